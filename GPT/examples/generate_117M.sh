@@ -0,0 +1,37 @@
+#! /bin/bash
+
+export PYTHONUNBUFFERED=1
+echo PYTHONUNBUFFERED=$PYTHONUNBUFFERED
+
+# checkpoint saved by train.py with the same model and parallel arguments
+CHECKPOINT=${1:-/path/to/checkpoint}
+# token ids of the prompt, comma-separated
+PROMPT=${2:-464,5044,318}
+SEQ_LEN=1024
+LAYER_NUM=12
+HIDDEN_SIZE=768
+HEAD_NUM=12
+MBZ=8
+GBZ=8
+TMP=1
+PMP=1
+
+SRC_DIR=$(realpath $(dirname "$0")/..)
+
+python3 $SRC_DIR/oneflow_gpt/generate.py \
+    --load $CHECKPOINT \
+    --prompt-tokens $PROMPT \
+    --max-new-tokens 64 \
+    --temperature 0.8 \
+    --top-p 0.9 \
+    --vocab-size 50257 \
+    --seq-length $SEQ_LEN \
+    --num-layers $LAYER_NUM \
+    --hidden-size $HIDDEN_SIZE \
+    --num-attention-heads $HEAD_NUM \
+    --micro-batch-size $MBZ \
+    --global-batch-size $GBZ \
+    --tensor-model-parallel-size $TMP \
+    --pipeline-model-parallel-size $PMP \
+    --num-gpus-per-node 1 \
+    --num-nodes 1
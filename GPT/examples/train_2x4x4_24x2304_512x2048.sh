@@ -46,6 +46,8 @@ python3 -m oneflow.distributed.launch \
         --num-accumulation-steps $ACC_STEPS \
         --tensor-model-parallel-size $TMP \
         --pipeline-model-parallel-size $PMP \
+        --pipeline-schedule interleaved \
+        --num-layers-per-virtual-pipeline-stage 3 \
         --checkpoint-activations \
         --num-gpus-per-node $DEVICE_NUM_PER_NODE \
         --num-nodes $NUM_NODES \
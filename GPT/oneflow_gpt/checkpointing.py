@@ -0,0 +1,174 @@
+from oneflow_gpt import distribute as dist
+from oneflow_gpt.config import get_args
+from oneflow_gpt.logger import print_rank_0
+
+# per-layer recompute modes:
+#   None: keep all activations of the layer
+#   "attention": recompute softmax(q * k.T) * v (CoreAttention) in backward
+#   "full": keep the layer input only and recompute the whole layer in backward
+NO_RECOMPUTE = None
+ATTENTION_RECOMPUTE = "attention"
+FULL_RECOMPUTE = "full"
+
+
+class LayerActivationMemory(object):
+    """
+    Activation bytes a transformer layer keeps for backward per micro-batch,
+    following the estimate of Korthikanti et al. (https://arxiv.org/abs/2205.05198)
+        full layer: s * b * h * (10 + 24 / t + 5 * a * s / (h * t))
+        attention scores, softmax and dropout: 5 * a * s * s * b / t
+        layer input only: 2 * s * b * h
+    for half precision activations, t is the tensor model parallel size. Sequence
+    parallelism divides the terms outside the tensor parallel region by t as well.
+    """
+
+    def __init__(self, args, tensor_model_parallel_size):
+        s = args.seq_length
+        b = args.micro_batch_size
+        h = args.hidden_size
+        a = args.num_attention_heads
+        t = tensor_model_parallel_size
+        # the estimate counts 2 bytes per element and 1 byte per dropout mask
+        scale = 1.0 if args.fp16 else 2.0
+
+        # sequence parallel splits layernorms, dropouts and residual adds as well
+        sp = t if args.sequence_parallel else 1
+
+        self.attention = scale * 5 * a * s * s * b / t
+        self.full = scale * s * b * h * (10 / sp + 24 / t) + self.attention
+        self.input = scale * 2 * s * b * h / sp
+
+    def retained(self, mode):
+        if mode == FULL_RECOMPUTE:
+            return self.input
+        elif mode == ATTENTION_RECOMPUTE:
+            return self.full - self.attention
+        else:
+            return self.full
+
+
+def _num_in_flight_micro_batches(stage, num_stages, num_micro_batches, num_chunks):
+    # 1f1b keeps (num_stages - stage) micro-batches in flight on a stage,
+    # interleaving adds the warmup of the extra model chunks
+    in_flight = num_stages - stage
+    if num_chunks > 1:
+        in_flight += (num_stages - 1) / num_chunks
+    return min(in_flight, num_micro_batches)
+
+
+def get_layer_recompute_modes():
+    """Returns the recompute mode of every transformer layer."""
+    args = get_args()
+    num_layers = args.num_layers
+    policy = args.checkpoint_policy
+
+    if policy == "none":
+        return [NO_RECOMPUTE] * num_layers
+    elif policy == "full":
+        return [FULL_RECOMPUTE] * num_layers
+    elif policy == "attention":
+        return [ATTENTION_RECOMPUTE] * num_layers
+    elif policy == "every-n":
+        n = args.checkpoint_every_n_layers
+        return [
+            FULL_RECOMPUTE if i % n == 0 else NO_RECOMPUTE for i in range(num_layers)
+        ]
+    elif policy == "memory-budget":
+        return _memory_budget_modes(args)
+    else:
+        raise NotImplementedError(f"unknown checkpoint policy {policy}")
+
+
+def _stage_layers_and_in_flight(args):
+    dist_util = dist.get_dist_util()
+    p = dist_util.pipeline_model_parallel_size
+    stage_layers = [[] for _ in range(p)]
+    for i in range(args.num_layers):
+        stage_layers[dist_util.get_layer_stage_id(i) % p].append(i)
+
+    in_flight = [
+        _num_in_flight_micro_batches(
+            stage, p, args.num_accumulation_steps, dist_util.num_model_chunks
+        )
+        for stage in range(p)
+    ]
+    return stage_layers, in_flight
+
+
+def _memory_budget_modes(args):
+    """
+    Recomputes as little as possible while the activations of every pipeline stage
+    fit into --checkpoint-memory-budget: the attention scores of the layers are
+    dropped first since they are the cheapest to recompute, then whole layers.
+    """
+    dist_util = dist.get_dist_util()
+    memory = LayerActivationMemory(args, dist_util.tensor_model_parallel_size)
+    budget = args.checkpoint_memory_budget * (1 << 30)
+    modes = [NO_RECOMPUTE] * args.num_layers
+
+    def stage_memory(layers, in_flight):
+        return in_flight * sum(memory.retained(modes[i]) for i in layers)
+
+    stage_layers, stage_in_flight = _stage_layers_and_in_flight(args)
+    for stage, (layers, in_flight) in enumerate(zip(stage_layers, stage_in_flight)):
+        for mode in (ATTENTION_RECOMPUTE, FULL_RECOMPUTE):
+            for i in layers:
+                if stage_memory(layers, in_flight) <= budget:
+                    break
+                modes[i] = mode
+
+        if stage_memory(layers, in_flight) > budget:
+            print_rank_0(
+                f"WARNING: activations of pipeline stage {stage} need"
+                f" {stage_memory(layers, in_flight) / (1 << 30):.2f} GiB with"
+                f" {_describe_modes([modes[i] for i in layers])},"
+                f" over the budget of {args.checkpoint_memory_budget} GiB"
+            )
+
+    return modes
+
+
+def _describe_modes(modes):
+    # e.g. "2 full, 2 attention recompute layers"
+    counts = [
+        (modes.count(mode), name)
+        for mode, name in (
+            (FULL_RECOMPUTE, "full"),
+            (ATTENTION_RECOMPUTE, "attention"),
+            (NO_RECOMPUTE, "no"),
+        )
+    ]
+    return ", ".join(f"{n} {name}" for n, name in counts if n > 0) + " recompute layers"
+
+
+def print_activation_memory(modes):
+    args = get_args()
+    dist_util = dist.get_dist_util()
+    memory = LayerActivationMemory(args, dist_util.tensor_model_parallel_size)
+    stage_layers, stage_in_flight = _stage_layers_and_in_flight(args)
+
+    print_rank_0(
+        f"> activation checkpointing policy: {args.checkpoint_policy},"
+        " estimated activation memory per micro-batch (MiB):"
+    )
+    print_rank_0(
+        "  {:>6} {:>6} {:>10} {:>10} {:>10}".format(
+            "layer", "stage", "recompute", "full", "retained"
+        )
+    )
+    for stage, (layers, in_flight) in enumerate(zip(stage_layers, stage_in_flight)):
+        for i in layers:
+            print_rank_0(
+                "  {:>6} {:>6} {:>10} {:>10.1f} {:>10.1f}".format(
+                    i,
+                    stage,
+                    modes[i] or "-",
+                    memory.full / (1 << 20),
+                    memory.retained(modes[i]) / (1 << 20),
+                )
+            )
+        total = in_flight * sum(memory.retained(modes[i]) for i in layers)
+        print_rank_0(
+            f"  stage {stage}: {in_flight:.1f} micro-batches in flight,"
+            f" {total / (1 << 30):.2f} GiB of layer activations"
+        )
@@ -29,6 +29,7 @@ def parse_args(ignore_unknown_args=False):
     parser = _add_distributed_args(parser)
     parser = _add_validation_args(parser)
     parser = _add_data_args(parser)
+    parser = _add_generation_args(parser)
     parser = _add_misc_args(parser)
 
     if ignore_unknown_args:
@@ -38,9 +39,14 @@ def parse_args(ignore_unknown_args=False):
 
     _check_model_size(args)
     _check_parallel_size(args)
+    _check_pipeline_schedule(args)
+    _check_checkpoint_policy(args)
+    _check_sequence_parallel(args)
     _check_batch_size(args)
-    _check_train_iters(args)
-    _check_lr_decay_and_warmup(args)
+    if args.prompt_tokens is None:
+        # generation does not use the training schedule
+        _check_train_iters(args)
+        _check_lr_decay_and_warmup(args)
 
     args.padded_vocab_size = _pad_vocab_size(
         args.vocab_size,
@@ -109,6 +115,59 @@ def _check_parallel_size(args):
     args.data_parallel_size = world_size // model_parallel_size
 
 
+def _check_pipeline_schedule(args):
+    if args.pipeline_schedule != "interleaved":
+        return
+
+    if args.pipeline_model_parallel_size <= 1:
+        raise ValueError(
+            "interleaved pipeline schedule requires pipeline model parallel size > 1"
+        )
+
+    if args.num_layers_per_virtual_pipeline_stage is None:
+        raise ValueError(
+            "num_layers_per_virtual_pipeline_stage must be set"
+            " when pipeline schedule is interleaved"
+        )
+
+    num_layers_per_stage = args.num_layers // args.pipeline_model_parallel_size
+    if num_layers_per_stage % args.num_layers_per_virtual_pipeline_stage != 0:
+        raise ValueError(
+            f"number of layers per pipeline stage {num_layers_per_stage} must be divisible by"
+            f" number of layers per virtual pipeline stage {args.num_layers_per_virtual_pipeline_stage}"
+        )
+
+
+def _check_checkpoint_policy(args):
+    if args.checkpoint_policy == "every-n" and args.checkpoint_every_n_layers < 1:
+        raise ValueError(
+            f"checkpoint_every_n_layers {args.checkpoint_every_n_layers} must be positive"
+        )
+
+    if (
+        args.checkpoint_policy == "memory-budget"
+        and args.checkpoint_memory_budget is None
+    ):
+        raise ValueError(
+            "checkpoint_memory_budget must be set when checkpoint policy is memory-budget"
+        )
+
+
+def _check_sequence_parallel(args):
+    if not args.sequence_parallel:
+        return
+
+    if args.tensor_model_parallel_size <= 1:
+        raise ValueError("sequence parallel requires tensor model parallel size > 1")
+
+    if args.seq_length % args.tensor_model_parallel_size != 0:
+        raise ValueError(
+            f"sequence length {args.seq_length} must be divisible by"
+            f" tensor model parallel size {args.tensor_model_parallel_size}"
+            " when sequence parallel is enabled"
+        )
+
+
 def _check_batch_size(args):
     if args.micro_batch_size is not None and args.global_batch_size is not None:
         if args.num_accumulation_steps is None:
@@ -353,6 +412,27 @@ def _add_training_args(parser):
         help="Checkpoint activation to allow for training "
         "with larger models, sequences, and batch sizes.",
     )
+    group.add_argument(
+        "--checkpoint-policy",
+        type=str,
+        default="full",
+        choices=["full", "none", "every-n", "attention", "memory-budget"],
+        help="Which activations to recompute in backward. full: every layer,"
+        " every-n: every n-th layer, attention: only the attention scores,"
+        " memory-budget: as little as possible within --checkpoint-memory-budget.",
+    )
+    group.add_argument(
+        "--checkpoint-every-n-layers",
+        type=int,
+        default=2,
+        help="Checkpoint one layer out of every n with the every-n policy.",
+    )
+    group.add_argument(
+        "--checkpoint-memory-budget",
+        type=float,
+        default=None,
+        help="Activation memory budget per GPU in GiB for the memory-budget policy.",
+    )
     group.add_argument(
         "--train-iters",
         type=int,
@@ -563,6 +643,28 @@ def _add_distributed_args(parser):
         default=1,
         help="Degree of pipeline model parallelism.",
     )
+    group.add_argument(
+        "--sequence-parallel",
+        action="store_true",
+        help="Split layernorms, dropouts and residual adds along the sequence"
+        " dimension in the tensor parallel group, replacing the all-reduce of"
+        " row parallel linears with reduce-scatter and all-gather.",
+    )
+    group.add_argument(
+        "--pipeline-schedule",
+        type=str,
+        default="1f1b",
+        choices=["1f1b", "interleaved"],
+        help="Pipeline schedule. 1f1b runs contiguous layer chunks on each stage,"
+        " interleaved assigns several non-contiguous chunks (virtual stages) to"
+        " each stage to shrink the pipeline bubble.",
+    )
+    group.add_argument(
+        "--num-layers-per-virtual-pipeline-stage",
+        type=int,
+        default=None,
+        help="Number of layers in each chunk of the interleaved pipeline schedule.",
+    )
     group.add_argument(
         "--num-gpus-per-node",
         type=int,
@@ -617,6 +719,50 @@ def _add_data_args(parser):
     return parser
 
 
+def _add_generation_args(parser):
+    group = parser.add_argument_group(title="generation")
+
+    group.add_argument(
+        "--prompt-tokens",
+        type=_int_list,
+        default=None,
+        help="Comma-separated token ids of the prompt generate.py continues.",
+    )
+    group.add_argument(
+        "--num-samples",
+        type=int,
+        default=None,
+        help="Number of continuations of the prompt, a multiple of the data parallel"
+        " size. Defaults to the data parallel size.",
+    )
+    group.add_argument(
+        "--max-new-tokens",
+        type=int,
+        default=32,
+        help="Number of tokens generated after the prompt.",
+    )
+    group.add_argument(
+        "--temperature",
+        type=float,
+        default=1.0,
+        help="Sampling temperature, 0 means greedy decoding.",
+    )
+    group.add_argument(
+        "--top-k",
+        type=int,
+        default=0,
+        help="Sample from the k most likely tokens only, 0 disables it.",
+    )
+    group.add_argument(
+        "--top-p",
+        type=float,
+        default=0.0,
+        help="Sample from the most likely tokens whose cumulative probability"
+        " reaches top-p (nucleus sampling), 0 disables it.",
+    )
+    return parser
+
+
 def _add_misc_args(parser):
     group = parser.add_argument_group(title="misc")
     group.add_argument(
@@ -1,3 +1,8 @@
+import os
+import socket
+import struct
+
+import numpy as np
 import oneflow as flow
 
 from oneflow_gpt.config import get_args
@@ -11,24 +16,29 @@ class GPTDataLoader(flow.nn.Module):
         assert args.dataset is not None
 
         batch_size = args.global_batch_size // args.num_accumulation_steps
-        self.reader = flow.nn.GPTIndexedBinDataReader(
-            data_file_prefix=args.dataset,
-            seq_length=args.seq_length,
-            num_samples=args.train_samples,
-            batch_size=batch_size,
-            dtype=flow.int64,
-            shuffle=True,
-            random_seed=args.seed,
-            split_sizes=args.split,
-            split_index=0,
-            placement=dist.get_layer_placement(0, "cpu"),
-            sbp=dist.get_nd_sbp([flow.sbp.split(0), flow.sbp.broadcast]),
-        )
+        if args.use_external_dataset:
+            # samples are read on the host by ExternalBatchReader and fed to forward
+            self.reader = None
+        else:
+            self.reader = flow.nn.GPTIndexedBinDataReader(
+                data_file_prefix=args.dataset,
+                seq_length=args.seq_length,
+                num_samples=args.train_samples,
+                batch_size=batch_size,
+                dtype=flow.int64,
+                shuffle=True,
+                random_seed=args.seed,
+                split_sizes=args.split,
+                split_index=0,
+                placement=dist.get_layer_placement(0, "cpu"),
+                sbp=dist.get_nd_sbp([flow.sbp.split(0), flow.sbp.broadcast]),
+            )
         self.data_decoder = DataDecoder()
         self.label_decoder = LabelDecoder()
 
-    def forward(self):
-        tokens = self.reader()
+    def forward(self, tokens=None):
+        if tokens is None:
+            tokens = self.reader()
         data = self.data_decoder(tokens)
         labels = self.label_decoder(tokens)
         return data, labels
@@ -50,3 +60,235 @@ class LabelDecoder(flow.nn.Module):
     def forward(self, tokens):
         assert tokens.ndim == 2
         return tokens.to_consistent(placement=dist.get_layer_placement(-1))[:, 1:]
+
+
+_INDEX_HEADER = b"MMIDIDX\x00\x00"
+_INDEX_VERSION = 1
+_DTYPES = {
+    1: np.uint8,
+    2: np.int8,
+    3: np.int16,
+    4: np.int32,
+    5: np.int64,
+    6: np.float32,
+    7: np.float64,
+    8: np.uint16,
+}
+
+
+def _dtype_code(dtype):
+    for code, d in _DTYPES.items():
+        if d == dtype:
+            return code
+    raise ValueError(f"unsupported dtype {dtype}")
+
+
+def best_fitting_dtype(vocab_size):
+    return np.uint16 if vocab_size < 65500 else np.int32
+
+
+class MMapIndexedDatasetBuilder(object):
+    """
+    Writes documents of token ids into the .bin/.idx pair read by
+    flow.nn.GPTIndexedBinDataReader (the Megatron-LM mmap indexed dataset format).
+    """
+
+    def __init__(self, bin_path, dtype=np.uint16):
+        self._file = open(bin_path, "wb")
+        self._dtype = dtype
+        self._sizes = []
+        self._doc_idx = [0]
+
+    def add_document(self, tokens):
+        tokens = np.asarray(tokens, dtype=self._dtype)
+        self._file.write(tokens.tobytes(order="C"))
+        self._sizes.append(tokens.size)
+        self._doc_idx.append(len(self._sizes))
+
+    def finalize(self, idx_path):
+        self._file.close()
+
+        sizes = np.array(self._sizes, dtype=np.int32)
+        pointers = np.zeros(len(sizes), dtype=np.int64)
+        np.cumsum(sizes[:-1] * np.dtype(self._dtype).itemsize, out=pointers[1:])
+        doc_idx = np.array(self._doc_idx, dtype=np.int64)
+
+        with open(idx_path, "wb") as f:
+            f.write(_INDEX_HEADER)
+            f.write(struct.pack("<Q", _INDEX_VERSION))
+            f.write(struct.pack("<B", _dtype_code(self._dtype)))
+            f.write(struct.pack("<Q", len(sizes)))
+            f.write(struct.pack("<Q", len(doc_idx)))
+            f.write(sizes.tobytes(order="C"))
+            f.write(pointers.tobytes(order="C"))
+            f.write(doc_idx.tobytes(order="C"))
+
+
+class MMapIndexedDataset(object):
+    def __init__(self, prefix):
+        idx_path = prefix + ".idx"
+        with open(idx_path, "rb") as f:
+            header = f.read(len(_INDEX_HEADER))
+            if header != _INDEX_HEADER:
+                raise ValueError(f"{idx_path} is not a mmap indexed dataset index")
+            (version,) = struct.unpack("<Q", f.read(8))
+            assert version == _INDEX_VERSION
+            (dtype_code,) = struct.unpack("<B", f.read(1))
+            (num_sequences,) = struct.unpack("<Q", f.read(8))
+            (num_docs,) = struct.unpack("<Q", f.read(8))
+            offset = f.tell()
+
+        self.dtype = _DTYPES[dtype_code]
+        self._index = np.memmap(idx_path, mode="r", order="C")
+        self.sizes = np.frombuffer(
+            self._index, dtype=np.int32, count=num_sequences, offset=offset
+        )
+        offset += self.sizes.nbytes
+        self.pointers = np.frombuffer(
+            self._index, dtype=np.int64, count=num_sequences, offset=offset
+        )
+        offset += self.pointers.nbytes
+        self.doc_idx = np.frombuffer(
+            self._index, dtype=np.int64, count=num_docs, offset=offset
+        )
+        self._bin = np.memmap(prefix + ".bin", mode="r", order="C")
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def get(self, idx, offset=0, length=None):
+        if length is None:
+            length = self.sizes[idx] - offset
+        ptr = self.pointers[idx] + offset * np.dtype(self.dtype).itemsize
+        return np.frombuffer(self._bin, dtype=self.dtype, count=length, offset=ptr)
+
+
+def _save_index(path, array):
+    # written under a temporary name so that ranks building the same index
+    # concurrently never read a partial file, pids alone can collide across the
+    # nodes of a shared file system
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def _build_sample_idx(sizes, doc_idx, seq_length, num_samples):
+    """
+    sample_idx[i] = (position in doc_idx, token offset) of the first token of sample
+    i, sample i spans the tokens up to and including the first token of sample i + 1.
+    """
+    doc_sizes = sizes[doc_idx].astype(np.int64)
+    doc_ends = np.cumsum(doc_sizes)
+    starts = np.arange(num_samples + 1, dtype=np.int64) * seq_length
+    positions = np.searchsorted(doc_ends, starts, side="right")
+    offsets = starts - (doc_ends[positions] - doc_sizes[positions])
+    return np.stack([positions, offsets], axis=1)
+
+
+def build_index_mappings(name, prefix, documents, sizes, num_samples, seq_length, seed):
+    """
+    Builds the doc/sample/shuffle indices of a split once and caches them next to
+    the dataset, later launches only memory-map the .npy files.
+    """
+    stem = f"{prefix}_{name}_indexmap_{num_samples}ns_{seq_length}sl_{seed}s"
+    paths = [f"{stem}_{key}_idx.npy" for key in ("doc", "sample", "shuffle")]
+
+    if not all(os.path.isfile(path) for path in paths):
+        tokens_per_epoch = int(sizes[documents].sum())
+        num_epochs = -(-(num_samples * seq_length + 1) // tokens_per_epoch)
+        rng = np.random.RandomState(seed)
+        doc_idx = np.concatenate(
+            [rng.permutation(documents) for _ in range(num_epochs)]
+        ).astype(np.int64)
+        sample_idx = _build_sample_idx(sizes, doc_idx, seq_length, num_samples)
+        shuffle_idx = rng.permutation(num_samples).astype(np.int64)
+        for path, array in zip(paths, (doc_idx, sample_idx, shuffle_idx)):
+            _save_index(path, array)
+
+    return [np.load(path, mmap_mode="r") for path in paths]
+
+
+class GPTDataset(object):
+    """Samples of seq_length + 1 tokens drawn from the documents of an indexed dataset."""
+
+    def __init__(
+        self, name, prefix, indexed_dataset, documents, num_samples, seq_length, seed
+    ):
+        self.indexed_dataset = indexed_dataset
+        self.num_samples = num_samples
+        self.doc_idx, self.sample_idx, self.shuffle_idx = build_index_mappings(
+            name,
+            prefix,
+            documents,
+            indexed_dataset.sizes,
+            num_samples,
+            seq_length,
+            seed,
+        )
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, idx):
+        idx = self.shuffle_idx[idx]
+        doc_f, offset_f = self.sample_idx[idx]
+        doc_l, offset_l = self.sample_idx[idx + 1]
+        if doc_f == doc_l:
+            return self.indexed_dataset.get(
+                self.doc_idx[doc_f], offset_f, offset_l - offset_f + 1
+            )
+
+        parts = [self.indexed_dataset.get(self.doc_idx[doc_f], offset_f)]
+        for i in range(doc_f + 1, doc_l):
+            parts.append(self.indexed_dataset.get(self.doc_idx[i]))
+        parts.append(self.indexed_dataset.get(self.doc_idx[doc_l], 0, offset_l + 1))
+        return np.concatenate(parts)
+
+
+def get_split_documents(num_docs, split, split_index):
+    bounds = np.cumsum([0] + list(split)) / sum(split)
+    bounds = np.round(bounds * num_docs).astype(np.int64)
+    return np.arange(bounds[split_index], bounds[split_index + 1], dtype=np.int64)
+
+
+class ExternalBatchReader(object):
+    """
+    Reads the training samples on the host for --use-external-dataset, the batches
+    are fed to GPTDataLoader as graph inputs.
+    """
+
+    def __init__(self):
+        args = get_args()
+        assert args.dataset is not None
+        self.batch_size = args.global_batch_size // args.num_accumulation_steps
+
+        indexed_dataset = MMapIndexedDataset(args.dataset)
+        documents = get_split_documents(len(indexed_dataset), args.split, 0)
+        self.dataset = GPTDataset(
+            "train",
+            args.dataset,
+            indexed_dataset,
+            documents,
+            args.train_samples,
+            args.seq_length,
+            args.seed,
+        )
+        self.consumed_samples = 0
+
+    def __call__(self):
+        start = self.consumed_samples
+        tokens = np.stack(
+            [self.dataset[i] for i in range(start, start + self.batch_size)]
+        ).astype(np.int64)
+        self.consumed_samples += self.batch_size
+
+        tokens = flow.tensor(
+            tokens,
+            dtype=flow.int64,
+            placement=dist.get_layer_placement(0, "cpu"),
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+        )
+        return tokens.to_consistent(
+            sbp=dist.get_nd_sbp([flow.sbp.split(0), flow.sbp.broadcast])
+        )
@@ -1,6 +1,7 @@
 import oneflow as flow
 
 from oneflow_gpt.config import get_args
+from oneflow_gpt.logger import print_rank_0
 
 _DIST_UTIL = None
 
@@ -63,13 +64,23 @@ class _DistributeUtil(object):
             f"number of layers ({args.num_layers}) is not divisible by"
             f" pipeline model parallel size ({self.pmp_size_})"
         )
-        num_layers_per_stage = args.num_layers // self.pmp_size_
+        self.pipeline_schedule_ = args.pipeline_schedule
+        if self.pipeline_schedule_ == "interleaved":
+            # every stage holds several non-contiguous chunks of layers,
+            # chunk i (virtual stage i) runs on stage i % pmp_size
+            num_layers_per_chunk = args.num_layers_per_virtual_pipeline_stage
+        else:
+            num_layers_per_chunk = args.num_layers // self.pmp_size_
+        self.num_virtual_stages_ = args.num_layers // num_layers_per_chunk
 
+        # the stage id of a layer is its position in the pipeline (virtual stage),
+        # which keeps stage ids increasing along the forward pass
         self.layers_stage_ids_ = [
-            i // num_layers_per_stage for i in range(args.num_layers)
+            i // num_layers_per_chunk for i in range(args.num_layers)
         ]
         self.layers_devices_ = [
-            stages_devices[stage_id] for stage_id in self.layers_stage_ids_
+            stages_devices[stage_id % self.pmp_size_]
+            for stage_id in self.layers_stage_ids_
         ]
 
     def _init_parallel_hierarchy(self):
@@ -98,6 +109,15 @@ class _DistributeUtil(object):
     def data_parallel_size(self):
         return self.dp_size_
 
+    @property
+    def pipeline_schedule(self):
+        return self.pipeline_schedule_
+
+    @property
+    def num_model_chunks(self):
+        """Number of layer chunks (virtual stages) on each pipeline stage."""
+        return self.num_virtual_stages_ // self.pmp_size_
+
     def get_layer_devices(self, layer_idx):
         return self.layers_devices_[layer_idx]
 
@@ -127,6 +147,53 @@ def get_dist_util():
     return _DIST_UTIL
 
 
+def pipeline_bubble_ratio(num_stages, num_micro_batches, num_model_chunks=1):
+    """
+    Fraction of a training step a pipeline stage is idle. The fill and drain of
+    the pipeline take (num_stages - 1) micro-batch slots, which shrink by the
+    number of model chunks per stage with the interleaved schedule.
+    """
+    bubble = (num_stages - 1) / num_model_chunks
+    return bubble / (num_micro_batches + bubble)
+
+
+def print_pipeline_schedule():
+    args = get_args()
+    dist_util = get_dist_util()
+    p = dist_util.pipeline_model_parallel_size
+    m = args.num_accumulation_steps
+    v = dist_util.num_model_chunks
+    if p == 1:
+        return
+
+    # (schedule, model chunks per stage, micro-batch activations held by the first
+    # stage at peak). gpipe is listed as a baseline only, the graph runtime starts
+    # every backward pass as soon as its inputs are ready.
+    schedules = [
+        ("gpipe", 1, m),
+        ("1f1b", 1, min(p, m)),
+        ("interleaved", v, min(p + (p - 1) / v, m)),
+    ]
+    print_rank_0(
+        f"> pipeline schedule: {dist_util.pipeline_schedule},"
+        f" {p} stages, {m} micro-batches, {v} model chunks per stage"
+    )
+    print_rank_0(
+        "  {:<12} {:>8} {:>16} {:>14}".format(
+            "schedule", "chunks", "peak activations", "bubble ratio"
+        )
+    )
+    for name, chunks, in_flight in schedules:
+        if name == "interleaved" and v == 1:
+            continue
+        mark = "*" if name == dist_util.pipeline_schedule else " "
+        print_rank_0(
+            "{} {:<12} {:>8} {:>16.1f} {:>14.2%}".format(
+                mark, name, chunks, in_flight, pipeline_bubble_ratio(p, m, chunks),
+            )
+        )
+
+
 def get_layer_placement(layer_idx, device_type="cuda"):
     dist_util = get_dist_util()
     return flow.placement(
@@ -156,3 +223,8 @@ def get_nd_sbp(sbp_list):
 
 def get_hidden_sbp():
     return get_nd_sbp([flow.sbp.split(0), flow.sbp.broadcast])
+
+
+def get_sequence_parallel_sbp(seq_dim):
+    """Hidden states split along the sequence dimension in the tensor parallel group."""
+    return get_nd_sbp([flow.sbp.split(0), flow.sbp.split(seq_dim)])
@@ -0,0 +1,130 @@
+import os
+import sys
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+)
+
+import oneflow as flow
+
+from oneflow_gpt import distribute as dist
+from oneflow_gpt.config import get_args
+from oneflow_gpt.logger import print_rank_0
+from oneflow_gpt.model import GPTModel, KVCache
+
+
+def generate(model, tokens, max_new_tokens, temperature=1.0, top_k=0, top_p=0.0):
+    """
+    Auto-regressive decoding with per-layer key/value caches: the prompt is run
+    through the model once, after that every step only feeds the newest token.
+
+    tokens: prompt token ids, shape (batch_size, prompt_length),
+        placement: dist.get_layer_placement(0), sbp: [S(0), B]
+    temperature: logits are divided by it, 0 means greedy decoding.
+    top_k > 0: keep only the k most likely tokens.
+    top_p > 0.0: keep the most likely tokens whose cumulative probability reaches
+        top_p (nucleus sampling, Holtzman et al. http://arxiv.org/abs/1904.09751).
+    returns: prompt + generated token ids, shape (batch_size, prompt_length + max_new_tokens)
+
+    The model is expected to be in eval mode (no dropout).
+    """
+    args = get_args()
+    assert tokens.ndim == 2
+    batch_size, prompt_length = tokens.shape
+    cache = KVCache(batch_size, prompt_length + max_new_tokens)
+
+    outputs = [tokens]
+    next_tokens = tokens
+    with flow.no_grad():
+        for _ in range(max_new_tokens):
+            logits = model(next_tokens, cache=cache)
+            # logits sbp: [S(0), S(1)] -> [S(0), B], sampling needs the whole vocab
+            logits = logits[:, -1].to_consistent(sbp=dist.get_hidden_sbp())
+            # padded vocab entries are never generated
+            logits = logits[:, : args.vocab_size]
+            next_tokens = sample(logits, temperature, top_k, top_p).unsqueeze(-1)
+            next_tokens = next_tokens.to_consistent(
+                placement=dist.get_layer_placement(0), sbp=dist.get_hidden_sbp()
+            )
+            outputs.append(next_tokens)
+
+    return flow.cat(outputs, dim=1)
+
+
+def greedy_generate(model, tokens, max_new_tokens):
+    return generate(model, tokens, max_new_tokens, temperature=0)
+
+
+def sample(logits, temperature=1.0, top_k=0, top_p=0.0):
+    """
+    Draws one token id per row of logits, shape (batch_size, vocab_size), sbp: [S(0), B].
+    The uniform draws are consistent tensors of the same sbp, so all tensor parallel
+    ranks of a row pick the same token.
+    """
+    if temperature == 0 or top_k == 1:
+        return logits.argmax(-1)
+    logits = logits / temperature
+
+    if 0 < top_k < logits.shape[-1]:
+        values, indices = flow.topk(logits, top_k, dim=-1)
+    else:
+        values, indices = flow.sort(logits, dim=-1, descending=True)
+    probs = flow.softmax(values, dim=-1)
+    if top_p > 0.0:
+        # exclusive cumulative sum keeps the first token above the threshold as well
+        to_remove = (flow.cumsum(probs, dim=-1) - probs) > top_p
+        probs = probs.masked_fill(to_remove, 0.0)
+
+    # inverse transform sampling, the draw is scaled by the total the CDF reaches at
+    # the last kept token so rounding never selects a removed one
+    cdf = flow.cumsum(probs, dim=-1)
+    u = (
+        flow.rand(logits.shape[0], 1, placement=logits.placement, sbp=logits.sbp)
+        * cdf[:, -1:]
+    )
+    choice = (cdf < u).to(flow.int64).sum(-1, keepdim=True)
+    return flow.gather(indices, 1, choice).squeeze(-1)
+
+
+def main():
+    args = get_args()
+    assert args.prompt_tokens, "--prompt-tokens is required"
+    flow.manual_seed(args.seed)
+
+    model = GPTModel()
+    if args.checkpoint_load_path is not None:
+        print_rank_0(f"Loading model from {args.checkpoint_load_path}")
+        state_dict = flow.load(args.checkpoint_load_path, consistent_src_rank=0)
+        model.load_state_dict(state_dict)
+    model.eval()
+
+    dp_size = dist.get_dist_util().data_parallel_size
+    num_samples = args.num_samples or dp_size
+    assert num_samples % dp_size == 0, (
+        f"num_samples ({num_samples}) is not divisible by"
+        f" data parallel size ({dp_size})"
+    )
+    broadcast = dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast])
+    tokens = flow.tensor(
+        [args.prompt_tokens] * num_samples,
+        dtype=flow.int64,
+        placement=dist.get_layer_placement(0),
+        sbp=broadcast,
+    ).to_consistent(sbp=dist.get_hidden_sbp())
+
+    outputs = generate(
+        model,
+        tokens,
+        args.max_new_tokens,
+        temperature=args.temperature,
+        top_k=args.top_k,
+        top_p=args.top_p,
+    )
+    outputs = outputs.to_consistent(sbp=broadcast).to_local()
+    if flow.env.get_rank() == 0:
+        for ids in outputs.numpy().tolist():
+            print(",".join(map(str, ids)))
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,7 @@ class GPTModel(flow.nn.Module):
         self.batch_size = args.global_batch_size // args.num_accumulation_steps
         self.seq_length = args.seq_length
         self.hidden_size = args.hidden_size
+        self.sequence_parallel = args.sequence_parallel
 
         self.embedding = Embedding(
             self.seq_length, self.hidden_size, args.padded_vocab_size
@@ -20,10 +21,22 @@ class GPTModel(flow.nn.Module):
         self.transformer = Transformer(self.hidden_size)
         self.logits = Logits()
 
-    def forward(self, tokens):
+    def forward(self, tokens, cache=None):
         # tokens shape: (batch_size, seq_length)
         # sbp: [S(0), B]
         assert tokens.ndim == 2
+        if cache is not None:
+            # incremental decoding, tokens are the positions following the cache
+            assert (
+                not self.sequence_parallel
+            ), "sequence parallel is a training only mode"
+            assert tokens.shape[0] == cache.batch_size
+            assert cache.length + tokens.shape[1] <= cache.max_length
+            hidden_states = self.embedding(tokens, past_length=cache.length)
+            h = self.transformer(hidden_states, cache=cache)
+            cache.advance(tokens.shape[1])
+            return self.logits(h, self.embedding.wte)
+
         assert tokens.shape[0] == self.batch_size
         assert tokens.shape[1] == self.seq_length
 
@@ -36,6 +49,70 @@ class GPTModel(flow.nn.Module):
         return self.logits(h, self.embedding.wte)
 
 
+class LayerKVCache(object):
+    """
+    Preallocated key/value buffers of one layer,
+        shape: (batch_size, num_heads, max_length, head_size)
+        sbp: [S(0), S(1)], the same as k, v produced by `SelfAttention.query_key_value`,
+        so each tensor parallel rank only keeps the heads it computes.
+    """
+
+    def __init__(self, cache, layer_idx, num_heads, head_size, dtype):
+        self.cache = cache
+        shape = (cache.batch_size, num_heads, cache.max_length, head_size)
+        placement = dist.get_layer_placement(layer_idx)
+        sbp = dist.get_nd_sbp([flow.sbp.split(0), flow.sbp.split(1)])
+        self.key = flow.zeros(shape, dtype=dtype, placement=placement, sbp=sbp)
+        self.value = flow.zeros(shape, dtype=dtype, placement=placement, sbp=sbp)
+
+    @property
+    def past_length(self):
+        return self.cache.length
+
+    def update(self, key, value):
+        """
+        Writes k, v of the new positions in place and returns k, v of all the
+        positions seen so far.
+        """
+        start = self.cache.length
+        end = start + key.shape[2]
+        self.key[:, :, start:end] = key
+        self.value[:, :, start:end] = value
+        return self.key[:, :, :end], self.value[:, :, :end]
+
+
+class KVCache(object):
+    """
+    Per-layer key/value caches for auto-regressive inference, so that every decode
+    step only runs the new tokens through the layers.
+    """
+
+    def __init__(self, batch_size, max_length=None, dtype=flow.float32):
+        args = get_args()
+        self.batch_size = batch_size
+        self.max_length = max_length or args.seq_length
+        assert self.max_length <= args.seq_length
+        self.length = 0
+
+        head_size = args.hidden_size // args.num_attention_heads
+        self.layers = [
+            LayerKVCache(self, i, args.num_attention_heads, head_size, dtype)
+            for i in range(args.num_layers)
+        ]
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __getitem__(self, layer_idx):
+        return self.layers[layer_idx]
+
+    def advance(self, num_tokens):
+        self.length += num_tokens
+
+    def reset(self):
+        self.length = 0
+
+
 class Logits(flow.nn.Module):
     def __init__(self):
         super().__init__()
@@ -63,6 +140,7 @@ class Embedding(flow.nn.Module):
         args = get_args()
         self.dropout = flow.nn.Dropout(p=args.hidden_dropout)
         self.enable_amp = args.fp16
+        self.sequence_parallel = args.sequence_parallel
 
         # word token embedding shape (vocab_size, hidden_size)
         # sbp: [B, S(0)]
@@ -89,11 +167,11 @@ class Embedding(flow.nn.Module):
         flow.nn.init.normal_(self.wte, std=args.init_method_std)
         flow.nn.init.normal_(self.wpe, std=args.init_method_std)
 
-    def forward(self, tokens):
+    def forward(self, tokens, past_length=0):
         # tokens shape: (batch_size, seq_len)
         # sbp: [S(0), B]
         assert tokens.ndim == 2
-        assert tokens.shape[-1] == self.seq_length
+        assert past_length + tokens.shape[-1] <= self.seq_length
 
         if self.enable_amp:
             wte = flow._C.amp_white_identity(self.wte)
@@ -102,6 +180,10 @@ class Embedding(flow.nn.Module):
             wte = self.wte
             wpe = self.wpe
 
+        if tokens.shape[-1] != self.seq_length:
+            # positions of the tokens fed to an incremental decoding step
+            wpe = wpe[past_length : past_length + tokens.shape[-1]]
+
         # wte.grad: [P, S(0)]  -> [B, S(0)]
         # wte = wte.to_consistent(grad_sbp=self.wte.sbp)
         # gather forward sbp sign: [B, S(0)] x [S(0), B] -> [S(0), P]
@@ -109,8 +191,13 @@ class Embedding(flow.nn.Module):
         # [S(0), B] (h.grad) x [S(0), B] (tokens) x [B, S(0)] (wte) -> [P, S(0)] (wte.grad)
         h = flow._C.gather(wte, tokens, axis=0)
         # hidden_states shape: (batch_size, sel_len, hidden_size)
-        # hidden_states: [S(0), P] -> [S(0), B]
-        h = h.to_consistent(sbp=dist.get_hidden_sbp())
+        if self.sequence_parallel:
+            # hidden_states: [S(0), P] -> [S(0), S(1)] (reduce-scatter),
+            # the dropout below only runs on the local part of the sequence
+            h = h.to_consistent(sbp=dist.get_sequence_parallel_sbp(seq_dim=1))
+        else:
+            # hidden_states: [S(0), P] -> [S(0), B]
+            h = h.to_consistent(sbp=dist.get_hidden_sbp())
         # (h + self.wpe) will apply broadcast_add,
         # shape sign: (batch_size, sel_len, hidden_size) + (sel_len, hidden_size)
         #         -> (batch_size, sel_len, hidden_size)
@@ -145,6 +232,7 @@ class Transformer(flow.nn.Module):
         args = get_args()
         self.is_seq_len_dim_leading = True if args.multihead_attention_fusion else False
         self.num_layers = args.num_layers
+        self.sequence_parallel = args.sequence_parallel
 
         self._build_layers(args.init_method_std)
         self.layernorm_f = LayerNorm(-1, (self.hidden_size,))
@@ -171,7 +259,7 @@ class Transformer(flow.nn.Module):
         checkpoint = getattr(self, f"layer_checkpoint_{layer_idx}")
         return layer, checkpoint
 
-    def forward(self, hidden_states):
+    def forward(self, hidden_states, cache=None):
         # hidden_states shape: (batch_size, seq_length, hidden_size)
         # sbp: [S(0), B]
         assert hidden_states.ndim == 3
@@ -182,11 +270,23 @@ class Transformer(flow.nn.Module):
         else:
             h = hidden_states
 
+        if self.sequence_parallel:
+            # layernorms, dropouts and residual adds between the tensor parallel
+            # linears run on hidden states split along the sequence dimension
+            seq_dim = 0 if self.is_seq_len_dim_leading else 1
+            h = h.to_consistent(sbp=dist.get_sequence_parallel_sbp(seq_dim))
+
         for i in range(self.num_layers):
             layer, checkpoint = self._get_layer(i)
-            h = layer(checkpoint(h))
+            if cache is None:
+                h = layer(checkpoint(h))
+            else:
+                h = layer(checkpoint(h), cache[i])
 
         h = self.layernorm_f(h)
+        if self.sequence_parallel:
+            # [S(0), S(seq_dim)] -> [S(0), B] (all-gather)
+            h = h.to_consistent(sbp=dist.get_hidden_sbp())
 
         assert h.ndim == 3
         if self.is_seq_len_dim_leading:
@@ -238,7 +338,7 @@ class TransformerLayer(flow.nn.Module):
         self.layernorm_1 = LayerNorm(layer_idx, (self.hidden_size,))
         self.layernorm_2 = LayerNorm(layer_idx, (self.hidden_size,))
 
-    def forward(self, hidden_states):
+    def forward(self, hidden_states, layer_cache=None):
         # hidden_states shape: (batch_size, seq_length, hidden_size)
         # sbp: [S(0), B]
         assert hidden_states.ndim == 3
@@ -246,7 +346,7 @@ class TransformerLayer(flow.nn.Module):
         h = hidden_states
 
         norm1 = self.layernorm_1(h)
-        h = h + self.attn(norm1)
+        h = h + self.attn(norm1, layer_cache)
 
         norm2 = self.layernorm_2(h)
         h = h + self.mlp(norm2)
@@ -268,6 +368,59 @@ class SelfAttention(flow.nn.Module):
         self.hidden_size = hidden_size
         self.is_seq_len_dim_leading = is_seq_len_dim_leading
 
+        self.c_attn = ColumnParallelLinear(
+            layer_idx, self.hidden_size, self.hidden_size * 3, init_method,
+        )
+
+        self.core_attn = CoreAttention(layer_idx, is_seq_len_dim_leading)
+
+        self.c_proj = RowParallelLinear(
+            layer_idx,
+            self.hidden_size,
+            self.hidden_size,
+            output_layer_init_method,
+            dropout_rate=hidden_dropout_rate,
+        )
+
+    def forward(self, hidden_states, layer_cache=None):
+        # hidden_states shape: (batch_size, seq_len, hidden_size)
+        # or (seq_len, batch_size, hidden_size) [seq_len dim leading]
+        # sbp: [S(0), B]
+        assert hidden_states.shape[-1] == self.hidden_size
+
+        h = self.c_attn(hidden_states)
+
+        if layer_cache is not None:
+            q, k, v = self.core_attn.query_key_value(h)
+            past_length = layer_cache.past_length
+            k, v = layer_cache.update(k, v)
+            h = self.core_attn.cached_multihead_attn(q, k, v, past_length)
+        else:
+            h = self.core_attn(h)
+
+        if self.is_seq_len_dim_leading:
+            # (batch_size, num_heads, seq_len, head_size) -> (seq_len, batch_size, num_heads, head_size)
+            h = flow._C.transpose(h, perm=(2, 0, 1, 3))
+        else:
+            # (batch_size, num_heads, seq_len, head_size) -> (batch_size, seq_len, num_heads, head_size)
+            h = flow._C.transpose(h, perm=(0, 2, 1, 3))
+
+        h = self.c_proj(h.flatten(2))
+        return h
+
+
+class CoreAttention(flow.nn.Module):
+    """
+    softmax(q * k.T) * v of all heads, a module of its own so that the
+    (seq_length, seq_length) attention scores can be recomputed in backward
+    without checkpointing the whole layer.
+    """
+
+    def __init__(self, layer_idx, is_seq_len_dim_leading):
+        super().__init__()
+        self.layer_idx = layer_idx
+        self.is_seq_len_dim_leading = is_seq_len_dim_leading
+
         args = get_args()
         self.num_heads = args.num_attention_heads
         self.head_size = args.hidden_size // args.num_attention_heads
@@ -284,18 +437,6 @@ class SelfAttention(flow.nn.Module):
             self.coeff = float(layer_idx + 1)
             self.norm_factor *= self.coeff
 
-        self.c_attn = ColumnParallelLinear(
-            layer_idx, self.hidden_size, self.hidden_size * 3, init_method,
-        )
-
-        self.c_proj = RowParallelLinear(
-            layer_idx,
-            self.hidden_size,
-            self.hidden_size,
-            output_layer_init_method,
-            dropout_rate=hidden_dropout_rate,
-        )
-
     def query_key_value(self, h):
         """
         Split input to q, k, v and split hidden states into heads,
@@ -358,6 +499,17 @@ class SelfAttention(flow.nn.Module):
 
         return x
 
+    def cached_multihead_attn(self, q, k, v, past_length):
+        # q shape: (b, n, s, h), k, v shape: (b, n, past_length + s, h)
+        # query i attends to keys 0 ... past_length + i,
+        # so the causal mask is the lower triangle shifted by past_length
+        qmk = flow._C.matmul(q, k, transpose_b=True, alpha=(1.0 / self.norm_factor))
+        qmk = flow._C.fused_scale_tril(
+            qmk, diagonal=past_length, fill_value=float("-inf"), scale=self.coeff
+        )
+        qmk = flow._C.softmax(qmk, dim=qmk.ndim - 1)
+        return flow._C.matmul(qmk, v)
+
     def fused_multihead_attn(self, h):
         qmk, v = flow._C.fused_self_attention_query_mul_key_and_value(
             h, head_size=self.head_size, alpha=(1.0 / self.norm_factor)
@@ -365,29 +517,14 @@ class SelfAttention(flow.nn.Module):
         qmk = self.tril_softmax_dropout(qmk)
         return flow._C.matmul(qmk, v)
 
-    def forward(self, hidden_states):
-        # hidden_states shape: (batch_size, seq_len, hidden_size)
-        # or (seq_len, batch_size, hidden_size) [seq_len dim leading]
-        # sbp: [S(0), B]
-        assert hidden_states.shape[-1] == self.hidden_size
-
-        h = self.c_attn(hidden_states)
-
+    def forward(self, h):
+        # h is the output of c_attn, q, k, v of all heads
+        # returns shape: (batch_size, num_heads, seq_len, head_size)
         if self.multihead_attention_fusion and self.is_seq_len_dim_leading:
-            h = self.fused_multihead_attn(h)
-        else:
-            q, k, v = self.query_key_value(h)
-            h = self.multihead_attn(q, k, v)
-
-        if self.is_seq_len_dim_leading:
-            # (batch_size, num_heads, seq_len, head_size) -> (seq_len, batch_size, num_heads, head_size)
-            h = flow._C.transpose(h, perm=(2, 0, 1, 3))
-        else:
-            # (batch_size, num_heads, seq_len, head_size) -> (batch_size, seq_len, num_heads, head_size)
-            h = flow._C.transpose(h, perm=(0, 2, 1, 3))
+            return self.fused_multihead_attn(h)
 
-        h = self.c_proj(h.flatten(2))
-        return h
+        q, k, v = self.query_key_value(h)
+        return self.multihead_attn(q, k, v)
 
 
 class MLP(flow.nn.Module):
@@ -479,6 +616,7 @@ class ColumnParallelLinear(flow.nn.Module):
 
         args = get_args()
         self.bias_gelu_fusion = args.bias_gelu_fusion
+        self.sequence_parallel = args.sequence_parallel
 
         # col parallel linear weight sbp: [B, S(1)]
         self.weight = flow.nn.Parameter(
@@ -503,9 +641,14 @@ class ColumnParallelLinear(flow.nn.Module):
         flow.nn.init.zeros_(self.bias)
 
     def forward(self, x):
-        # x sbp: [S(0), B]
-        # x.grad sbp: [S(0), P] -> [S(0), B]
-        x = x.to_consistent(grad_sbp=x.sbp)
+        if self.sequence_parallel:
+            # x sbp: [S(0), S(seq_dim)] -> [S(0), B] (all-gather)
+            # x.grad sbp: [S(0), P] -> [S(0), S(seq_dim)] (reduce-scatter)
+            x = x.to_consistent(sbp=dist.get_hidden_sbp(), grad_sbp=x.sbp)
+        else:
+            # x sbp: [S(0), B]
+            # x.grad sbp: [S(0), P] -> [S(0), B]
+            x = x.to_consistent(grad_sbp=x.sbp)
         # matmul sbp sign: [S(0), B] x [B, S(1)] -> [S(0), S(1)]
         # x.grad sbp sign: [S(0), S(1)] x [B, S(0)] (weight.T) -> [S(0), P]
         x = flow._C.matmul(x, self.weight)
@@ -533,6 +676,8 @@ class RowParallelLinear(flow.nn.Module):
 
         args = get_args()
         self.bias_dropout_fusion = args.bias_dropout_fusion
+        self.sequence_parallel = args.sequence_parallel
+        self.seq_dim = 0 if args.multihead_attention_fusion else 1
         if not self.bias_dropout_fusion:
             self.dropout = flow.nn.Dropout(p=dropout_rate)
 
@@ -563,8 +708,12 @@ class RowParallelLinear(flow.nn.Module):
         # matmul sbp sign: [S(0), S(1)] x [B, S(0)] -> [S(0), P]
         # backward x.grad sbp sign: [S(0), B] x [B, S(1)] (weight.T) -> [S(0), S(1)]
         x = flow._C.matmul(x, self.weight)
-        # x.sbp: [S(0), P] -> [S(0), B]
-        x = x.to_consistent(sbp=dist.get_hidden_sbp())
+        if self.sequence_parallel:
+            # x.sbp: [S(0), P] -> [S(0), S(seq_dim)] (reduce-scatter instead of all-reduce)
+            x = x.to_consistent(sbp=dist.get_sequence_parallel_sbp(self.seq_dim))
+        else:
+            # x.sbp: [S(0), P] -> [S(0), B]
+            x = x.to_consistent(sbp=dist.get_hidden_sbp())
         if self.bias_dropout_fusion:
             x = flow._C.fused_bias_add_dropout(
                 x, self.bias, p=self.dropout_rate, axis=x.ndim - 1
@@ -0,0 +1,126 @@
+"""
+Tokenizes a JSONL corpus (one json document per line) into the .bin/.idx pair
+used by --dataset, e.g.
+
+    python3 oneflow_gpt/preprocess_data.py \
+        --input corpus.jsonl \
+        --output-prefix /data/gpt/corpus_text_document \
+        --vocab-file gpt2-vocab.json \
+        --merge-file gpt2-merges.txt \
+        --append-eod \
+        --workers 16
+"""
+import os
+import sys
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+)
+
+import argparse
+import json
+import multiprocessing
+import time
+
+from oneflow_gpt.data import MMapIndexedDatasetBuilder, best_fitting_dtype
+
+_TOKENIZER = None
+_EOD_ID = None
+
+
+def _init_worker(vocab_file, merge_file):
+    global _TOKENIZER, _EOD_ID
+    try:
+        from tokenizers import ByteLevelBPETokenizer
+    except ImportError:
+        raise ImportError(
+            "preprocess_data.py requires tokenizers, `pip install -r requirements.txt`"
+        )
+
+    # GPT-2 byte-level BPE, one tokenizer per worker process
+    _TOKENIZER = ByteLevelBPETokenizer(vocab_file, merge_file)
+    _EOD_ID = _TOKENIZER.token_to_id("<|endoftext|>")
+
+
+def _encode(args):
+    line, json_key, append_eod = args
+    text = json.loads(line)[json_key]
+    tokens = _TOKENIZER.encode(text).ids
+    if append_eod:
+        tokens.append(_EOD_ID)
+    return tokens, len(line)
+
+
+def _vocab_size(vocab_file):
+    with open(vocab_file, "r", encoding="utf-8") as f:
+        return len(json.load(f))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="OneFlow GPT data preprocessing")
+    parser.add_argument("--input", type=str, required=True, help="Path to input JSONL")
+    parser.add_argument(
+        "--output-prefix",
+        type=str,
+        required=True,
+        help="Writes <output-prefix>.bin and <output-prefix>.idx",
+    )
+    parser.add_argument("--json-key", type=str, default="text")
+    parser.add_argument("--vocab-file", type=str, required=True)
+    parser.add_argument("--merge-file", type=str, required=True)
+    parser.add_argument(
+        "--append-eod",
+        action="store_true",
+        help="Append an <end of document> token to every document.",
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=64,
+        help="Documents sent to a worker at a time.",
+    )
+    parser.add_argument("--log-interval", type=int, default=10000)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    builder = MMapIndexedDatasetBuilder(
+        args.output_prefix + ".bin",
+        dtype=best_fitting_dtype(_vocab_size(args.vocab_file)),
+    )
+
+    start = time.time()
+    num_tokens = 0
+    num_bytes = 0
+    with open(args.input, "r", encoding="utf-8") as fin, multiprocessing.Pool(
+        args.workers,
+        initializer=_init_worker,
+        initargs=(args.vocab_file, args.merge_file),
+    ) as pool:
+        lines = ((line, args.json_key, args.append_eod) for line in fin if line.strip())
+        # imap keeps the order of the documents in the output
+        encoded = pool.imap(_encode, lines, chunksize=args.chunk_size)
+        for i, (tokens, length) in enumerate(encoded, start=1):
+            builder.add_document(tokens)
+            num_tokens += len(tokens)
+            num_bytes += length
+            if i % args.log_interval == 0:
+                elapsed = time.time() - start
+                print(
+                    f"processed {i} documents, {num_tokens / elapsed:.0f} tokens/s,"
+                    f" {num_bytes / elapsed / 1024 / 1024:.2f} MB/s",
+                    file=sys.stderr,
+                )
+
+    builder.finalize(args.output_prefix + ".idx")
+    print(
+        f"wrote {num_tokens} tokens to {args.output_prefix}.bin"
+        f" in {time.time() - start:.1f}s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -11,9 +11,11 @@ import oneflow._oneflow_internal
 
 from oneflow_gpt.config import get_args
 from oneflow_gpt import distribute as dist
-from oneflow_gpt.data import GPTDataLoader
+from oneflow_gpt import checkpointing
+from oneflow_gpt.data import GPTDataLoader, ExternalBatchReader
 from oneflow_gpt.model import GPTModel, Embedding, Logits
 from oneflow_gpt.model import Transformer, TransformerLayer, ActivationCheckpointing
+from oneflow_gpt.model import CoreAttention
 from oneflow_gpt.model import ParallelSparseSoftmaxCrossEntropyLoss
 from oneflow_gpt.optimizer import make_optimizer, make_lr_scheduler, make_grad_scaler
 from oneflow_gpt.logger import print_rank_0, print_rank_last, Logger
@@ -28,6 +30,9 @@ class Trainer(object):
         self.world_size = flow.env.get_world_size()
         self.model = GPTModel()
         self.data_loader = GPTDataLoader()
+        self.batch_reader = None
+        if self.args.use_external_dataset:
+            self.batch_reader = ExternalBatchReader()
         self.cross_entropy = ParallelSparseSoftmaxCrossEntropyLoss()
         self.optimizer = make_optimizer(self.args, self.model)
         self.lr_scheduler = make_lr_scheduler(self.args, self.optimizer)
@@ -35,6 +40,7 @@ class Trainer(object):
         # self.lr_scheduler = None
         # NOTE(zwx): grad scaler is not available in eager mode
         self.grad_scaler = make_grad_scaler(self.args)
+        dist.print_pipeline_schedule()
 
         if self.args.graph:
             flow.boxing.nccl.enable_use_compute_stream(True)
@@ -62,7 +68,10 @@ class Trainer(object):
         iteration = 0
         while iteration < self.args.train_iters:
             if self.args.graph:
-                loss = self.train_graph()
+                if self.batch_reader is not None:
+                    loss = self.train_graph(self.batch_reader())
+                else:
+                    loss = self.train_graph()
             else:
                 raise NotImplementedError
                 # loss = self.train_eager()
@@ -139,9 +148,17 @@ class GPTGraph(flow.nn.Graph):
         self.config.allow_fuse_cast_scale(True)
 
     def set_activation_checkpointing(self):
+        modes = checkpointing.get_layer_recompute_modes()
+        checkpointing.print_activation_memory(modes)
         for module_block in self.model.modules():
             if isinstance(module_block.origin, TransformerLayer):
-                module_block.config.activation_checkpointing = True
+                mode = modes[module_block.origin.layer_idx]
+                if mode == checkpointing.FULL_RECOMPUTE:
+                    module_block.config.activation_checkpointing = True
+            elif isinstance(module_block.origin, CoreAttention):
+                mode = modes[module_block.origin.layer_idx]
+                if mode == checkpointing.ATTENTION_RECOMPUTE:
+                    module_block.config.activation_checkpointing = True
 
     def set_pipeline_stage_id(self):
         dist_util = dist.get_dist_util()
@@ -170,8 +187,8 @@ class GPTGraph(flow.nn.Graph):
         )
         self.cross_entropy.config.stage_id = dist_util.get_layer_stage_id(-1)
 
-    def build(self):
-        data, label = self.data_loader()
+    def build(self, tokens=None):
+        data, label = self.data_loader(tokens)
         logits = self.model(data)
         loss = self.cross_entropy(logits, label)
         if self.is_train:
@@ -0,0 +1,349 @@
+""" Continuous-batching text generation service for GPT2
+
+Requests are pulled from a queue into a fixed number of batch slots that share one
+preallocated KVCache. New prompts are left-padded and prefilled together, then copied
+into free slots so that they end at the current cache column; every decode step feeds
+one token per slot. Finished sequences are retired right away and their slots are
+handed to waiting requests, which keeps the batch full under concurrent load.
+"""
+import argparse
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import oneflow as flow
+
+from model_config import GPT2Config
+from model import GPT2LMHeadModel, KVCache
+from run_generation import set_seed
+from sampling import sample
+from tokenizer import build_tokenizer
+
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationRequest(object):
+    def __init__(self, prompt_tokens, max_new_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.max_new_tokens = max_new_tokens
+        self.output_tokens = []
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.output_tokens
+
+
+class _Slot(object):
+    def __init__(self, request, start, last_token):
+        self.request = request
+        # first cache column holding a real token of this sequence
+        self.start = start
+        self.last_token = last_token
+
+
+class GenerationEngine(object):
+    def __init__(
+        self,
+        model,
+        max_batch_size=16,
+        max_length=1024,
+        temperature=1.0,
+        top_k=1,
+        top_p=0.0,
+        eod_id=None,
+        device="cuda",
+    ):
+        config = model.transformer.config
+        assert max_length <= config.max_position_embeddings
+        self.model = model
+        self.config = config
+        self.max_batch_size = max_batch_size
+        self.max_length = max_length
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.eod_id = eod_id
+        self.device = device
+
+        self.cache = KVCache(config, max_batch_size, max_length, device=device)
+        self.attention_mask = flow.zeros(
+            (max_batch_size, max_length), dtype=flow.int8, device=device
+        )
+        self.slots = [None] * max_batch_size
+        self.requests = queue.Queue()
+        self.num_generated_tokens = 0
+
+    def submit(self, prompt_tokens, max_new_tokens):
+        if len(prompt_tokens) == 0:
+            raise ValueError("prompt must contain at least one token")
+        max_new_tokens = min(max_new_tokens, self.max_length - len(prompt_tokens))
+        if max_new_tokens <= 0:
+            raise ValueError(
+                "prompt of {} tokens does not fit into max_length {}".format(
+                    len(prompt_tokens), self.max_length
+                )
+            )
+        request = GenerationRequest(list(prompt_tokens), max_new_tokens)
+        self.requests.put(request)
+        return request
+
+    def _sample(self, logits):
+        return sample(
+            logits, temperature=self.temperature, top_k=self.top_k, top_p=self.top_p
+        ).tolist()
+
+    def _shift(self, offset):
+        length = self.cache.length
+        if offset > 0:
+            src, dst = (0, length), (offset, length + offset)
+        else:
+            src, dst = (-offset, length), (0, length + offset)
+        self.attention_mask[:, dst[0] : dst[1]] = self.attention_mask[
+            :, src[0] : src[1]
+        ].clone()
+        if offset > 0:
+            self.attention_mask[:, :offset] = 0
+        self.cache.shift(offset)
+        for slot in self.slots:
+            if slot is not None:
+                slot.start += offset
+
+    def _reset(self):
+        self.cache.reset()
+        self.attention_mask.fill_(0)
+
+    def _append_token(self, index, token):
+        slot = self.slots[index]
+        request = slot.request
+        request.output_tokens.append(token)
+        slot.last_token = token
+        length = self.cache.length - slot.start + 1
+        if (
+            len(request.output_tokens) >= request.max_new_tokens
+            or token == self.eod_id
+            or length >= self.max_length
+        ):
+            self.slots[index] = None
+            self.attention_mask[index] = 0
+            request.done.set()
+
+    def _admit(self, block):
+        free = [i for i, slot in enumerate(self.slots) if slot is None]
+        admitted = []
+        while len(admitted) < len(free):
+            try:
+                request = self.requests.get(block=block and not admitted)
+            except queue.Empty:
+                break
+            admitted.append(request)
+        if not admitted:
+            return
+
+        # left-pad the new prompts so that they all end in the same column
+        prompt_length = max(len(r.prompt_tokens) for r in admitted)
+        input_ids = np.zeros((len(admitted), prompt_length), dtype=np.int64)
+        mask = np.zeros((len(admitted), prompt_length), dtype=np.int8)
+        for i, request in enumerate(admitted):
+            input_ids[
+                i, prompt_length - len(request.prompt_tokens) :
+            ] = request.prompt_tokens
+            mask[i, prompt_length - len(request.prompt_tokens) :] = 1
+        position_ids = np.maximum(mask.cumsum(-1) - 1, 0)
+
+        prefill_cache = KVCache(
+            self.config, len(admitted), prompt_length, device=self.device
+        )
+        input_ids = flow.tensor(input_ids, dtype=flow.long, device=self.device)
+        position_ids = flow.tensor(position_ids, dtype=flow.long, device=self.device)
+        mask = flow.tensor(mask, dtype=flow.int8, device=self.device)
+        logits = self.model(
+            input_ids,
+            position_ids=position_ids,
+            past_key_values=prefill_cache,
+            use_cache=True,
+            attention_mask=mask,
+        )[0]
+        next_tokens = self._sample(logits[:, -1, :])
+
+        if self.cache.length < prompt_length:
+            self._shift(prompt_length - self.cache.length)
+        rows = free[: len(admitted)]
+        self.cache.write_rows(rows, prefill_cache)
+        end = self.cache.length
+        for i, (row, request) in enumerate(zip(rows, admitted)):
+            self.attention_mask[row] = 0
+            self.attention_mask[row, end - prompt_length : end] = mask[i]
+            self.slots[row] = _Slot(request, end - len(request.prompt_tokens), None)
+            self._append_token(row, next_tokens[i])
+        self.num_generated_tokens += len(admitted)
+
+    def step(self):
+        """Runs one decode step over all occupied slots."""
+        active = [i for i, slot in enumerate(self.slots) if slot is not None]
+        if not active:
+            return
+        length = self.cache.length
+        if length == self.max_length:
+            # drop the leading columns that are padding for every live sequence
+            self._shift(-min(self.slots[i].start for i in active))
+            length = self.cache.length
+
+        input_ids = [[slot.last_token if slot else 0] for slot in self.slots]
+        position_ids = [[length - slot.start if slot else 0] for slot in self.slots]
+        self.attention_mask[:, length] = flow.tensor(
+            [1 if slot else 0 for slot in self.slots],
+            dtype=flow.int8,
+            device=self.device,
+        )
+        logits = self.model(
+            flow.tensor(input_ids, dtype=flow.long, device=self.device),
+            position_ids=flow.tensor(position_ids, dtype=flow.long, device=self.device),
+            past_key_values=self.cache,
+            use_cache=True,
+            attention_mask=self.attention_mask[:, : length + 1],
+        )[0]
+        next_tokens = self._sample(logits[:, -1, :])
+        for i in active:
+            self._append_token(i, next_tokens[i])
+        self.num_generated_tokens += len(active)
+
+    def serve_forever(self, log_interval=10.0):
+        last_time, last_tokens = time.time(), 0
+        with flow.no_grad():
+            while True:
+                idle = all(slot is None for slot in self.slots)
+                if idle:
+                    self._reset()
+                self._admit(block=idle)
+                self.step()
+                now = time.time()
+                if now - last_time >= log_interval:
+                    tokens = self.num_generated_tokens - last_tokens
+                    logger.info(
+                        "%.1f tokens/sec, %d/%d slots busy, %d requests queued",
+                        tokens / (now - last_time),
+                        sum(slot is not None for slot in self.slots),
+                        self.max_batch_size,
+                        self.requests.qsize(),
+                    )
+                    last_time, last_tokens = now, self.num_generated_tokens
+
+
+def make_handler(engine, tokenizer, default_max_new_tokens):
+    class GenerationHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/generate":
+                self.send_error(404)
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                payload = json.loads(body)
+                request = engine.submit(
+                    tokenizer.tokenize(payload["prompt"]),
+                    int(payload.get("max_new_tokens", default_max_new_tokens)),
+                )
+            except (ValueError, KeyError) as e:
+                self.send_error(400, str(e))
+                return
+            text = tokenizer.detokenize(request.wait())
+            response = json.dumps({"text": text}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+    return GenerationHandler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--vocab_file", default="gpt2-vocab.json", type=str)
+    parser.add_argument("--merges_file", default="gpt2-merges.txt", type=str)
+    parser.add_argument(
+        "--restore_file",
+        default="gpt2_oneflow_model",
+        type=str,
+        help="Path to pre-trained model",
+    )
+    parser.add_argument("--max_batch_size", type=int, default=16)
+    parser.add_argument(
+        "--max_length",
+        type=int,
+        default=1024,
+        help="cache columns shared by all slots (prompt + generated tokens)",
+    )
+    parser.add_argument("--length", type=int, default=20, help="default new tokens")
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--top_k", type=int, default=1)
+    parser.add_argument("--top_p", type=float, default=0.9)
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=0,
+        help="serve POST /generate on this port, read prompts from stdin if 0",
+    )
+    parser.add_argument(
+        "--no_cuda", action="store_true", help="Avoid using CUDA when available"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=42, help="random seed for initialization"
+    )
+    args = parser.parse_args()
+
+    args.device = flow.device("cuda" if not args.no_cuda else "cpu")
+    set_seed(args)
+
+    tokenizer = build_tokenizer(
+        vocab_file=args.vocab_file,
+        merges_file=args.merges_file,
+        tokenizer_type="GPT2BPETokenizer",
+    )
+    config = GPT2Config()
+    model = GPT2LMHeadModel(config)
+    if args.restore_file is not None:
+        model.load_state_dict(flow.load(args.restore_file))
+    model.lm_head.weight = model.transformer.wte.weight
+    model.to(args.device)
+    model.eval()
+
+    engine = GenerationEngine(
+        model,
+        max_batch_size=args.max_batch_size,
+        max_length=min(args.max_length, config.max_position_embeddings),
+        temperature=args.temperature,
+        top_k=args.top_k,
+        top_p=args.top_p,
+        eod_id=tokenizer.eod,
+        device=args.device,
+    )
+    worker = threading.Thread(target=engine.serve_forever, daemon=True)
+    worker.start()
+
+    if args.port:
+        server = ThreadingHTTPServer(
+            ("127.0.0.1", args.port), make_handler(engine, tokenizer, args.length)
+        )
+        logger.info("serving on http://127.0.0.1:%d/generate", args.port)
+        server.serve_forever()
+    else:
+        # every line of stdin is one prompt, all of them are in flight at once
+        prompts = [line.rstrip("\n") for line in sys.stdin if line.strip()]
+        requests = [
+            engine.submit(prompt_tokens, args.length)
+            for prompt_tokens in tokenizer.tokenize_batch(prompts)
+        ]
+        for request in requests:
+            print(tokenizer.detokenize(request.wait()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import array
 import tqdm
 import random
 import pickle
@@ -28,9 +29,8 @@ class GPTDataset(flow.utils.data.Dataset):
                 text = f.read()
 
             tokenized_text = self.tokenizer.tokenize(text)
-            while len(tokenized_text) >= self.block_size:
-                self.examples.append(tokenized_text[:block_size])
-                tokenized_text = tokenized_text[block_size:]
+            for start in range(0, len(tokenized_text) - block_size + 1, block_size):
+                self.examples.append(tokenized_text[start : start + block_size])
 
             print("saving features into cached file")
             with open(cached_file, "wb") as handle:
@@ -43,3 +43,92 @@ class GPTDataset(flow.utils.data.Dataset):
         example = self.examples[index]
         # return np.array(example, dtype=np.long)
         return flow.tensor(example, dtype=flow.long)
+
+
+def token_dtype(vocab_size):
+    return np.uint16 if vocab_size <= np.iinfo(np.uint16).max + 1 else np.uint32
+
+
+class TokenShardWriter(object):
+    """
+    Writes token ids as one flat binary file ``<prefix>.bin`` plus ``<prefix>.idx``
+    holding the document offsets and the token dtype, see :class:`TokenShardDataset`.
+    """
+
+    def __init__(self, prefix, vocab_size):
+        self.prefix = prefix
+        self.dtype = token_dtype(vocab_size)
+        self.offsets = array.array("q", [0])
+        self.bin_file = open(prefix + ".bin", "wb")
+
+    def add_document(self, token_ids):
+        tokens = np.asarray(token_ids, dtype=self.dtype)
+        self.bin_file.write(tokens.tobytes())
+        self.offsets.append(self.offsets[-1] + len(tokens))
+
+    def add_documents(self, tokens, lengths):
+        """Appends several documents given as concatenated ``tokens`` and their ``lengths``."""
+        self.bin_file.write(np.asarray(tokens, dtype=self.dtype).tobytes())
+        ends = self.offsets[-1] + np.cumsum(lengths, dtype=np.int64)
+        self.offsets.extend(ends.tolist())
+
+    def close(self):
+        self.bin_file.close()
+        with open(self.prefix + ".idx", "wb") as handle:
+            np.savez(
+                handle,
+                offsets=np.frombuffer(self.offsets, dtype=np.int64),
+                dtype=np.array(np.dtype(self.dtype).str),
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TokenShardDataset(flow.utils.data.Dataset):
+    """
+    Contiguous ``block_size`` windows over a token file written by TokenShardWriter.
+
+    The tokens are memory-mapped lazily in every process, so start-up does not
+    depend on the corpus size and DataLoader workers share the page cache; items
+    are views into the map and are only copied by :func:`collate_blocks`.
+    """
+
+    def __init__(self, prefix, block_size: int):
+        self.prefix = prefix
+        self.block_size = block_size
+        with np.load(prefix + ".idx") as index:
+            self.doc_offsets = index["offsets"]
+            self.dtype = np.dtype(str(index["dtype"]))
+        self.num_tokens = int(self.doc_offsets[-1])
+        self._tokens = None
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = np.memmap(
+                self.prefix + ".bin",
+                dtype=self.dtype,
+                mode="r",
+                shape=(self.num_tokens,),
+            )
+        return self._tokens
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_tokens"] = None
+        return state
+
+    def __len__(self):
+        return self.num_tokens // self.block_size
+
+    def __getitem__(self, index):
+        start = index * self.block_size
+        return self.tokens[start : start + self.block_size]
+
+
+def collate_blocks(blocks):
+    return flow.tensor(np.array(blocks, dtype=np.int64), dtype=flow.long)
@@ -61,6 +61,119 @@ class Conv1D(nn.Module):
         return x
 
 
+class LayerKVCache(object):
+    """
+    Key/value buffers of a single attention layer, owned by a :class:`KVCache`.
+    """
+
+    def __init__(self, cache, shape, dtype, device):
+        self.cache = cache
+        self.key = flow.zeros(shape, dtype=dtype, device=device)
+        self.value = flow.zeros(shape, dtype=dtype, device=device)
+
+    def update(self, key, value):
+        """
+        Writes the new ``key``/``value`` (batch, head, seq_length, head_features) into the
+        buffers right after the cached prefix and returns the keys/values seen so far.
+        """
+        start = self.cache.length
+        end = start + key.size(-2)
+        if end > self.cache.max_length:
+            raise ValueError(
+                "KVCache overflow: {} positions requested but only {} were allocated".format(
+                    end, self.cache.max_length
+                )
+            )
+        self.key[:, :, start:end, :] = key
+        self.value[:, :, start:end, :] = value
+        return self.key[:, :, :end, :], self.value[:, :, :end, :]
+
+    def shift(self, offset):
+        length = self.cache.length
+        if offset > 0:
+            src, dst = (0, length), (offset, length + offset)
+        else:
+            src, dst = (-offset, length), (0, length + offset)
+        for buf in (self.key, self.value):
+            buf[:, :, dst[0] : dst[1], :] = buf[:, :, src[0] : src[1], :].clone()
+
+
+class KVCache(object):
+    """
+    Preallocated key/value cache for incremental decoding.
+
+    Every layer gets a fixed (batch, head, max_length, head_features) buffer that is
+    written in place, so after the prompt has been consumed each step only feeds the
+    newly sampled token through the model and memory does not grow with the output.
+    The cache is advanced by :class:`GPT2Model` once all layers have been updated.
+    """
+
+    def __init__(
+        self, config, batch_size, max_length, dtype=flow.float32, device="cuda"
+    ):
+        num_heads = config.num_attention_heads
+        head_dim = config.hidden_size // num_heads
+        shape = (batch_size, num_heads, max_length, head_dim)
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.length = 0
+        self.layers = [
+            LayerKVCache(self, shape, dtype, device)
+            for _ in range(config.num_hidden_layers)
+        ]
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __getitem__(self, index):
+        return self.layers[index]
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    def advance(self, num_tokens):
+        self.length += num_tokens
+
+    def shift(self, offset):
+        """
+        Moves the cached positions ``offset`` columns to the right (to the left if
+        negative), e.g. to make room for a longer left-padded prompt or to drop
+        columns that are padding for every sequence in the batch.
+        """
+        if not 0 <= self.length + offset <= self.max_length:
+            raise ValueError(
+                "Cannot shift KVCache of length {} by {}".format(self.length, offset)
+            )
+        for layer in self.layers:
+            layer.shift(offset)
+        self.length += offset
+
+    def write_rows(self, rows, other):
+        """
+        Copies the positions cached in ``other`` into the batch ``rows`` of this cache
+        so that they end at the current length; ``other`` holds one row per entry of
+        ``rows``.
+        """
+        start = self.length - other.length
+        if start < 0:
+            raise ValueError(
+                "Cannot fit {} cached positions into a KVCache of length {}".format(
+                    other.length, self.length
+                )
+            )
+        for layer, other_layer in zip(self.layers, other.layers):
+            for i, row in enumerate(rows):
+                layer.key[row, :, start : self.length, :] = other_layer.key[
+                    i, :, : other.length, :
+                ]
+                layer.value[row, :, start : self.length, :] = other_layer.value[
+                    i, :, : other.length, :
+                ]
+
+    def reset(self):
+        self.length = 0
+
+
 class GPT2Attention(nn.Module):
     def __init__(self, config):
         super(GPT2Attention, self).__init__()
@@ -86,7 +199,7 @@ class GPT2Attention(nn.Module):
         self.attn_dropout = nn.Dropout(config.attn_pdrop)
         self.resid_dropout = nn.Dropout(config.resid_pdrop)
 
-    def _attn(self, query, key, value):
+    def _attn(self, query, key, value, attention_mask=None):
         attn_weights = flow.matmul(query, key.transpose(-2, -1))
 
         if self.scale_attn_weights:
@@ -96,6 +209,10 @@ class GPT2Attention(nn.Module):
         causal_mask = self.bias[
             :, :, key_length - query_length : key_length, :key_length
         ]
+        if attention_mask is not None:
+            # attention_mask: (batch, key_length), 0 marks padded positions
+            attention_mask = attention_mask.view(attention_mask.size(0), 1, 1, -1)
+            causal_mask = causal_mask * attention_mask.to(causal_mask.dtype)
         attn_weights = flow.where(
             causal_mask, attn_weights, self.masked_bias.to(attn_weights.dtype)
         )
@@ -126,7 +243,9 @@ class GPT2Attention(nn.Module):
         new_shape = (bsz, seq_len, num_heads * attn_head_size)
         return tensor.view(*new_shape)
 
-    def forward(self, hidden_states, layer_past=None, use_cache=False):
+    def forward(
+        self, hidden_states, layer_past=None, use_cache=False, attention_mask=None
+    ):
         hidden_states = self.c_attn(hidden_states)
         query, key, value = flow.chunk(hidden_states, chunks=3, dim=2)
 
@@ -134,17 +253,21 @@ class GPT2Attention(nn.Module):
         key = self._split_heads(key, self.num_heads, self.head_dim)
         value = self._split_heads(value, self.num_heads, self.head_dim)
 
-        if layer_past is not None:
+        if isinstance(layer_past, LayerKVCache):
+            key, value = layer_past.update(key, value)
+        elif layer_past is not None:
             past_key, past_value = layer_past
             key = flow.cat((past_key, key), dim=-2)
             value = flow.cat((past_value, value), dim=-2)
 
         if use_cache is True:
-            present = (key, value)
+            present = (
+                layer_past if isinstance(layer_past, LayerKVCache) else (key, value)
+            )
         else:
             present = None
 
-        attn_output, attn_weights = self._attn(query, key, value)
+        attn_output, attn_weights = self._attn(query, key, value, attention_mask)
 
         attn_output = self._merge_heads(attn_output, self.num_heads, self.head_dim)
         attn_output = self.c_proj(attn_output)
@@ -182,10 +305,12 @@ class GPT2Block(nn.Module):
         self.ln_2 = LayerNorm(hidden_size, eps=config.layer_norm_epsilon)
         self.mlp = GPT2MLP(inner_dim, config)
 
-    def forward(self, hidden_states, layer_past=None, use_cache=False):
+    def forward(
+        self, hidden_states, layer_past=None, use_cache=False, attention_mask=None
+    ):
         residual = hidden_states
         hidden_states = self.ln_1(hidden_states)
-        attn_outputs = self.attn(hidden_states, layer_past, use_cache)
+        attn_outputs = self.attn(hidden_states, layer_past, use_cache, attention_mask)
         attn_output = attn_outputs[0]
         outputs = attn_outputs[1:]
         hidden_states = attn_output + residual
@@ -207,6 +332,7 @@ class GPT2Block(nn.Module):
 class GPT2Model(nn.Module):
     def __init__(self, config):
         super(GPT2Model, self).__init__()
+        self.config = config
         self.embed_dim = config.hidden_size
 
         self.wte = nn.Embedding(config.vocab_size, self.embed_dim)
@@ -227,6 +353,7 @@ class GPT2Model(nn.Module):
         use_cache=False,
         output_attentions=False,
         output_hidden_states=False,
+        attention_mask=None,
     ):
         input_shape = input_ids.size()
         input_ids = input_ids.view(-1, input_ids.size(-1))
@@ -240,6 +367,8 @@ class GPT2Model(nn.Module):
         if past_key_values is None:
             past_length = 0
             past_key_values = [None] * len(self.h)
+        elif isinstance(past_key_values, KVCache):
+            past_length = past_key_values.length
         else:
             past_length = past_key_values[0][0].size(-2)
 
@@ -269,7 +398,7 @@ class GPT2Model(nn.Module):
         for i, (block, layer_past) in enumerate(zip(self.h, past_key_values)):
             if output_hidden_states:
                 all_hidden_states = all_hidden_states + (hidden_states,)
-            outputs = block(hidden_states, layer_past, use_cache)
+            outputs = block(hidden_states, layer_past, use_cache, attention_mask)
             hidden_states = outputs[0]
             if use_cache is True:
                 presents = presents + (outputs[1],)
@@ -277,6 +406,11 @@ class GPT2Model(nn.Module):
             if output_attentions:
                 all_attentions = all_attentions + (outputs[2 if use_cache else 1],)
 
+        if isinstance(past_key_values, KVCache):
+            past_key_values.advance(input_shape[-1])
+            if use_cache is True:
+                presents = past_key_values
+
         hidden_states = self.ln_f(hidden_states)
         output_shape = (input_shape[0], input_shape[1], hidden_states.size(-1))
         hidden_states = hidden_states.view(*output_shape)
@@ -334,6 +468,7 @@ class GPT2LMHeadModel(nn.Module):
         use_cache=False,
         output_attentions=False,
         output_hidden_states=False,
+        attention_mask=None,
     ):
         transformer_outputs = self.transformer(
             input_ids,
@@ -343,6 +478,7 @@ class GPT2LMHeadModel(nn.Module):
             use_cache,
             output_attentions,
             output_hidden_states,
+            attention_mask,
         )
         hidden_states = transformer_outputs[0]
         lm_logits = self.lm_head(hidden_states)
@@ -0,0 +1,128 @@
+import argparse
+import collections
+import itertools
+import multiprocessing
+import time
+
+import numpy as np
+import tqdm
+
+from gpt_dataset import TokenShardWriter
+from tokenizer import build_tokenizer
+
+
+_tokenizer = None
+
+
+def _init_worker(vocab_file, merges_file):
+    # one tokenizer per worker, its BPE cache is reused for every chunk
+    global _tokenizer
+    _tokenizer = build_tokenizer(
+        vocab_file=vocab_file,
+        merges_file=merges_file,
+        tokenizer_type="GPT2BPETokenizer",
+    )
+
+
+def _tokenize_chunk(documents):
+    ids = _tokenizer.tokenize_batch(documents)
+    lengths = np.array([len(x) for x in ids], dtype=np.int64)
+    tokens = np.fromiter(itertools.chain.from_iterable(ids), dtype=np.int64)
+    return tokens, lengths
+
+
+def _splits_cleanly(line, next_line):
+    # GPT-2 BPE pre-tokenizes a whitespace run as one piece, e.g. "\n\n" or "\n  ",
+    # so a break is only invisible to it between "<non-space>\n" and a non-space
+    return (
+        len(line) > 1
+        and line[-1] == "\n"
+        and not line[-2].isspace()
+        and not next_line[0].isspace()
+    )
+
+
+def _read_documents(f):
+    lines = []
+    for line in f:
+        if lines and _splits_cleanly(lines[-1], line):
+            yield "".join(lines)
+            lines = []
+        lines.append(line)
+    if lines:
+        yield "".join(lines)
+
+
+def _read_chunks(f, chunk_lines):
+    chunk, num_lines = [], 0
+    for document in _read_documents(f):
+        chunk.append(document)
+        num_lines += document.count("\n")
+        if num_lines >= chunk_lines:
+            yield chunk
+            chunk, num_lines = [], 0
+    if chunk:
+        yield chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tokenize a text corpus into <output_prefix>.bin/.idx for TokenShardDataset"
+    )
+    parser.add_argument("--input", type=str, required=True, help="raw text file")
+    parser.add_argument("--output_prefix", type=str, required=True)
+    parser.add_argument("--vocab_file", default="gpt2-vocab.json", type=str)
+    parser.add_argument("--merges_file", default="gpt2-merges.txt", type=str)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="tokenizer processes",
+    )
+    parser.add_argument(
+        "--chunk_lines", type=int, default=1024, help="lines sent to a worker at once"
+    )
+    args = parser.parse_args()
+
+    tokenizer = build_tokenizer(
+        vocab_file=args.vocab_file,
+        merges_file=args.merges_file,
+        tokenizer_type="GPT2BPETokenizer",
+    )
+
+    # Documents are runs of lines cut only where the pre-tokenizer splits anyway and
+    # line breaks are kept, so the token stream matches tokenizing the whole file
+    # at once. Chunks are streamed through the pool with a bounded number in flight
+    # and written in input order, so memory does not depend on the corpus size.
+    start_time = time.time()
+    with open(args.input, "r", encoding="utf-8") as f, TokenShardWriter(
+        args.output_prefix, tokenizer.vocab_size
+    ) as writer, multiprocessing.Pool(
+        args.workers,
+        initializer=_init_worker,
+        initargs=(args.vocab_file, args.merges_file),
+    ) as pool:
+        pending = collections.deque()
+        for documents in tqdm.tqdm(
+            _read_chunks(f, args.chunk_lines), desc="Tokenizing"
+        ):
+            pending.append(pool.apply_async(_tokenize_chunk, (documents,)))
+            if len(pending) >= 2 * args.workers:
+                writer.add_documents(*pending.popleft().get())
+        while pending:
+            writer.add_documents(*pending.popleft().get())
+
+    num_tokens = writer.offsets[-1]
+    elapsed = time.time() - start_time
+    print(
+        "wrote {} tokens in {} documents to {}.bin ({:.0f} tokens/sec)".format(
+            num_tokens,
+            len(writer.offsets) - 1,
+            args.output_prefix,
+            num_tokens / max(elapsed, 1e-6),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+""" Batched token sampling for auto-regressive generation
+
+Everything works on `(batch, vocab)` logits with dense tensor ops only, so it can be
+shared by any decoder that produces next-token logits.
+"""
+import oneflow as flow
+
+
+def sample(
+    logits,
+    temperature=1.0,
+    top_k=0,
+    top_p=0.0,
+    repetition_penalty=1.0,
+    prev_tokens=None,
+):
+    """ Draw one token per row of `logits` (batch size, vocabulary size)
+        Args:
+            temperature: logits are divided by it, 0 means greedy decoding.
+            top_k > 0: keep only top k tokens with highest probability (top-k filtering).
+            top_p > 0.0: keep the top tokens with cumulative probability >= top_p (nucleus filtering).
+                Nucleus filtering is described in Holtzman et al. (http://arxiv.org/abs/1904.09751)
+            repetition_penalty: > 1.0 discourages the ids in `prev_tokens` (batch size, seq length)
+                as described in Keskar et al. (https://arxiv.org/abs/1909.05858)
+
+        Returns the sampled ids with shape (batch size,).
+    """
+    if repetition_penalty != 1.0 and prev_tokens is not None:
+        score = flow.gather(logits, 1, prev_tokens)
+        score = flow.where(
+            score > 0, score / repetition_penalty, score * repetition_penalty
+        )
+        logits = flow.scatter(logits, 1, prev_tokens, score)
+
+    if temperature == 0 or top_k == 1:
+        return logits.argmax(-1)
+    logits = logits / temperature
+
+    # Only the (sorted) candidates that survive top-k are looked at from here on,
+    # the sampled position is mapped back to a vocabulary id with one gather.
+    values, indices = _sorted_candidates(logits, top_k)
+    values = _top_p_filter(values, top_p, -float("Inf"))
+    probs = flow.softmax(values, dim=-1)
+
+    # Inverse transform sampling: one uniform draw per row against the CDF. The draw
+    # is scaled by the float total, which the CDF reaches at the last kept candidate,
+    # so a rounding shortfall can never select a filtered (zero probability) token.
+    cdf = flow.cumsum(probs, dim=-1)
+    u = flow.rand(probs.size(0), 1, device=probs.device) * cdf[:, -1:]
+    choice = (cdf < u).to(flow.int64).sum(-1, keepdim=True)
+    return flow.gather(indices, 1, choice).squeeze(-1)
+
+
+def _sorted_candidates(logits, top_k):
+    if 0 < top_k < logits.size(-1):
+        return flow.topk(logits, top_k, dim=-1)
+    return flow.sort(logits, dim=-1, descending=True)
+
+
+def _top_p_filter(sorted_logits, top_p, filter_value):
+    if top_p <= 0.0:
+        return sorted_logits
+    probs = flow.softmax(sorted_logits, dim=-1)
+    # Exclusive cumulative sum keeps the first token above the threshold as well.
+    to_remove = (flow.cumsum(probs, dim=-1) - probs) > top_p
+    return sorted_logits.masked_fill(to_remove, filter_value)
@@ -22,6 +22,8 @@ import json
 import logging
 import os
 import regex as re
+import threading
+from collections import OrderedDict
 from io import open
 
 try:
@@ -91,6 +93,58 @@ def get_pairs(word):
     return pairs
 
 
+class LRUCache(object):
+    """Bounded mapping that evicts the least recently used entry, with hit/miss counters.
+    Safe to share between threads."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+
 class GPT2Tokenizer(object):
     """
     GPT-2 BPE tokenizer. Peculiarities:
@@ -187,6 +241,7 @@ class GPT2Tokenizer(object):
         errors="replace",
         special_tokens=None,
         max_len=None,
+        cache_size=1 << 17,
     ):
         self.max_len = max_len if max_len is not None else int(1e12)
         self.encoder = json.load(open(vocab_file))
@@ -197,7 +252,11 @@ class GPT2Tokenizer(object):
         bpe_data = open(merges_file, encoding="utf-8").read().split("\n")[1:-1]
         bpe_merges = [tuple(merge.split()) for merge in bpe_data]
         self.bpe_ranks = dict(zip(bpe_merges, range(len(bpe_merges))))
-        self.cache = {}
+        self._build_merge_table(bpe_merges)
+        # word -> tuple of symbol ids after all merges
+        self.cache = LRUCache(cache_size)
+        # build_tokenizer shares one instance, e.g. between server threads
+        self._symbol_lock = threading.Lock()
 
         # Should haved added re.IGNORECASE so BPE merges can happen for
         # capitalized versions of contractions
@@ -212,6 +271,28 @@ class GPT2Tokenizer(object):
     def __len__(self):
         return len(self.encoder) + len(self.special_tokens)
 
+    def _build_merge_table(self, bpe_merges):
+        """ Number every BPE symbol and store the merges as (id, id) -> (rank, merged id),
+            so that applying merges only compares and hashes small integers.
+        """
+        self.symbols = []
+        self.symbol_ids = {}
+
+        def symbol_id(symbol):
+            if symbol not in self.symbol_ids:
+                self.symbol_ids[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+            return self.symbol_ids[symbol]
+
+        for symbol in self.byte_encoder.values():
+            symbol_id(symbol)
+        self.merge_ranks = {}
+        for rank, (first, second) in enumerate(bpe_merges):
+            self.merge_ranks[(symbol_id(first), symbol_id(second))] = (
+                rank,
+                symbol_id(first + second),
+            )
+
     def set_special_tokens(self, special_tokens):
         """ Add a list of additional tokens to the encoder.
             The additional tokens are indexed starting from the last index of the
@@ -220,64 +301,83 @@ class GPT2Tokenizer(object):
         if not special_tokens:
             self.special_tokens = {}
             self.special_tokens_decoder = {}
-            return
-        self.special_tokens = dict(
-            (tok, len(self.encoder) + i) for i, tok in enumerate(special_tokens)
-        )
-        self.special_tokens_decoder = {v: k for k, v in self.special_tokens.items()}
-        logger.info("Special tokens {}".format(self.special_tokens))
-
-    def bpe(self, token):
-        if token in self.cache:
-            return self.cache[token]
-        word = tuple(token)
-        pairs = get_pairs(word)
-
-        if not pairs:
-            return token
+        else:
+            self.special_tokens = dict(
+                (tok, len(self.encoder) + i) for i, tok in enumerate(special_tokens)
+            )
+            self.special_tokens_decoder = {v: k for k, v in self.special_tokens.items()}
+            logger.info("Special tokens {}".format(self.special_tokens))
+        # vocabulary id of every BPE symbol, same lookup as convert_tokens_to_ids
+        with self._symbol_lock:
+            self.symbol_token_ids = [
+                self.special_tokens[symbol]
+                if symbol in self.special_tokens
+                else self.encoder.get(symbol, 0)
+                for symbol in self.symbols
+            ]
 
-        while True:
-            bigram = min(pairs, key=lambda pair: self.bpe_ranks.get(pair, float("inf")))
-            if bigram not in self.bpe_ranks:
+    def bpe_ids(self, token):
+        """ Apply the BPE merges to a byte-encoded word, returns the symbol ids. """
+        word = self.cache.get(token)
+        if word is not None:
+            return word
+        merge_ranks = self.merge_ranks
+        symbol_ids = self.symbol_ids
+        word = [
+            symbol_ids[char] if char in symbol_ids else self._add_symbol(char)
+            for char in token
+        ]
+
+        while len(word) > 1:
+            bigram, best = None, None
+            for pair in zip(word, word[1:]):
+                merge = merge_ranks.get(pair)
+                if merge is not None and (best is None or merge[0] < best[0]):
+                    bigram, best = pair, merge
+            if bigram is None:
                 break
             first, second = bigram
+            merged = best[1]
             new_word = []
             i = 0
             while i < len(word):
-                try:
-                    j = word.index(first, i)
-                    new_word.extend(word[i:j])
-                    i = j
-                except BaseException:
-                    new_word.extend(word[i:])
-                    break
-
                 if word[i] == first and i < len(word) - 1 and word[i + 1] == second:
-                    new_word.append(first + second)
+                    new_word.append(merged)
                     i += 2
                 else:
                     new_word.append(word[i])
                     i += 1
-            new_word = tuple(new_word)
             word = new_word
-            if len(word) == 1:
-                break
-            else:
-                pairs = get_pairs(word)
-        word = " ".join(word)
-        self.cache[token] = word
+        word = tuple(word)
+        self.cache.put(token, word)
         return word
 
-    def tokenize(self, text):
-        """ Tokenize a string. """
-        bpe_tokens = []
+    def _add_symbol(self, symbol):
+        with self._symbol_lock:
+            if symbol in self.symbol_ids:
+                return self.symbol_ids[symbol]
+            self.symbols.append(symbol)
+            self.symbol_token_ids.append(
+                self.special_tokens.get(symbol, self.encoder.get(symbol, 0))
+            )
+            # published last, a reader that finds the id can always index the lists
+            self.symbol_ids[symbol] = len(self.symbols) - 1
+            return self.symbol_ids[symbol]
+
+    def bpe(self, token):
+        return " ".join(self.symbols[i] for i in self.bpe_ids(token))
+
+    def _words(self, text):
         for token in re.findall(self.pat, text):
             if sys.version_info[0] == 2:
-                token = "".join(self.byte_encoder[ord(b)] for b in token)
+                yield "".join(self.byte_encoder[ord(b)] for b in token)
             else:
-                token = "".join(self.byte_encoder[b] for b in token.encode("utf-8"))
-            bpe_tokens.extend(bpe_token for bpe_token in self.bpe(token).split(" "))
-        return bpe_tokens
+                yield "".join(self.byte_encoder[b] for b in token.encode("utf-8"))
+
+    def tokenize(self, text):
+        """ Tokenize a string. """
+        symbols = self.symbols
+        return [symbols[i] for word in self._words(text) for i in self.bpe_ids(word)]
 
     def convert_tokens_to_ids(self, tokens):
         """ Converts a sequence of tokens into ids using the vocab. """
@@ -294,6 +394,10 @@ class GPT2Tokenizer(object):
                 ids.append(self.special_tokens[token])
             else:
                 ids.append(self.encoder.get(token, 0))
+        self._check_length(ids)
+        return ids
+
+    def _check_length(self, ids):
         if len(ids) > self.max_len:
             logger.warning(
                 "Token indices sequence length is longer than the specified maximum "
@@ -302,7 +406,6 @@ class GPT2Tokenizer(object):
                     len(ids), self.max_len
                 )
             )
-        return ids
 
     def convert_ids_to_tokens(self, ids, skip_special_tokens=False):
         """Converts a sequence of ids in BPE tokens using the vocab."""
@@ -316,7 +419,14 @@ class GPT2Tokenizer(object):
         return tokens
 
     def encode(self, text):
-        return self.convert_tokens_to_ids(self.tokenize(text))
+        token_ids = self.symbol_token_ids
+        ids = [token_ids[i] for word in self._words(text) for i in self.bpe_ids(word)]
+        self._check_length(ids)
+        return ids
+
+    def encode_batch(self, texts):
+        """ Encode several strings, words repeated across them are merged only once. """
+        return [self.encode(text) for text in texts]
 
     def decode(self, tokens):
         text = "".join([self.decoder[token] for token in tokens])
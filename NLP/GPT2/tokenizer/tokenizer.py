@@ -16,17 +16,26 @@
 from abc import ABC
 from abc import abstractmethod
 import math
+import os
 from .gpt2_tokenization import GPT2Tokenizer
 
 
+# tokenizers already built in this process, so that every caller shares one BPE cache
+_TOKENIZERS = {}
+
+
 def build_tokenizer(vocab_file, merges_file, tokenizer_type="GPT2BPETokenizer"):
-    """Select and instantiate the tokenizer."""
+    """Select and instantiate the tokenizer, or return the one built before for the same files."""
+    key = (tokenizer_type, os.path.abspath(vocab_file), os.path.abspath(merges_file))
+    if key in _TOKENIZERS:
+        return _TOKENIZERS[key]
     if tokenizer_type == "GPT2BPETokenizer":
         tokenizer = _GPT2BPETokenizer(vocab_file, merges_file)
     else:
         raise NotImplementedError(
             "{} tokenizer is not implemented.".format(tokenizer_type)
         )
+    _TOKENIZERS[key] = tokenizer
     return tokenizer
 
 
@@ -76,6 +85,9 @@ class AbstractTokenizer(ABC):
     def tokenize(self, text):
         pass
 
+    def tokenize_batch(self, texts):
+        return [self.tokenize(text) for text in texts]
+
     def detokenize(self, token_ids):
         raise NotImplementedError(
             "detokenizer is not implemented for {} tokenizer".format(self.name)
@@ -139,6 +151,13 @@ class _GPT2BPETokenizer(AbstractTokenizer):
     def tokenize(self, text):
         return self.tokenizer.encode(text)
 
+    def tokenize_batch(self, texts):
+        return self.tokenizer.encode_batch(texts)
+
+    def cache_info(self):
+        """Hit/miss counters of the BPE word cache."""
+        return self.tokenizer.cache.info()
+
     def detokenize(self, token_ids):
         return self.tokenizer.decode(token_ids)
 
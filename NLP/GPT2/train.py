@@ -6,7 +6,7 @@ from oneflow.utils.data import DataLoader
 from model_config import GPT2Config
 from model import GPT2LMHeadModel
 from trainer import Trainer
-from gpt_dataset import GPTDataset
+from gpt_dataset import GPTDataset, TokenShardDataset, collate_blocks
 from tokenizer import build_tokenizer
 
 
@@ -23,6 +23,11 @@ def main():
         default="data/corpus.small",
         help="test set for evaluation",
     )
+    parser.add_argument(
+        "--mmap_dataset",
+        action="store_true",
+        help="datasets are prefixes of .bin/.idx files written by preprocess_data.py",
+    )
     parser.add_argument("--vocab_file", default="gpt2-vocab.json", type=str)
     parser.add_argument("--merges_file", default="gpt2-merges.txt", type=str)
     parser.add_argument("--output_path", default="output/", type=str, help="save path")
@@ -67,15 +72,27 @@ def main():
         tokenizer_type="GPT2BPETokenizer",
     )
 
-    print("building train dataset")
-    train_dataset = GPTDataset(args.train_dataset, tokenizer, args.seq_len)
+    if args.mmap_dataset:
+        print("building train dataset")
+        train_dataset = TokenShardDataset(args.train_dataset, args.seq_len)
+
+        print("building test dataset")
+        test_dataset = TokenShardDataset(args.test_dataset, args.seq_len)
+        collate_fn = collate_blocks
+    else:
+        print("building train dataset")
+        train_dataset = GPTDataset(args.train_dataset, tokenizer, args.seq_len)
 
-    print("building test dataset")
-    test_dataset = GPTDataset(args.test_dataset, tokenizer, args.seq_len)
+        print("building test dataset")
+        test_dataset = GPTDataset(args.test_dataset, tokenizer, args.seq_len)
+        collate_fn = None
 
     print("building train dataloader")
     train_data_loader = DataLoader(
-        train_dataset, batch_size=args.batch_size, num_workers=args.num_workers
+        train_dataset,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        collate_fn=collate_fn,
     )
 
     print("building test dataloader")
@@ -84,6 +101,7 @@ def main():
         shuffle=False,
         batch_size=args.batch_size,
         num_workers=args.num_workers,
+        collate_fn=collate_fn,
     )
 
     print("building model")
@@ -0,0 +1,123 @@
+"""
+Times forward and backward of the sparse part of the local Wide&Deep model, the
+separate wide/deep lookups against FusedSparseEmbedding, e.g.
+
+    python3 benchmark_embedding.py --batch_sizes 1024,4096,16384,65536
+"""
+import os
+import sys
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+)
+import argparse
+import time
+
+import oneflow as flow
+import oneflow.nn as nn
+
+from models.wide_and_deep import Embedding, FusedSparseEmbedding
+
+
+class SeparateSparseEmbedding(nn.Module):
+    """The lookups of LocalWideAndDeep.forward without --fused_embedding."""
+
+    def __init__(self, vocab_size, deep_embedding_vec_size):
+        super(SeparateSparseEmbedding, self).__init__()
+        self.wide_embedding = Embedding(vocab_size, 1)
+        self.deep_embedding = Embedding(vocab_size, deep_embedding_vec_size)
+
+    def forward(self, dense_fields, wide_sparse_fields, deep_sparse_fields):
+        wide_embedding = self.wide_embedding(wide_sparse_fields)
+        wide_embedding = wide_embedding.view(
+            -1, wide_embedding.shape[-1] * wide_embedding.shape[-2]
+        )
+        wide_scores = flow.sum(wide_embedding, dim=1, keepdim=True)
+        deep_embedding = self.deep_embedding(deep_sparse_fields)
+        deep_embedding = deep_embedding.view(
+            -1, deep_embedding.shape[-1] * deep_embedding.shape[-2]
+        )
+        deep_features = flow.cat([deep_embedding, dense_fields], dim=1)
+        return wide_scores, deep_features
+
+
+def parse_args():
+    def int_list(x):
+        return list(map(int, x.split(",")))
+
+    parser = argparse.ArgumentParser(description="Wide&Deep embedding benchmark")
+    parser.add_argument(
+        "--batch_sizes", type=int_list, default=[1024, 4096, 16384, 65536]
+    )
+    parser.add_argument("--vocab_size", type=int, default=2322444)
+    parser.add_argument("--deep_embedding_vec_size", type=int, default=16)
+    parser.add_argument("--num_wide_sparse_fields", type=int, default=2)
+    parser.add_argument("--num_deep_sparse_fields", type=int, default=26)
+    parser.add_argument("--num_dense_fields", type=int, default=13)
+    parser.add_argument("--warmup_iters", type=int, default=10)
+    parser.add_argument("--iters", type=int, default=100)
+    return parser.parse_args()
+
+
+def benchmark(module, batch, args):
+    def step():
+        wide_scores, deep_features = module(*batch)
+        loss = flow.sum(wide_scores) + flow.sum(deep_features)
+        loss.backward()
+        return loss
+
+    for _ in range(args.warmup_iters):
+        step()
+    # eager ops run asynchronously, reading the loss waits for the queued steps
+    step().numpy()
+    start = time.perf_counter()
+    for _ in range(args.iters):
+        loss = step()
+    loss.numpy()
+    return (time.perf_counter() - start) * 1000 / args.iters
+
+
+def main():
+    args = parse_args()
+    separate = SeparateSparseEmbedding(
+        args.vocab_size, args.deep_embedding_vec_size
+    ).to("cuda")
+    fused = FusedSparseEmbedding(
+        Embedding(args.vocab_size, args.deep_embedding_vec_size + 1),
+        args.num_wide_sparse_fields,
+    ).to("cuda")
+
+    print(
+        "{:>10} {:>14} {:>14} {:>8}".format(
+            "batch", "separate(ms)", "fused(ms)", "speedup"
+        )
+    )
+    for batch_size in args.batch_sizes:
+        batch = (
+            flow.rand(batch_size, args.num_dense_fields, device="cuda"),
+            flow.randint(
+                0,
+                args.vocab_size,
+                (batch_size, args.num_wide_sparse_fields),
+                dtype=flow.int32,
+                device="cuda",
+            ),
+            flow.randint(
+                0,
+                args.vocab_size,
+                (batch_size, args.num_deep_sparse_fields),
+                dtype=flow.int32,
+                device="cuda",
+            ),
+        )
+        separate_ms = benchmark(separate, batch, args)
+        fused_ms = benchmark(fused, batch, args)
+        print(
+            "{:>10} {:>14.3f} {:>14.3f} {:>7.2f}x".format(
+                batch_size, separate_ms, fused_ms, separate_ms / fused_ms
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
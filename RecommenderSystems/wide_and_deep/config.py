@@ -21,6 +21,9 @@ def get_args(print_args=True):
     def str_list(x):
         return x.split(",")
 
+    def int_list(x):
+        return list(map(int, x.split(",")))
+
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--model_load_dir", type=str, default="")
@@ -41,13 +44,22 @@ def get_args(print_args=True):
         help="do eval after_training",
     )
     parser.add_argument(
-        "--dataset_format", type=str, default="ofrecord", help="ofrecord, onerec or synthetic"
+        "--dataset_format",
+        type=str,
+        default="ofrecord",
+        help="ofrecord, onerec, synthetic or columnar",
     )
     parser.add_argument("--data_part_num", type=int, default=256)
     parser.add_argument(
         "--data_dir", type=str, default="/dataset/wdl_ofrecord/ofrecord"
     )
     parser.add_argument('--data_part_name_suffix_length', type=int, default=-1)
+    parser.add_argument(
+        "--shuffle_block_size",
+        type=int,
+        default=8192,
+        help="rows of the blocks the columnar format shuffles every epoch",
+    )
     parser.add_argument('--eval_batchs', type=int, default=20)
     parser.add_argument('--eval_interval', type=int, default=1000)    
     parser.add_argument("--batch_size", type=int, default=16384)
@@ -56,7 +68,57 @@ def get_args(print_args=True):
     parser.add_argument("--wide_vocab_size", type=int, default=1603616)
     parser.add_argument("--deep_vocab_size", type=int, default=1603616)
     parser.add_argument("--deep_embedding_vec_size", type=int, default=16)
+    parser.add_argument(
+        "--embedding_mode",
+        type=str,
+        default="shared",
+        choices=["shared", "hash", "per_field", "frequency"],
+        help="shared: one row per id, hash: ids hashed into wide/deep_vocab_size rows, "
+        "per_field: per-field tables capped at max_rows_per_field, "
+        "frequency: ids rarer than min_id_frequency share a fallback row per field",
+    )
+    parser.add_argument(
+        "--slot_size_array",
+        type=int_list,
+        default=None,
+        help="vocab size of every sparse field, wide fields first, e.g. 225945,354813,...",
+    )
+    parser.add_argument("--max_rows_per_field", type=int, default=None)
+    parser.add_argument(
+        "--id_frequency_file",
+        type=str,
+        default=None,
+        help="npy file of the occurrence count of every sparse id",
+    )
+    parser.add_argument("--min_id_frequency", type=int, default=2)
+    parser.add_argument(
+        "--embedding_cache_rows",
+        type=int,
+        default=0,
+        help="keep the embedding tables in host memory and cache this many rows "
+        "of each on the GPU, 0 keeps the whole tables on the GPU",
+    )
+    parser.add_argument(
+        "--embedding_cache_policy", type=str, default="lru", choices=["lru", "lfu"]
+    )
+    parser.add_argument(
+        "--embedding_host_dir",
+        type=str,
+        default="",
+        help="directory of the memory mapped host tables, empty keeps them in RAM",
+    )
+    parser.add_argument(
+        "--fused_embedding",
+        action="store_true",
+        help="look up wide and deep fields in one table, local models only",
+    )
     parser.add_argument("--deep_dropout_rate", type=float, default=0.5)
+    parser.add_argument(
+        "--eval_auc_bins",
+        type=int,
+        default=65536,
+        help="score histogram bins of the streaming eval AUC",
+    )
     parser.add_argument("--num_dense_fields", type=int, default=13)
     parser.add_argument("--max_iter", type=int, default=30000)
     parser.add_argument("--loss_print_every_n_iter", type=int, default=100)
@@ -0,0 +1,195 @@
+"""
+Converts Criteo TSV files (label, 13 integer and 26 categorical features per line)
+into the columnar format read by --dataset_format columnar, e.g.
+
+    python3 criteo_to_columnar.py \
+        --train_files day_0,day_1 \
+        --val_files day_23 \
+        --output_dir /dataset/wdl_columnar \
+        --min_count 2
+
+Categorical values seen fewer than --min_count times in the train files, and
+missing values, share id 0 of their field. The wide fields are crosses of pairs
+of categorical features and take the first ids, the deep fields follow. The
+slot sizes and id counts are written for --embedding_mode per_field/frequency.
+"""
+import os
+import sys
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+)
+import argparse
+import itertools
+import json
+import time
+from collections import Counter
+
+import numpy as np
+
+from models.data import COLUMNAR_FIELDS
+
+NUM_DENSE_FIELDS = 13
+NUM_CATEGORICAL_FIELDS = 26
+
+
+def parse_args():
+    def str_list(x):
+        return x.split(",")
+
+    parser = argparse.ArgumentParser(description="Criteo TSV to columnar converter")
+    parser.add_argument("--train_files", type=str_list, required=True)
+    parser.add_argument("--val_files", type=str_list, default=[])
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--min_count", type=int, default=1)
+    parser.add_argument(
+        "--wide_crosses",
+        type=str_list,
+        default=["0:1", "2:3"],
+        help="pairs of 0-based categorical fields crossed into the wide fields",
+    )
+    parser.add_argument("--chunk_lines", type=int, default=1 << 16)
+    return parser.parse_args()
+
+
+def read_chunks(files, chunk_lines):
+    for file in files:
+        with open(file, "r") as f:
+            while True:
+                lines = list(itertools.islice(f, chunk_lines))
+                if not lines:
+                    break
+                yield [line.rstrip("\n").split("\t") for line in lines]
+
+
+def sparse_columns(rows, crosses):
+    """Returns the string values of the wide (crossed) and deep fields of the rows."""
+    first = 1 + NUM_DENSE_FIELDS
+    deep = [[row[first + i] for row in rows] for i in range(NUM_CATEGORICAL_FIELDS)]
+    wide = [
+        [f"{a}_{b}" if a and b else "" for a, b in zip(deep[i], deep[j])]
+        for i, j in crosses
+    ]
+    return wide + deep
+
+
+def build_vocabs(files, crosses, min_count, chunk_lines):
+    num_fields = len(crosses) + NUM_CATEGORICAL_FIELDS
+    counters = [Counter() for _ in range(num_fields)]
+    for rows in read_chunks(files, chunk_lines):
+        for counter, values in zip(counters, sparse_columns(rows, crosses)):
+            counter.update(values)
+
+    vocabs, id_counts = [], []
+    for counter in counters:
+        # id 0 of a field holds its missing and rare values
+        vocab = {}
+        counts = [0]
+        for value, count in counter.items():
+            if value and count >= min_count:
+                vocab[value] = len(counts)
+                counts.append(count)
+            else:
+                counts[0] += count
+        vocabs.append(vocab)
+        id_counts.append(counts)
+    return vocabs, id_counts
+
+
+def convert(files, output_dir, vocabs, id_offsets, crosses, chunk_lines):
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {
+        name: open(os.path.join(output_dir, f"{name}.bin"), "wb")
+        for name, _ in COLUMNAR_FIELDS
+    }
+    dtypes = dict(COLUMNAR_FIELDS)
+    num_wide = len(crosses)
+    num_samples = 0
+    for rows in read_chunks(files, chunk_lines):
+        labels = np.array([int(row[0]) for row in rows], dtype=dtypes["labels"])
+        dense = np.array(
+            [
+                [int(x) if x else 0 for x in row[1 : 1 + NUM_DENSE_FIELDS]]
+                for row in rows
+            ],
+            dtype=np.float64,
+        )
+        dense = np.log1p(np.maximum(dense, 0)).astype(dtypes["dense_fields"])
+        sparse = np.stack(
+            [
+                np.array([vocab.get(v, 0) for v in values], dtype=np.int64) + offset
+                for vocab, offset, values in zip(
+                    vocabs, id_offsets, sparse_columns(rows, crosses)
+                )
+            ],
+            axis=1,
+        )
+        columns = {
+            "labels": labels.reshape(-1, 1),
+            "dense_fields": dense,
+            "wide_sparse_fields": sparse[:, :num_wide],
+            "deep_sparse_fields": sparse[:, num_wide:],
+        }
+        for name, dtype in COLUMNAR_FIELDS:
+            columns[name].astype(dtype).tofile(outputs[name])
+        num_samples += len(rows)
+
+    for f in outputs.values():
+        f.close()
+    meta = {
+        "num_samples": num_samples,
+        "widths": {
+            "labels": 1,
+            "dense_fields": NUM_DENSE_FIELDS,
+            "wide_sparse_fields": num_wide,
+            "deep_sparse_fields": len(vocabs) - num_wide,
+        },
+    }
+    with open(os.path.join(output_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return num_samples
+
+
+def main():
+    args = parse_args()
+    crosses = [tuple(map(int, cross.split(":"))) for cross in args.wide_crosses]
+
+    start = time.time()
+    vocabs, id_counts = build_vocabs(
+        args.train_files, crosses, args.min_count, args.chunk_lines
+    )
+    slot_sizes = [len(counts) for counts in id_counts]
+    id_offsets = np.cumsum([0] + slot_sizes[:-1]).tolist()
+    assert sum(slot_sizes) < np.iinfo(np.int32).max
+    print(f"built vocabularies of {sum(slot_sizes)} ids in {time.time() - start:.1f}s")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    np.save(
+        os.path.join(args.output_dir, "id_frequency.npy"),
+        np.concatenate([np.array(counts, dtype=np.int64) for counts in id_counts]),
+    )
+    with open(os.path.join(args.output_dir, "slot_size_array.txt"), "w") as f:
+        f.write(",".join(map(str, slot_sizes)) + "\n")
+
+    for mode, files in (("train", args.train_files), ("val", args.val_files)):
+        if not files:
+            continue
+        num_samples = convert(
+            files,
+            os.path.join(args.output_dir, mode),
+            vocabs,
+            id_offsets,
+            crosses,
+            args.chunk_lines,
+        )
+        print(f"wrote {num_samples} {mode} samples in {time.time() - start:.1f}s")
+
+    print(
+        f"train with --dataset_format columnar --data_dir {args.output_dir}"
+        f" --num_wide_sparse_fields {len(crosses)}"
+        f" --wide_vocab_size {sum(slot_sizes)} --deep_vocab_size {sum(slot_sizes)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
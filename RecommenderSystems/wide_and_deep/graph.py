@@ -7,13 +7,10 @@ class WideAndDeepValGraph(flow.nn.Graph):
         self.module = wdl_module
         self.dataloader = dataloader
 
-    def build(self):
-        (
-            labels,
-            dense_fields,
-            wide_sparse_fields,
-            deep_sparse_fields,
-        ) = self.dataloader()
+    def build(self, *batch):
+        if not batch:
+            batch = self.dataloader()
+        labels, dense_fields, wide_sparse_fields, deep_sparse_fields = batch
         labels = labels.to("cuda").to(dtype=flow.float32)
         dense_fields = dense_fields.to("cuda")
         wide_sparse_fields = wide_sparse_fields.to("cuda")
@@ -32,13 +29,10 @@ class WideAndDeepTrainGraph(flow.nn.Graph):
         self.add_optimizer(optimizer)
         self.add_optimizer(sparse_opt)
 
-    def build(self):
-        (
-            labels,
-            dense_fields,
-            wide_sparse_fields,
-            deep_sparse_fields,
-        ) = self.dataloader()
+    def build(self, *batch):
+        if not batch:
+            batch = self.dataloader()
+        labels, dense_fields, wide_sparse_fields, deep_sparse_fields = batch
         labels = labels.to("cuda").to(dtype=flow.float32)
         dense_fields = dense_fields.to("cuda")
         wide_sparse_fields = wide_sparse_fields.to("cuda")
@@ -1,10 +1,23 @@
 import os
+import json
 import oneflow as flow
 import oneflow.nn as nn
 import glob
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
 
-__all__ = ["make_data_loader"]
+__all__ = ["make_data_loader", "COLUMNAR_FIELDS"]
+
+# column files of the columnar format, {data_dir}/{mode}/{name}.bin with
+# meta.json holding the number of samples and the width of every column
+COLUMNAR_FIELDS = (
+    ("labels", np.int32),
+    ("dense_fields", np.float32),
+    ("wide_sparse_fields", np.int32),
+    ("deep_sparse_fields", np.int32),
+)
+
 
 def make_data_loader(args, mode, is_consistent=False, data_format="ofrecord"):
     assert mode in ("train", "val")
@@ -61,8 +74,25 @@ def make_data_loader(args, mode, is_consistent=False, data_format="ofrecord"):
             sbp=sbp,
         )
         return synthetic_data_loader
+    elif data_format == "columnar":
+        columnar_data_loader = ColumnarDataLoader(
+            data_dir=args.data_dir,
+            num_dense_fields=args.num_dense_fields,
+            num_wide_sparse_fields=args.num_wide_sparse_fields,
+            num_deep_sparse_fields=args.num_deep_sparse_fields,
+            batch_size=batch_size_per_proc,
+            total_batch_size=total_batch_size,
+            mode=mode,
+            shuffle=(mode == "train"),
+            shuffle_block_size=args.shuffle_block_size,
+            placement=placement,
+            sbp=sbp,
+        )
+        return columnar_data_loader
     else:
-        raise ValueError("data format must be one of ofrecord, onerec or synthetic")
+        raise ValueError(
+            "data format must be one of ofrecord, onerec, synthetic or columnar"
+        )
 
 
 class OFRecordDataLoader(nn.Module):
@@ -247,3 +277,127 @@ class SyntheticDataLoader(nn.Module):
     def forward(self):
         return self.labels, self.dense_fields, self.wide_sparse_fields, self.deep_sparse_fields
 
+
+class ColumnarDataLoader(nn.Module):
+    """
+    Reads the fixed-width column files written by criteo_to_columnar.py. The files
+    are memory mapped and every batch is a few contiguous row slices, so no record
+    is decoded. Training shuffles the order of blocks of `shuffle_block_size` rows
+    every epoch, the same order on every rank, and each rank reads its own part of
+    the global batch. The next batch is read on a background thread.
+    """
+
+    def __init__(
+        self,
+        data_dir: str = "/dataset/wdl_columnar",
+        num_dense_fields: int = 13,
+        num_wide_sparse_fields: int = 2,
+        num_deep_sparse_fields: int = 26,
+        batch_size: int = 1,
+        total_batch_size: int = 1,
+        mode: str = "train",
+        shuffle: bool = True,
+        shuffle_block_size: int = 8192,
+        placement=None,
+        sbp=None,
+    ):
+        super(ColumnarDataLoader, self).__init__()
+        assert mode in ("train", "val")
+        self.batch_size = batch_size
+        self.total_batch_size = total_batch_size
+        self.placement = placement
+        self.sbp = sbp
+        self.shuffle = shuffle
+
+        data_dir = os.path.join(data_dir, mode)
+        with open(os.path.join(data_dir, "meta.json"), "r") as f:
+            meta = json.load(f)
+        widths = {
+            "labels": 1,
+            "dense_fields": num_dense_fields,
+            "wide_sparse_fields": num_wide_sparse_fields,
+            "deep_sparse_fields": num_deep_sparse_fields,
+        }
+        for name, width in widths.items():
+            assert (
+                meta["widths"][name] == width
+            ), f"{name} of {data_dir} has width {meta['widths'][name]}, expected {width}"
+        self.columns = [
+            np.memmap(
+                os.path.join(data_dir, f"{name}.bin"),
+                dtype=dtype,
+                mode="r",
+                shape=(meta["num_samples"], widths[name]),
+            )
+            for name, dtype in COLUMNAR_FIELDS
+        ]
+
+        self.rank = flow.env.get_rank()
+        self.world_size = flow.env.get_world_size()
+        if placement is None:
+            # every process reads its own batch of batch_size rows
+            self.local_batch_size = batch_size
+        else:
+            # the local batches are the split(0) parts of the consistent batch
+            self.local_batch_size = total_batch_size // self.world_size
+        # rows consumed by all ranks in one step
+        self.global_batch_size = self.local_batch_size * self.world_size
+
+        # the tail of the data that does not fill a block is dropped
+        self.block_size = shuffle_block_size
+        self.num_blocks = meta["num_samples"] // self.block_size
+        self.epoch_size = self.num_blocks * self.block_size
+        assert (
+            self.epoch_size >= self.global_batch_size
+        ), f"{data_dir} has fewer than {self.global_batch_size} samples"
+        self.epoch = -1
+        self.position = self.epoch_size
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._next_batch = None
+
+    def _next_row_ranges(self):
+        if self.position + self.global_batch_size > self.epoch_size:
+            self.epoch += 1
+            self.position = 0
+            if self.shuffle:
+                # seeded by the epoch, so every rank draws the same block order
+                rng = np.random.RandomState(self.epoch)
+                self.block_order = rng.permutation(self.num_blocks)
+            else:
+                self.block_order = np.arange(self.num_blocks)
+
+        start = self.position + self.rank * self.local_batch_size
+        end = start + self.local_batch_size
+        self.position += self.global_batch_size
+
+        ranges = []
+        while start < end:
+            block, offset = divmod(start, self.block_size)
+            count = min(end - start, self.block_size - offset)
+            row = self.block_order[block] * self.block_size + offset
+            ranges.append((row, row + count))
+            start += count
+        return ranges
+
+    def _read(self, ranges):
+        return [
+            np.concatenate([column[begin:end] for begin, end in ranges])
+            for column in self.columns
+        ]
+
+    def forward(self):
+        if self._next_batch is None:
+            self._next_batch = self._executor.submit(
+                self._read, self._next_row_ranges()
+            )
+        batch = self._next_batch.result()
+        self._next_batch = self._executor.submit(self._read, self._next_row_ranges())
+
+        tensors = []
+        for array in batch:
+            tensor = flow.tensor(array)
+            if self.placement is not None and self.sbp is not None:
+                tensor = tensor.to_consistent(placement=self.placement, sbp=self.sbp)
+            tensors.append(tensor)
+        return tuple(tensors)
@@ -0,0 +1,370 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import oneflow as flow
+import oneflow.nn as nn
+
+
+__all__ = [
+    "CachedEmbedding",
+    "EmbeddingIdMapper",
+    "make_id_mappers",
+    "print_table_memory",
+]
+
+
+EMBEDDING_MODES = ("shared", "hash", "per_field", "frequency")
+
+# Knuth's multiplicative hash, spreads consecutive ids over the buckets
+_HASH_MULTIPLIER = 2654435761
+
+
+def _hash(ids, num_buckets):
+    ids = ids.to(flow.int64) * _HASH_MULTIPLIER % (1 << 32)
+    return ids % num_buckets
+
+
+class EmbeddingIdMapper(nn.Module):
+    """
+    Maps the sparse ids of a batch, shape (batch_size, num_fields), to rows of an
+    embedding table that is smaller than the id space:
+
+        hash: ids are hashed into the `vocab_size - 1` rows after the padding row,
+            shared by all fields.
+        per_field: field i owns min(field_vocab_sizes[i], max_rows_per_field) rows,
+            ids past them are hashed into the rows of the field.
+        frequency: ids seen fewer than `min_frequency` times in `id_frequency`
+            share one fallback row of their field, the others keep a row each.
+
+    Ids are global, field i covers [field_id_offsets[i], field_id_offsets[i] +
+    field_vocab_sizes[i]) as produced by the slot offsets of the Criteo conversion.
+    Row 0 stays reserved for the padding index of the embedding.
+    """
+
+    def __init__(
+        self,
+        mode,
+        vocab_size,
+        field_vocab_sizes=None,
+        field_id_offsets=None,
+        max_rows_per_field=None,
+        id_frequency=None,
+        min_frequency=1,
+        row_alignment=1,
+    ):
+        super(EmbeddingIdMapper, self).__init__()
+        assert mode in EMBEDDING_MODES[1:]
+        self.mode = mode
+
+        if mode == "hash":
+            self.num_buckets = vocab_size - 1
+            self.field_rows = None
+            num_rows = vocab_size
+        elif mode == "per_field":
+            field_rows = [
+                size if max_rows_per_field is None else min(size, max_rows_per_field)
+                for size in field_vocab_sizes
+            ]
+            row_offsets = np.cumsum([1] + field_rows[:-1])
+            self.register_buffer(
+                "field_id_offsets", _field_tensor(field_id_offsets, flow.int64)
+            )
+            self.register_buffer(
+                "field_num_rows", _field_tensor(field_rows, flow.int64)
+            )
+            self.register_buffer(
+                "field_row_offsets", _field_tensor(row_offsets, flow.int64)
+            )
+            self.field_rows = field_rows
+            num_rows = 1 + sum(field_rows)
+        else:
+            remap, field_rows = _frequency_remap(
+                field_vocab_sizes, field_id_offsets, id_frequency, min_frequency
+            )
+            self.register_buffer("remap", flow.tensor(remap, dtype=flow.int32))
+            self.field_rows = field_rows
+            num_rows = 1 + sum(field_rows)
+
+        self.num_rows = -(-num_rows // row_alignment) * row_alignment
+
+    def forward(self, ids):
+        if self.mode == "hash":
+            rows = _hash(ids, self.num_buckets) + 1
+        elif self.mode == "per_field":
+            local_ids = ids.to(flow.int64) - self.field_id_offsets
+            rows = flow.where(
+                local_ids < self.field_num_rows,
+                local_ids,
+                _hash(local_ids, self.field_num_rows),
+            )
+            rows = rows + self.field_row_offsets
+        else:
+            rows = flow._C.gather(self.remap, ids, axis=0)
+        return rows.to(ids.dtype)
+
+
+def _field_tensor(values, dtype):
+    # shape (1, num_fields), broadcasts over the batch
+    return flow.tensor(np.asarray(values).reshape(1, -1), dtype=dtype)
+
+
+def _frequency_remap(field_vocab_sizes, field_id_offsets, id_frequency, min_frequency):
+    remap = np.zeros(len(id_frequency), dtype=np.int32)
+    field_rows = []
+    row = 1
+    for size, offset in zip(field_vocab_sizes, field_id_offsets):
+        frequent = id_frequency[offset : offset + size] >= min_frequency
+        num_frequent = int(frequent.sum())
+        # the row after the frequent ids of the field is its fallback row
+        rows = np.full(size, row + num_frequent, dtype=np.int32)
+        rows[frequent] = row + np.arange(num_frequent, dtype=np.int32)
+        remap[offset : offset + size] = rows
+        field_rows.append(num_frequent + 1)
+        row += num_frequent + 1
+    return remap, field_rows
+
+
+def make_id_mappers(args, row_alignment=1):
+    """Returns the (wide, deep) id mappers of args.embedding_mode, None for shared tables."""
+    if args.embedding_mode == "shared":
+        return None, None
+    if args.embedding_mode == "hash":
+        return (
+            EmbeddingIdMapper(
+                "hash", args.wide_vocab_size, row_alignment=row_alignment
+            ),
+            EmbeddingIdMapper("hash", args.deep_vocab_size),
+        )
+
+    num_wide = args.num_wide_sparse_fields
+    slot_sizes = args.slot_size_array
+    assert slot_sizes is not None, f"{args.embedding_mode} needs --slot_size_array"
+    assert len(slot_sizes) == num_wide + args.num_deep_sparse_fields
+    id_offsets = np.cumsum([0] + slot_sizes[:-1]).tolist()
+    id_frequency = None
+    if args.embedding_mode == "frequency":
+        id_frequency = np.load(args.id_frequency_file, mmap_mode="r")
+
+    def _mapper(fields, alignment):
+        return EmbeddingIdMapper(
+            args.embedding_mode,
+            None,
+            field_vocab_sizes=[slot_sizes[i] for i in fields],
+            field_id_offsets=[id_offsets[i] for i in fields],
+            max_rows_per_field=args.max_rows_per_field,
+            id_frequency=id_frequency,
+            min_frequency=args.min_id_frequency,
+            row_alignment=alignment,
+        )
+
+    num_fields = len(slot_sizes)
+    return (
+        _mapper(range(num_wide), row_alignment),
+        _mapper(range(num_wide, num_fields), 1),
+    )
+
+
+def print_table_memory(name, num_rows, embedding_dim, mapper=None):
+    bytes_per_row = embedding_dim * 4
+    print(
+        f"{name}: {num_rows} rows x {embedding_dim}, "
+        f"{num_rows * bytes_per_row / 1024 / 1024:.2f} MB"
+        f" ({'shared' if mapper is None else mapper.mode})"
+    )
+    if mapper is None or mapper.field_rows is None:
+        return
+    for i, rows in enumerate(mapper.field_rows):
+        print(f"  field {i}: {rows} rows, {rows * bytes_per_row / 1024 / 1024:.2f} MB")
+
+
+def _make_host_table(num_rows, embedding_dim, path=None, chunk_rows=1 << 20):
+    shape = (num_rows, embedding_dim)
+    if path is not None and os.path.exists(path):
+        # reopens the table of an earlier run
+        return np.memmap(path, dtype=np.float32, mode="r+", shape=shape)
+
+    if path is None:
+        table = np.empty(shape, dtype=np.float32)
+    else:
+        table = np.memmap(path, dtype=np.float32, mode="w+", shape=shape)
+    # same init as Embedding, chunked to bound the temporaries of large tables
+    for start in range(0, num_rows, chunk_rows):
+        end = min(start + chunk_rows, num_rows)
+        table[start:end] = np.random.uniform(-0.05, 0.05, (end - start, embedding_dim))
+    table[0] = 0
+    return table
+
+
+class CachedEmbedding(nn.Module):
+    """
+    Embedding whose full table lives in host memory, or in an np.memmap file at
+    `host_table_file`, while the rows looked up last stay in a cuda cache of
+    `cache_rows` rows. Only the cache is a parameter; a row is copied in on a
+    miss and written back to the host table when it is evicted, "lru" evicts the
+    least recently used rows and "lfu" the least frequently looked up ones.
+
+    `prefetch(ids)` looks up the ids of the next batch and gathers its missing
+    rows from the host table on a background thread, call it once the current
+    batch has been looked up so the host work overlaps with the GPU step.
+
+    Pass the optimizer of the cache to `bind_optimizer`, the optimizer state of a
+    slot (e.g. the Adam moments) is reset when another row refills it. As in
+    Embedding, id 0 is the padding row: it reads as zeros and is never trained.
+    """
+
+    def __init__(
+        self, vocab_size, embed_size, cache_rows, policy="lru", host_table_file=None
+    ):
+        super(CachedEmbedding, self).__init__()
+        assert policy in ("lru", "lfu")
+        self.vocab_size = vocab_size
+        self.embed_size = embed_size
+        self.cache_rows = min(cache_rows, vocab_size)
+        self.policy = policy
+        self.host_table = _make_host_table(vocab_size, embed_size, host_table_file)
+        self.weight = nn.Parameter(flow.zeros(self.cache_rows, embed_size))
+
+        self._optimizer = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._prefetched = None
+        self.reset_cache()
+        self.reset_stats()
+
+    def reset_cache(self):
+        self._wait_prefetch()
+        self.id_to_slot = np.full(self.vocab_size, -1, dtype=np.int32)
+        self.slot_to_id = np.full(self.cache_rows, -1, dtype=np.int64)
+        self.slot_last_used = np.zeros(self.cache_rows, dtype=np.int64)
+        self.id_counts = (
+            np.zeros(self.vocab_size, dtype=np.int32) if self.policy == "lfu" else None
+        )
+        self.step = 0
+
+    def bind_optimizer(self, optimizer):
+        self._optimizer = optimizer
+
+    def _reset_optimizer_state(self, index):
+        if self._optimizer is None:
+            return
+        # moments etc. of the evicted rows must not be applied to the new ones
+        for value in self._optimizer._state.get(self.weight, {}).values():
+            if isinstance(value, flow.Tensor) and value.shape == self.weight.shape:
+                value[index] = 0
+
+    def reset_stats(self):
+        self.num_lookups = 0
+        self.num_hits = 0
+
+    @property
+    def hit_rate(self):
+        """Share of the unique ids of the looked up batches found in the cache."""
+        return self.num_hits / max(self.num_lookups, 1)
+
+    def _plan(self, ids):
+        unique_ids, inverse = np.unique(ids.ravel(), return_inverse=True)
+        slots = self.id_to_slot[unique_ids]
+        missing = slots < 0
+        rows = self.host_table[unique_ids[missing]]
+        return unique_ids, inverse, slots, missing, rows
+
+    def _wait_prefetch(self):
+        prefetched, self._prefetched = self._prefetched, None
+        if prefetched is None:
+            return None, None
+        ids, future = prefetched
+        return ids, future.result()
+
+    def prefetch(self, ids):
+        self._wait_prefetch()
+        self._prefetched = (ids, self._executor.submit(self._plan, ids))
+
+    def _victims(self, used_slots, num_victims):
+        if self.policy == "lru":
+            score = self.slot_last_used.astype(np.float64)
+        else:
+            score = self.id_counts[self.slot_to_id].astype(np.float64)
+        # empty slots go first, the rows of the current batch stay
+        score[self.slot_to_id < 0] = -1
+        score[used_slots] = np.inf
+        return np.argpartition(score, num_victims - 1)[:num_victims]
+
+    def _read_slots(self, slots):
+        index = flow.tensor(slots, dtype=flow.int64, device=self.weight.device)
+        return flow._C.gather(self.weight.detach(), index, axis=0).numpy()
+
+    def _write_back(self, slots):
+        slots = slots[self.slot_to_id[slots] >= 0]
+        if len(slots) == 0:
+            return
+        ids = self.slot_to_id[slots]
+        self.host_table[ids] = self._read_slots(slots)
+        self.id_to_slot[ids] = -1
+        self.slot_to_id[slots] = -1
+
+    def _assign_slots(self, unique_ids, slots, missing, rows):
+        num_missing = int(missing.sum())
+        self.num_lookups += len(unique_ids)
+        self.num_hits += len(unique_ids) - num_missing
+        self.step += 1
+        if self.id_counts is not None:
+            self.id_counts[unique_ids] += 1
+
+        if num_missing > 0:
+            if len(unique_ids) > self.cache_rows:
+                raise ValueError(
+                    f"a batch looks up {len(unique_ids)} rows, more than the"
+                    f" {self.cache_rows} rows of the embedding cache"
+                )
+            victims = self._victims(slots[~missing], num_missing)
+            self._write_back(victims)
+            new_ids = unique_ids[missing]
+            index = flow.tensor(victims, dtype=flow.int64, device=self.weight.device)
+            with flow.no_grad():
+                self.weight[index] = flow.tensor(
+                    rows, dtype=flow.float32, device=self.weight.device
+                )
+                self._reset_optimizer_state(index)
+            self.id_to_slot[new_ids] = victims
+            self.slot_to_id[victims] = new_ids
+            slots = slots.copy()
+            slots[missing] = victims
+
+        self.slot_last_used[slots] = self.step
+        return slots
+
+    def forward(self, ids):
+        ids_np = ids.numpy()
+        prefetched_ids, plan = self._wait_prefetch()
+        # a batch looked up since the prefetch (e.g. eval) may have changed the cache
+        if plan is None or not np.array_equal(prefetched_ids, ids_np):
+            plan = self._plan(ids_np)
+        unique_ids, inverse, slots, missing, rows = plan
+        slots = self._assign_slots(unique_ids, slots, missing, rows)
+        index = flow.tensor(
+            slots[inverse].reshape(ids_np.shape),
+            dtype=flow.int64,
+            device=self.weight.device,
+        )
+        embeddings = flow._C.gather(self.weight, index, axis=0)
+        padding = ids_np == 0
+        if padding.any():
+            # zeros in the output also keep the gradient of the padding row at zero
+            mask = flow.tensor(
+                ~padding[..., np.newaxis], dtype=flow.float32, device=self.weight.device
+            )
+            embeddings = embeddings * mask
+        return embeddings
+
+    def flush(self):
+        """Writes the cached rows back to the host table, the cache stays valid."""
+        self._wait_prefetch()
+        slots = np.nonzero(self.slot_to_id >= 0)[0]
+        if len(slots) > 0:
+            self.host_table[self.slot_to_id[slots]] = self._read_slots(slots)
+        if isinstance(self.host_table, np.memmap):
+            self.host_table.flush()
+
+    def load_host_table(self, table):
+        self.reset_cache()
+        self.host_table[:] = table
@@ -1,8 +1,12 @@
 from collections import OrderedDict
+import os
+import numpy as np
 import oneflow as flow
 import oneflow.nn as nn
 from typing import Any
 
+from models.embedding import CachedEmbedding, make_id_mappers, print_table_memory
+
 
 __all__ = ["make_wide_and_deep_module"]
 
@@ -35,6 +39,30 @@ class Embedding(nn.Embedding):
             nn.init.uniform_(param, a=-0.05, b=0.05)
 
 
+class FusedSparseEmbedding(nn.Module):
+    """
+    Looks up the wide and deep sparse fields of a batch in one gather from a table
+    of `deep_embedding_vec_size + 1` columns, column 0 holds the wide weights. Returns
+    the pooled wide scores and the deep features with the dense fields appended.
+    The wide and deep ids must share one id space.
+    """
+
+    def __init__(self, embedding, num_wide_sparse_fields):
+        super(FusedSparseEmbedding, self).__init__()
+        self.embedding = embedding
+        self.num_wide_sparse_fields = num_wide_sparse_fields
+
+    def forward(self, dense_fields, wide_sparse_fields, deep_sparse_fields):
+        sparse_fields = flow.cat([wide_sparse_fields, deep_sparse_fields], dim=1)
+        embedding = self.embedding(sparse_fields)
+        wide_scores = flow.sum(
+            embedding[:, : self.num_wide_sparse_fields, 0], dim=1, keepdim=True
+        )
+        deep_embedding = embedding[:, self.num_wide_sparse_fields :, 1:].flatten(1)
+        deep_features = flow.cat([deep_embedding, dense_fields], dim=1)
+        return wide_scores, deep_features
+
+
 class ConsistentWideAndDeep(nn.Module):
     def __init__(
         self,
@@ -46,9 +74,19 @@ class ConsistentWideAndDeep(nn.Module):
         hidden_size: int = 1024,
         hidden_units_num: int = 7,
         deep_dropout_rate: float = 0.5,
+        wide_id_mapper=None,
+        deep_id_mapper=None,
     ):
         super(ConsistentWideAndDeep, self).__init__()
 
+        self.wide_id_mapper = wide_id_mapper
+        self.deep_id_mapper = deep_id_mapper
+        for id_mapper in (self.wide_id_mapper, self.deep_id_mapper):
+            if id_mapper is not None:
+                id_mapper.to_consistent(
+                    flow.env.all_device_placement("cuda"), flow.sbp.broadcast
+                )
+
         self.wide_embedding = Embedding(wide_vocab_size // flow.env.get_world_size(), 1)
         self.wide_embedding.to_consistent(flow.env.all_device_placement("cuda"), flow.sbp.split(0))
         self.deep_embedding = Embedding(deep_vocab_size, deep_embedding_vec_size // flow.env.get_world_size())
@@ -82,11 +120,15 @@ class ConsistentWideAndDeep(nn.Module):
         self, dense_fields, wide_sparse_fields, deep_sparse_fields
     ) -> flow.Tensor:
         wide_sparse_fields = wide_sparse_fields.to_consistent(sbp=flow.sbp.broadcast)
+        if self.wide_id_mapper is not None:
+            wide_sparse_fields = self.wide_id_mapper(wide_sparse_fields)
         wide_embedding = self.wide_embedding(wide_sparse_fields)
         wide_embedding = wide_embedding.view(-1, wide_embedding.shape[-1] * wide_embedding.shape[-2])
         wide_scores = flow.sum(wide_embedding, dim=1, keepdim=True)
         wide_scores = wide_scores.to_consistent(sbp=flow.sbp.split(0), grad_sbp=flow.sbp.broadcast)
         deep_sparse_fields = deep_sparse_fields.to_consistent(sbp=flow.sbp.broadcast)
+        if self.deep_id_mapper is not None:
+            deep_sparse_fields = self.deep_id_mapper(deep_sparse_fields)
         deep_embedding = self.deep_embedding(deep_sparse_fields)
         deep_embedding = deep_embedding.to_consistent(sbp=flow.sbp.split(0), grad_sbp=flow.sbp.split(2))
         deep_embedding = deep_embedding.view(-1, deep_embedding.shape[-1] * deep_embedding.shape[-2])
@@ -102,15 +144,50 @@ class LocalWideAndDeep(nn.Module):
         wide_vocab_size: int,
         deep_vocab_size: int,
         deep_embedding_vec_size: int = 16,
+        num_wide_sparse_fields: int = 2,
         num_deep_sparse_fields: int = 26,
         num_dense_fields: int = 13,
         hidden_size: int = 1024,
         hidden_units_num: int = 7,
         deep_dropout_rate: float = 0.5,
+        wide_id_mapper=None,
+        deep_id_mapper=None,
+        embedding_cache_rows: int = 0,
+        embedding_cache_policy: str = "lru",
+        embedding_host_dir: str = "",
+        fused_embedding: bool = False,
     ):
         super(LocalWideAndDeep, self).__init__()
-        self.wide_embedding = Embedding(wide_vocab_size, 1,)
-        self.deep_embedding = Embedding(deep_vocab_size, deep_embedding_vec_size)
+        self.wide_id_mapper = wide_id_mapper
+        self.deep_id_mapper = deep_id_mapper
+        self.fused_embedding = fused_embedding
+
+        def make_table(vocab_size, embed_size, name):
+            if embedding_cache_rows <= 0:
+                return Embedding(vocab_size, embed_size)
+            host_table_file = None
+            if embedding_host_dir != "":
+                host_table_file = os.path.join(embedding_host_dir, f"{name}.bin")
+            return CachedEmbedding(
+                vocab_size,
+                embed_size,
+                embedding_cache_rows,
+                embedding_cache_policy,
+                host_table_file,
+            )
+
+        if fused_embedding:
+            self.sparse_embedding = FusedSparseEmbedding(
+                make_table(
+                    wide_vocab_size, deep_embedding_vec_size + 1, "sparse_embedding"
+                ),
+                num_wide_sparse_fields,
+            )
+        else:
+            self.wide_embedding = make_table(wide_vocab_size, 1, "wide_embedding")
+            self.deep_embedding = make_table(
+                deep_vocab_size, deep_embedding_vec_size, "deep_embedding"
+            )
         deep_feature_size = (
             deep_embedding_vec_size * num_deep_sparse_fields
             + num_dense_fields
@@ -133,43 +210,111 @@ class LocalWideAndDeep(nn.Module):
         self.deep_scores = nn.Linear(hidden_size, 1)
         self.sigmoid = nn.Sigmoid()
 
+    def prefetch(self, wide_sparse_fields, deep_sparse_fields):
+        """Starts gathering the missing embedding rows of the next batch from the host tables."""
+        wide_fields = (wide_sparse_fields, self.wide_id_mapper)
+        deep_fields = (deep_sparse_fields, self.deep_id_mapper)
+        if self.fused_embedding:
+            lookups = [(self.sparse_embedding.embedding, [wide_fields, deep_fields])]
+        else:
+            lookups = [
+                (self.wide_embedding, [wide_fields]),
+                (self.deep_embedding, [deep_fields]),
+            ]
+
+        def map_ids(ids, id_mapper):
+            if id_mapper is None:
+                return ids.numpy()
+            # the mapper runs on cuda, reading its result waits for the current step
+            return id_mapper(ids.to("cuda")).numpy()
+
+        for embedding, fields in lookups:
+            if isinstance(embedding, CachedEmbedding):
+                ids = [map_ids(ids, id_mapper) for ids, id_mapper in fields]
+                embedding.prefetch(np.concatenate(ids, axis=1))
 
     def forward(
         self, dense_fields, wide_sparse_fields, deep_sparse_fields
     ) -> flow.Tensor:
-        wide_embedding = self.wide_embedding(wide_sparse_fields)
-        wide_embedding = wide_embedding.view(-1, wide_embedding.shape[-1] * wide_embedding.shape[-2])
-        wide_scores = flow.sum(wide_embedding, dim=1, keepdim=True)
-        deep_embedding = self.deep_embedding(deep_sparse_fields)
-        deep_embedding = deep_embedding.view(-1, deep_embedding.shape[-1] * deep_embedding.shape[-2])
-        deep_features = flow.cat([deep_embedding, dense_fields], dim=1)
+        if self.wide_id_mapper is not None:
+            wide_sparse_fields = self.wide_id_mapper(wide_sparse_fields)
+        if self.deep_id_mapper is not None:
+            deep_sparse_fields = self.deep_id_mapper(deep_sparse_fields)
+        if self.fused_embedding:
+            wide_scores, deep_features = self.sparse_embedding(
+                dense_fields, wide_sparse_fields, deep_sparse_fields
+            )
+        else:
+            wide_embedding = self.wide_embedding(wide_sparse_fields)
+            wide_embedding = wide_embedding.view(
+                -1, wide_embedding.shape[-1] * wide_embedding.shape[-2]
+            )
+            wide_scores = flow.sum(wide_embedding, dim=1, keepdim=True)
+            deep_embedding = self.deep_embedding(deep_sparse_fields)
+            deep_embedding = deep_embedding.view(
+                -1, deep_embedding.shape[-1] * deep_embedding.shape[-2]
+            )
+            deep_features = flow.cat([deep_embedding, dense_fields], dim=1)
         deep_features = self.linear_layers(deep_features)
         deep_scores = self.deep_scores(deep_features)
         return self.sigmoid(wide_scores + deep_scores)
 
 
 def make_wide_and_deep_module(args, is_consistent):
+    # the wide table is split by rows in consistent mode
+    row_alignment = flow.env.get_world_size() if is_consistent else 1
+    wide_id_mapper, deep_id_mapper = make_id_mappers(args, row_alignment)
+    wide_vocab_size = args.wide_vocab_size
+    if wide_id_mapper is not None:
+        wide_vocab_size = wide_id_mapper.num_rows
+    deep_vocab_size = args.deep_vocab_size
+    if deep_id_mapper is not None:
+        deep_vocab_size = deep_id_mapper.num_rows
+    if args.fused_embedding:
+        assert not is_consistent, "fused embedding supports local models only"
+        assert (
+            wide_vocab_size == deep_vocab_size
+        ), "fused embedding needs wide and deep ids of one id space"
+
+    if flow.env.get_rank() == 0:
+        print_table_memory("wide_embedding", wide_vocab_size, 1, wide_id_mapper)
+        print_table_memory(
+            "deep_embedding",
+            deep_vocab_size,
+            args.deep_embedding_vec_size,
+            deep_id_mapper,
+        )
+
     if is_consistent:
         model = ConsistentWideAndDeep(
-            wide_vocab_size=args.wide_vocab_size,
-            deep_vocab_size=args.deep_vocab_size,
+            wide_vocab_size=wide_vocab_size,
+            deep_vocab_size=deep_vocab_size,
             deep_embedding_vec_size=args.deep_embedding_vec_size,
             num_deep_sparse_fields=args.num_deep_sparse_fields,
             num_dense_fields=args.num_dense_fields,
             hidden_size=args.hidden_size,
             hidden_units_num=args.hidden_units_num,
             deep_dropout_rate=args.deep_dropout_rate,
+            wide_id_mapper=wide_id_mapper,
+            deep_id_mapper=deep_id_mapper,
         )
     else:
         model = LocalWideAndDeep(
-            wide_vocab_size=args.wide_vocab_size,
-            deep_vocab_size=args.deep_vocab_size,
+            wide_vocab_size=wide_vocab_size,
+            deep_vocab_size=deep_vocab_size,
             deep_embedding_vec_size=args.deep_embedding_vec_size,
+            num_wide_sparse_fields=args.num_wide_sparse_fields,
             num_deep_sparse_fields=args.num_deep_sparse_fields,
             num_dense_fields=args.num_dense_fields,
             hidden_size=args.hidden_size,
             hidden_units_num=args.hidden_units_num,
             deep_dropout_rate=args.deep_dropout_rate,
+            wide_id_mapper=wide_id_mapper,
+            deep_id_mapper=deep_id_mapper,
+            embedding_cache_rows=args.embedding_cache_rows,
+            embedding_cache_policy=args.embedding_cache_policy,
+            embedding_host_dir=args.embedding_host_dir,
+            fused_embedding=args.fused_embedding,
         )
         model = model.to("cuda")
     return model
@@ -5,15 +5,16 @@ sys.path.append(
     os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
 )
 import numpy as np
-from sklearn.metrics import roc_auc_score
 import oneflow as flow
 from config import get_args
 from models.data import make_data_loader
+from models.embedding import CachedEmbedding
 from models.wide_and_deep import make_wide_and_deep_module
 from oneflow.nn.parallel import DistributedDataParallel as DDP
 from graph import WideAndDeepValGraph, WideAndDeepTrainGraph
 import warnings
 import utils.logger as log
+from utils.metrics import StreamingBinaryEvaluator
 
 
 class Trainer(object):
@@ -38,19 +39,36 @@ class Trainer(object):
         self.is_consistent = (
             flow.env.get_world_size() > 1 and not args.ddp
         ) or args.execution_mode == "graph"
+        if args.embedding_cache_rows > 0:
+            assert (
+                not self.is_consistent and not self.ddp
+            ), "embedding cache supports single device eager training only"
         self.rank = flow.env.get_rank()
         self.world_size = flow.env.get_world_size()
         self.cur_iter = 0
         self.eval_interval = args.eval_interval
         self.eval_batchs = args.eval_batchs
+        self.evaluator = StreamingBinaryEvaluator(args.eval_auc_bins)
         self.init_logger()
         self.train_dataloader = make_data_loader(args, "train", self.is_consistent, self.dataset_format)
         self.val_dataloader = make_data_loader(args, "val", self.is_consistent, self.dataset_format)
         self.wdl_module = make_wide_and_deep_module(args, self.is_consistent)
+        self.embedding_caches = {
+            name: module
+            for name, module in self.wdl_module.named_modules()
+            if isinstance(module, CachedEmbedding)
+        }
+        for name in self.embedding_caches:
+            self.train_logger.register_metric(
+                f"{name}_hit_rate", log.IterationMeter(), f"{name}_hit_rate: {{:.4f}}"
+            )
+        self.prefetched_batch = None
         self.init_model()
         self.opt = flow.optim.Adam(
             self.wdl_module.parameters(), lr=args.learning_rate
         )
+        for cache in self.embedding_caches.values():
+            cache.bind_optimizer(self.opt)
 
         self.loss = flow.nn.BCELoss(reduction="none").to("cuda")
         if self.execution_mode == "graph":
@@ -88,6 +106,12 @@ class Trainer(object):
         self.val_logger = log.make_logger(self.rank, print_ranks)
         self.val_logger.register_metric("iter", log.IterationMeter(), "iter: {}/{}")
         self.val_logger.register_metric("auc", log.IterationMeter(), "eval_auc: {}")
+        self.val_logger.register_metric(
+            "logloss", log.IterationMeter(), "eval_logloss: {:.6f}"
+        )
+        self.val_logger.register_metric(
+            "calibration", log.IterationMeter(), "eval_calibration: {:.4f}"
+        )
 
     def meter(
         self,
@@ -99,6 +123,9 @@ class Trainer(object):
             self.train_logger.meter("loss", loss)
         self.train_logger.meter("latency")
         if do_print:
+            for name, cache in self.embedding_caches.items():
+                self.train_logger.meter(f"{name}_hit_rate", cache.hit_rate)
+                cache.reset_stats()
             self.train_logger.print_metrics()
 
     def meter_train_iter(self, loss):
@@ -110,10 +137,10 @@ class Trainer(object):
             do_print=do_print,
         )
 
-    def meter_eval(self, auc):
+    def meter_eval(self, metrics):
         self.val_logger.meter("iter", (self.cur_iter, self.max_iter))
-        if auc is not None:
-            self.val_logger.meter("auc", auc)
+        for key, value in metrics.items():
+            self.val_logger.meter(key, value)
         self.val_logger.print_metrics()
 
 
@@ -126,6 +153,10 @@ class Trainer(object):
         else:
             return
         self.wdl_module.load_state_dict(state_dict)
+        for name, cache in self.embedding_caches.items():
+            cache.load_host_table(
+                np.load(f"{self.args.model_load_dir}.{name}.npy", mmap_mode="r")
+            )
 
     def save(self, subdir):
         if self.save_path is None or self.save_path == '':
@@ -138,6 +169,10 @@ class Trainer(object):
             flow.save(state_dict, save_path, consistent_dst_rank=0)
         elif self.rank == 0:
             flow.save(state_dict, save_path)
+            # the cache parameters are only valid together with the host tables
+            for name, cache in self.embedding_caches.items():
+                cache.flush()
+                np.save(f"{save_path}.{name}.npy", cache.host_table)
         else:
             return
 
@@ -164,18 +199,16 @@ class Trainer(object):
         if self.eval_batchs <= 0:
             return
         self.wdl_module.eval()
-        labels = np.array([[0]])
-        preds = np.array([[0]])
+        self.evaluator.reset()
         for _ in range(self.eval_batchs):
             if self.execution_mode == "graph":
-                pred, label = self.eval_graph()
+                pred, label = self.eval_graph(*self.graph_inputs(self.val_dataloader))
             else:
                 pred, label = self.inference()
-            label_ = label.numpy().astype(np.float32)
-            labels = np.concatenate((labels, label_), axis=0)
-            preds = np.concatenate((preds, pred.numpy()), axis=0)
-        auc = roc_auc_score(labels[1:], preds[1:])
-        self.meter_eval(auc)
+            self.evaluator.update(pred, label)
+        metrics = self.evaluator.compute()
+        auc = metrics["auc"]
+        self.meter_eval(metrics)
         if save_model:
             sub_save_dir = f"iter_{self.cur_iter}_val_auc_{auc}"
             self.save(sub_save_dir)
@@ -198,13 +231,19 @@ class Trainer(object):
             )
         return predicts, labels
 
+    def next_train_batch(self):
+        if self.prefetched_batch is None:
+            return self.train_dataloader()
+        batch, self.prefetched_batch = self.prefetched_batch, None
+        return batch
+
     def forward(self):
         (
             labels,
             dense_fields,
             wide_sparse_fields,
             deep_sparse_fields,
-        ) = self.train_dataloader()
+        ) = self.next_train_batch()
         labels = labels.to("cuda").to(dtype=flow.float32)
         dense_fields = dense_fields.to("cuda")
         wide_sparse_fields = wide_sparse_fields.to("cuda")
@@ -212,6 +251,10 @@ class Trainer(object):
         predicts = self.wdl_module(
             dense_fields, wide_sparse_fields, deep_sparse_fields
         )
+        if self.embedding_caches:
+            # rows of the next batch are gathered from the host tables while this step runs
+            self.prefetched_batch = self.train_dataloader()
+            self.wdl_module.prefetch(self.prefetched_batch[2], self.prefetched_batch[3])
         loss = self.loss(predicts, labels)
         reduce_loss = flow.mean(loss)
         return reduce_loss
@@ -223,10 +266,16 @@ class Trainer(object):
         self.opt.zero_grad()
         return loss
 
+    def graph_inputs(self, dataloader):
+        # the columnar reader runs in python and can not be traced into the graphs
+        if self.dataset_format == "columnar":
+            return dataloader()
+        return ()
+
     def train_one_step(self):
         self.wdl_module.train()
         if self.execution_mode == "graph":
-            train_loss = self.train_graph()
+            train_loss = self.train_graph(*self.graph_inputs(self.train_dataloader))
         else:
             train_loss = self.train_eager()
         return train_loss
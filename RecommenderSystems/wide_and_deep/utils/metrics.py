@@ -0,0 +1,82 @@
+import numpy as np
+import oneflow as flow
+
+
+__all__ = ["StreamingBinaryEvaluator"]
+
+
+def _local_shard(tensor):
+    # each rank accumulates its own samples, the histograms are summed afterwards
+    if tensor.is_consistent:
+        tensor = tensor.to_consistent(sbp=flow.sbp.split(0)).to_local()
+    return tensor.flatten().to(dtype=flow.float64)
+
+
+class StreamingBinaryEvaluator(object):
+    """
+    Accumulates histograms of the predicted scores of the positive and negative
+    samples on the device, so the AUC, log loss and calibration (predicted / observed
+    CTR) of any number of eval batches take constant memory and one host sync.
+    Pairs that fall into the same of the `num_bins` score bins count as ties.
+    """
+
+    def __init__(self, num_bins=1 << 16, eps=1e-7):
+        self.num_bins = num_bins
+        self.eps = eps
+        self.reset()
+
+    def reset(self):
+        self.pos_hist = None
+        self.neg_hist = None
+        # log loss and predicted score sums
+        self.sums = None
+
+    def update(self, preds, labels):
+        preds = _local_shard(preds)
+        labels = _local_shard(labels)
+        if self.pos_hist is None:
+            self.pos_hist = flow.zeros(
+                self.num_bins, dtype=flow.float64, device=preds.device
+            )
+            self.neg_hist = flow.zeros_like(self.pos_hist)
+            self.sums = flow.zeros(2, dtype=flow.float64, device=preds.device)
+
+        bins = flow.clamp(
+            (preds * self.num_bins).to(dtype=flow.int64), 0, self.num_bins - 1
+        )
+        self.pos_hist = flow.scatter_add(self.pos_hist, 0, bins, labels)
+        self.neg_hist = flow.scatter_add(self.neg_hist, 0, bins, 1 - labels)
+        probs = flow.clamp(preds, self.eps, 1 - self.eps)
+        log_loss = -flow.sum(
+            labels * flow.log(probs) + (1 - labels) * flow.log(1 - probs)
+        )
+        self.sums = self.sums + flow.stack([log_loss, flow.sum(preds)])
+
+    def compute(self):
+        """Returns a dict of auc, logloss and calibration over all updates of all ranks."""
+        if self.pos_hist is None:
+            return {"auc": float("nan"), "logloss": float("nan"), "calibration": 0.0}
+
+        stats = flow.cat([self.pos_hist, self.neg_hist, self.sums])
+        if flow.env.get_world_size() > 1:
+            flow.comm.all_reduce(stats)
+        stats = stats.numpy()
+        pos_hist = stats[: self.num_bins]
+        neg_hist = stats[self.num_bins : 2 * self.num_bins]
+        log_loss_sum, pred_sum = stats[2 * self.num_bins :]
+
+        num_pos = pos_hist.sum()
+        num_neg = neg_hist.sum()
+        # walk the bins from the highest score, a negative ranks below every
+        # positive of a higher bin and half of the positives of its own bin
+        pos_hist, neg_hist = pos_hist[::-1], neg_hist[::-1]
+        pos_above = np.cumsum(pos_hist) - pos_hist
+        if num_pos > 0 and num_neg > 0:
+            auc = np.sum(neg_hist * (pos_above + 0.5 * pos_hist)) / (num_pos * num_neg)
+        else:
+            auc = float("nan")
+        return {
+            "auc": float(auc),
+            "logloss": float(log_loss_sum / (num_pos + num_neg)),
+            "calibration": float(pred_sum / num_pos) if num_pos > 0 else float("inf"),
+        }
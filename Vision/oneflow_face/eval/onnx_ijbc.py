@@ -106,68 +106,72 @@ def read_image_feature(path):
     return img_feats
 
 
+def _segment_starts(*keys):
+    """Start indices of the runs of equal keys in sorted arrays."""
+    change = np.zeros(len(keys[0]), dtype=bool)
+    change[0] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(change)
+
+
+def _segment_sum(values, starts):
+    """
+    Sums the rows of values in the segments [starts[i], starts[i + 1]). Row k of all
+    segments longer than k is added at once, so the loop runs over the length of the
+    longest segment; np.add.reduceat over rows is much slower for short segments.
+    """
+    lengths = np.diff(np.append(starts, len(values)))
+    sums = values[starts].copy()
+    by_length = np.argsort(-lengths, kind="stable")
+    neg_sorted_lengths = -lengths[by_length]
+    for k in range(1, -neg_sorted_lengths[0]):
+        longer = by_length[: np.searchsorted(neg_sorted_lengths, -k, side="left")]
+        sums[longer] += values[starts[longer] + k]
+    return sums, lengths
+
+
 def image2template_feature(img_feats=None, templates=None, medias=None):
-    unique_templates = np.unique(templates)
-    template_feats = np.zeros((len(unique_templates), img_feats.shape[1]))
-    for count_template, uqt in enumerate(unique_templates):
-        (ind_t,) = np.where(templates == uqt)
-        face_norm_feats = img_feats[ind_t]
-        face_medias = medias[ind_t]
-        unique_medias, unique_media_counts = np.unique(face_medias, return_counts=True)
-        media_norm_feats = []
-        for u, ct in zip(unique_medias, unique_media_counts):
-            (ind_m,) = np.where(face_medias == u)
-            if ct == 1:
-                media_norm_feats += [face_norm_feats[ind_m]]
-            else:  # image features from the same video will be aggregated into one feature
-                media_norm_feats += [
-                    np.mean(face_norm_feats[ind_m], axis=0, keepdims=True),
-                ]
-        media_norm_feats = np.array(media_norm_feats)
-        template_feats[count_template] = np.sum(media_norm_feats, axis=0)
-        if count_template % 2000 == 0:
-            print("Finish Calculating {} template features.".format(count_template))
+    """
+    Averages the image features of every media (frames of one video) and sums the
+    media features of every template. The images are sorted by (template, media)
+    once and both poolings reduce segments of the sorted rows.
+    """
+    unique_templates, template_ids = np.unique(templates, return_inverse=True)
+    order = np.lexsort((medias, template_ids))
+    template_ids = template_ids[order]
+    medias = medias[order]
+
+    media_starts = _segment_starts(template_ids, medias)
+    media_feats, media_counts = _segment_sum(img_feats[order], media_starts)
+    media_feats /= media_counts[:, np.newaxis]
+
+    template_feats, _ = _segment_sum(
+        media_feats, _segment_starts(template_ids[media_starts])
+    )
+    print("Finish Calculating {} template features.".format(len(unique_templates)))
     template_norm_feats = normalize(template_feats)
     return template_norm_feats, unique_templates
 
 
-def verification(template_norm_feats=None, unique_templates=None, p1=None, p2=None):
-    template2id = np.zeros((max(unique_templates) + 1, 1), dtype=int)
-    for count_template, uqt in enumerate(unique_templates):
-        template2id[uqt] = count_template
-    score = np.zeros((len(p1),))
-    total_pairs = np.array(range(len(p1)))
-    batchsize = 100000
-    sublists = [total_pairs[i : i + batchsize] for i in range(0, len(p1), batchsize)]
-    total_sublists = len(sublists)
-    for c, s in enumerate(sublists):
-        feat1 = template_norm_feats[template2id[p1[s]]]
-        feat2 = template_norm_feats[template2id[p2[s]]]
-        similarity_score = np.sum(feat1 * feat2, -1)
-        score[s] = similarity_score.flatten()
-        if c % 10 == 0:
-            print("Finish {}/{} pairs.".format(c, total_sublists))
+def verification(
+    template_norm_feats=None, unique_templates=None, p1=None, p2=None, batchsize=100000
+):
+    """Cosine similarity of the template pairs, scored in blocks of batchsize pairs."""
+    # unique_templates is sorted
+    id1 = np.searchsorted(unique_templates, p1)
+    id2 = np.searchsorted(unique_templates, p2)
+    score = np.empty((len(p1),))
+    for i in range(0, len(p1), batchsize):
+        score[i : i + batchsize] = np.einsum(
+            "ij,ij->i",
+            template_norm_feats[id1[i : i + batchsize]],
+            template_norm_feats[id2[i : i + batchsize]],
+        )
     return score
 
 
-def verification2(template_norm_feats=None, unique_templates=None, p1=None, p2=None):
-    template2id = np.zeros((max(unique_templates) + 1, 1), dtype=int)
-    for count_template, uqt in enumerate(unique_templates):
-        template2id[uqt] = count_template
-    score = np.zeros((len(p1),))  # save cosine distance between pairs
-    total_pairs = np.array(range(len(p1)))
-    # small batchsize instead of all pairs in one batch due to the memory limiation
-    batchsize = 100000
-    sublists = [total_pairs[i : i + batchsize] for i in range(0, len(p1), batchsize)]
-    total_sublists = len(sublists)
-    for c, s in enumerate(sublists):
-        feat1 = template_norm_feats[template2id[p1[s]]]
-        feat2 = template_norm_feats[template2id[p2[s]]]
-        similarity_score = np.sum(feat1 * feat2, -1)
-        score[s] = similarity_score.flatten()
-        if c % 10 == 0:
-            print("Finish {}/{} pairs.".format(c, total_sublists))
-    return score
+verification2 = verification
 
 
 def main(args):
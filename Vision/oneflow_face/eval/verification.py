@@ -24,9 +24,12 @@
 # SOFTWARE.
 
 
+import collections
 import datetime
+import fcntl
 import os
 import pickle
+from concurrent.futures import ThreadPoolExecutor
 
 
 import numpy as np
@@ -87,27 +90,47 @@ def calculate_roc(
             dist = np.sum(np.square(diff), 1)
 
         # Find the best threshold for the fold
-        acc_train = np.zeros((nrof_thresholds))
-        for threshold_idx, threshold in enumerate(thresholds):
-            _, _, acc_train[threshold_idx] = calculate_accuracy(
-                threshold, dist[train_set], actual_issame[train_set]
-            )
+        _, _, acc_train = calculate_accuracies(
+            thresholds, dist[train_set], actual_issame[train_set]
+        )
         best_threshold_index = np.argmax(acc_train)
-        for threshold_idx, threshold in enumerate(thresholds):
-            (
-                tprs[fold_idx, threshold_idx],
-                fprs[fold_idx, threshold_idx],
-                _,
-            ) = calculate_accuracy(threshold, dist[test_set], actual_issame[test_set])
-        _, _, accuracy[fold_idx] = calculate_accuracy(
-            thresholds[best_threshold_index], dist[test_set], actual_issame[test_set]
+        tprs[fold_idx], fprs[fold_idx], acc_test = calculate_accuracies(
+            thresholds, dist[test_set], actual_issame[test_set]
         )
+        accuracy[fold_idx] = acc_test[best_threshold_index]
 
     tpr = np.mean(tprs, 0)
     fpr = np.mean(fprs, 0)
     return tpr, fpr, accuracy
 
 
+def count_accepts(thresholds, dist, actual_issame):
+    """
+    Counts the true and false accepts (dist < threshold) of all thresholds at once:
+    the distances are sorted once, the accepts of a threshold are the pairs sorted
+    before it and the true accepts among them a cumulative sum of actual_issame.
+    """
+    order = np.argsort(dist, kind="stable")
+    sorted_issame = np.asarray(actual_issame, dtype=bool)[order]
+    accepts = np.searchsorted(dist[order], thresholds, side="left")
+    true_accepts = np.concatenate(([0], np.cumsum(sorted_issame)))[accepts]
+    false_accepts = accepts - true_accepts
+    n_same = int(np.sum(sorted_issame))
+    n_diff = len(sorted_issame) - n_same
+    return true_accepts, false_accepts, n_same, n_diff
+
+
+def calculate_accuracies(thresholds, dist, actual_issame):
+    """calculate_accuracy of every threshold, returns arrays of tpr, fpr and acc."""
+    tp, fp, n_same, n_diff = count_accepts(thresholds, dist, actual_issame)
+    tn = n_diff - fp
+    zeros = np.zeros(len(thresholds))
+    tpr = tp / n_same if n_same > 0 else zeros
+    fpr = fp / n_diff if n_diff > 0 else zeros
+    acc = (tp + tn) / dist.size
+    return tpr, fpr, acc
+
+
 def calculate_accuracy(threshold, dist, actual_issame):
     predict_issame = np.less(dist, threshold)
     tp = np.sum(np.logical_and(predict_issame, actual_issame))
@@ -129,7 +152,6 @@ def calculate_val(
     assert embeddings1.shape[0] == embeddings2.shape[0]
     assert embeddings1.shape[1] == embeddings2.shape[1]
     nrof_pairs = min(len(actual_issame), embeddings1.shape[0])
-    nrof_thresholds = len(thresholds)
     k_fold = LFold(n_splits=nrof_folds, shuffle=False)
 
     val = np.zeros(nrof_folds)
@@ -142,11 +164,10 @@ def calculate_val(
     for fold_idx, (train_set, test_set) in enumerate(k_fold.split(indices)):
 
         # Find the threshold that gives FAR = far_target
-        far_train = np.zeros(nrof_thresholds)
-        for threshold_idx, threshold in enumerate(thresholds):
-            _, far_train[threshold_idx] = calculate_val_far(
-                threshold, dist[train_set], actual_issame[train_set]
-            )
+        _, false_accepts, _, n_diff = count_accepts(
+            thresholds, dist[train_set], actual_issame[train_set]
+        )
+        far_train = false_accepts / float(n_diff)
         if np.max(far_train) >= far_target:
             f = interpolate.interp1d(far_train, thresholds, kind="slinear")
             threshold = f(far_target)
@@ -201,28 +222,121 @@ def evaluate(embeddings, actual_issame, nrof_folds=10, pca=0):
     return tpr, fpr, accuracy, val, val_std, far
 
 
-def load_bin_cv(path, image_size):
+def _decode_images(bins):
+    # BGR to RGB, HWC uint8
+    return np.stack([cv.imdecode(_bin, cv.IMREAD_COLOR)[:, :, ::-1] for _bin in bins])
+
+
+def _normalize(images, dtype):
+    images = images.transpose((0, 3, 1, 2))
+    return ((images - 127.5) * 0.00784313725).astype(dtype)
+
+
+def _decode_bin(bins, image_size, out, num_workers, chunk_size=256):
+    """Decodes the images of a .bin set into out[flip], shape (2, N, 3, H, W)."""
+    num_images = out.shape[1]
+    chunks = [bins[i : i + chunk_size] for i in range(0, num_images, chunk_size)]
+    # threads instead of forked processes, cv.imdecode releases the GIL and forking
+    # a process with an initialized oneflow runtime is not safe
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        begin = 0
+        for images in executor.map(_decode_images, chunks):
+            assert images.shape[1:3] == tuple(
+                image_size
+            ), f"got {images.shape[1:3]} images, expected {image_size}"
+            end = begin + len(images)
+            out[0, begin:end] = _normalize(images, out.dtype)
+            out[1, begin:end] = _normalize(images[:, :, ::-1], out.dtype)
+            logging.info("loading bin:%d", end)
+            begin = end
+
+
+def load_bin_cv(path, image_size, num_workers=8, cache_dtype=np.float32):
+    """
+    Returns the normalized images of both flips, numpy arrays of shape (N, 3, H, W),
+    and the issame list of a verification .bin set. The images are decoded by a
+    thread pool once and cached next to the .bin, later calls memory-map the cache.
+    When the cache can not be written, the set is decoded in memory.
+    """
+    cache_dtype = np.dtype(cache_dtype)
+    root = os.path.splitext(path)[0]
+    cache_path = f"{root}_{image_size[0]}x{image_size[1]}_{cache_dtype.name}.npy"
+    issame_path = f"{root}_issame.npy"
+
+    def cache_is_valid():
+        return (
+            os.path.exists(cache_path)
+            and os.path.exists(issame_path)
+            and os.path.getmtime(cache_path) >= os.path.getmtime(path)
+        )
+
+    if not cache_is_valid():
+        try:
+            # ranks sharing a file system decode the set once
+            with open(cache_path + ".lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not cache_is_valid():
+                    _build_bin_cache(
+                        path,
+                        image_size,
+                        cache_path,
+                        issame_path,
+                        num_workers,
+                        cache_dtype,
+                    )
+        except OSError as e:
+            # e.g. the sets are on a read-only mount
+            logging.warning("can not cache %s (%s), decoding in memory", path, e)
+            return _load_bin_in_memory(path, image_size, num_workers, cache_dtype)
+
+    data = np.load(cache_path, mmap_mode="r")
+    issame_list = np.load(issame_path).tolist()
+    logging.info(data[0].shape)
+    return [data[0], data[1]], issame_list
+
+
+def _load_bin_in_memory(path, image_size, num_workers, dtype):
+    bins, issame_list = pickle.load(open(path, "rb"), encoding="bytes")
+    data = np.empty(
+        (2, len(issame_list) * 2, 3, image_size[0], image_size[1]), dtype=dtype
+    )
+    _decode_bin(bins, image_size, data, num_workers)
+    return [data[0], data[1]], list(issame_list)
+
+
+def _build_bin_cache(path, image_size, cache_path, issame_path, num_workers, dtype):
     bins, issame_list = pickle.load(open(path, "rb"), encoding="bytes")
-    data_list = []
-    for flip in [0, 1]:
-        data = flow.empty(len(issame_list) * 2, 3, image_size[0], image_size[1])
-        data_list.append(data)
-    for i in range(len(issame_list) * 2):
-        _bin = bins[i]
-        img_ori = cv.imdecode(_bin, cv.IMREAD_COLOR)[:, :, ::-1]
-
-        for flip in [0, 1]:
-            img = img_ori.copy()
-            if flip == 1:
-                img = cv.flip(img, 1)
-            img = np.array(img).transpose((2, 0, 1))
-            img = (img - 127.5) * 0.00784313725
-            data_list[flip][i] = flow.tensor(img, dtype=flow.float)
-
-        if i % 1000 == 0:
-            logging.info("loading bin:%d", i)
-    logging.info(data_list[0].shape)
-    return data_list, issame_list
+    shape = (2, len(issame_list) * 2, 3, image_size[0], image_size[1])
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        data = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=shape)
+        _decode_bin(bins, image_size, data, num_workers)
+        data.flush()
+        del data
+        np.save(issame_path, np.asarray(issame_list, dtype=bool))
+        # readers only ever see a complete cache
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _host_batches(data, starts, begin, end, num_prefetch=2):
+    """Yields data[start + begin : start + end] as float32 arrays, read ahead on a thread."""
+
+    def read(start):
+        return np.ascontiguousarray(data[start + begin : start + end], dtype=np.float32)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = collections.deque(
+            executor.submit(read, start) for start in starts[:num_prefetch]
+        )
+        for i in range(len(starts)):
+            batch = pending.popleft().result()
+            if i + num_prefetch < len(starts):
+                pending.append(executor.submit(read, starts[i + num_prefetch]))
+            yield batch
 
 
 @flow.no_grad()
@@ -231,56 +345,69 @@ def test(data_set, backbone, batch_size, nfolds=10, is_consistent=False):
     data_list = data_set[0]
     issame_list = data_set[1]
     embeddings_list = []
-    time_consumed = 0.0
+    num_images = data_list[0].shape[0]
     if is_consistent:
         placement = flow.env.all_device_placement("cpu")
         sbp = flow.sbp.split(0)
-
-    for i in range(len(data_list)):
-        data = data_list[i]
+        world_size = flow.env.get_world_size()
+        rank = flow.env.get_rank()
+    else:
+        world_size = 1
+        rank = 0
+    # batches keep one shape for the graph, the last one overlaps the previous,
+    # every rank feeds its own part of a batch
+    batch_size = max(min(batch_size, num_images) // world_size, 1) * world_size
+    local_batch_size = batch_size // world_size
+    ranges = [
+        (ba, min(ba + batch_size, num_images))
+        for ba in range(0, num_images, batch_size)
+    ]
+    starts = [bb - batch_size for _, bb in ranges]
+
+    def copy_embeddings(embeddings, ba, bb, net_out):
+        if is_consistent:
+            net_out = net_out.to_consistent(sbp=flow.sbp.broadcast).to_local()
+        _embeddings = net_out.numpy()
+        if embeddings is None:
+            embeddings = np.empty((num_images, _embeddings.shape[1]), dtype=np.float32)
+        embeddings[ba:bb, :] = _embeddings[ba - (bb - batch_size) :, :]
+        return embeddings
+
+    time0 = datetime.datetime.now()
+    for data in data_list:
         embeddings = None
-        ba = 0
-        while ba < data.shape[0]:
-            bb = min(ba + batch_size, data.shape[0])
-            count = bb - ba
-            img = data[bb - batch_size : bb]
-            time0 = datetime.datetime.now()
-            with flow.no_grad():
-                if is_consistent:
-                    img = img.to_consistent(placement=placement, sbp=sbp)
-                net_out = backbone(img.to("cuda"))
-
+        pending = None
+        batches = _host_batches(
+            data, starts, rank * local_batch_size, (rank + 1) * local_batch_size
+        )
+        for (ba, bb), img in zip(ranges, batches):
+            img = flow.tensor(img)
             if is_consistent:
-                _embeddings = net_out.to_local().numpy()
-            else:
-                _embeddings = net_out.detach().numpy()
-            time_now = datetime.datetime.now()
-            diff = time_now - time0
-            time_consumed += diff.total_seconds()
-            if embeddings is None:
-                embeddings = np.zeros((data.shape[0], _embeddings.shape[1]))
-            embeddings[ba:bb, :] = _embeddings[(batch_size - count) :, :]
-            ba = bb
+                img = img.to_consistent(placement=placement, sbp=sbp)
+            net_out = backbone(img.to("cuda"))
+            # copy out the previous batch while this one runs on the device
+            if pending is not None:
+                embeddings = copy_embeddings(embeddings, *pending)
+            pending = (ba, bb, net_out)
+        embeddings = copy_embeddings(embeddings, *pending)
         embeddings_list.append(embeddings)
+    time_consumed = (datetime.datetime.now() - time0).total_seconds()
 
-    _xnorm = 0.0
-    _xnorm_cnt = 0
-    for embed in embeddings_list:
-        for i in range(embed.shape[0]):
-            _em = embed[i]
-            _norm = np.linalg.norm(_em)
-            _xnorm += _norm
-            _xnorm_cnt += 1
-    _xnorm /= _xnorm_cnt
+    _xnorm = np.mean(
+        np.linalg.norm(np.concatenate(embeddings_list), axis=1), dtype=np.float64
+    )
 
     embeddings = embeddings_list[0].copy()
     embeddings = sklearn.preprocessing.normalize(embeddings)
     acc1 = 0.0
     std1 = 0.0
-    embeddings = embeddings_list[0] + embeddings_list[1]
+    embeddings = embeddings_list[0].astype(np.float64) + embeddings_list[1]
     embeddings = sklearn.preprocessing.normalize(embeddings)
     logging.info(embeddings.shape)
-    logging.info("infer time:%f" % time_consumed)
+    logging.info(
+        "infer time:%f, %.1f images/sec"
+        % (time_consumed, len(data_list) * num_images / time_consumed)
+    )
     _, _, accuracy, val, val_std, far = evaluate(
         embeddings, issame_list, nrof_folds=nfolds
     )
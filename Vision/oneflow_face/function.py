@@ -183,7 +183,13 @@ class Trainer(object):
         )
         # val
         self.callback_verification = CallBackVerification(
-            600, rank, cfg.val_targets, cfg.ofrecord_path, is_consistent=cfg.graph
+            600,
+            rank,
+            cfg.val_targets,
+            cfg.ofrecord_path,
+            is_consistent=cfg.graph,
+            batch_size=cfg.val_batch_size,
+            cache_dtype=cfg.val_cache_dtype,
         )
         # save checkpoint
         self.callback_checkpoint = CallBackModelCheckpoint(rank, cfg.output)
@@ -256,6 +262,8 @@ class Trainer(object):
 
     def train_eager(self):
         self.train_module = ddp(self.train_module)
+        # the graph shares the parameters of the backbone trained in eager mode
+        val_graph = EvalGraph(self.backbone, self.cfg)
         for epoch in range(self.start_epoch, self.cfg.num_epoch):
             self.train_module.train()
 
@@ -281,6 +289,6 @@ class Trainer(object):
                     False,
                     self.scheduler.get_last_lr()[0],
                 )
-                self.callback_verification(self.global_step, self.backbone)
+                self.callback_verification(self.global_step, self.backbone, val_graph)
                 self.scheduler.step()
             self.callback_checkpoint(self.global_step, epoch, self.train_module)
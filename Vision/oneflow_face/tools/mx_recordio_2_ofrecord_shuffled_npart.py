@@ -1,10 +1,15 @@
 import os
 import sys
+import json
+import queue
 import struct
 import argparse
 import numbers
-import random
+import threading
+import time
+import multiprocessing
 
+import numpy as np
 from mxnet import recordio
 import oneflow.core.record.record_pb2 as of_record
 
@@ -27,6 +32,21 @@ def parse_arguement(argv):
     parser.add_argument(
         "--num_part", type=int, default=96, help="num_part of OFRecord to generate.",
     )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Processes converting parts in parallel.",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the global shuffle.",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=1024,
+        help="Records a worker reads ahead of the serialization.",
+    )
     return parser.parse_args(argv)
 
 
@@ -112,44 +132,140 @@ def convert_to_ofrecord(img_data):
     return example
 
 
+_IMGREC = None
+
+
+def _init_worker(data_dir):
+    global _IMGREC
+    # every worker reads through its own file handles
+    path_imgrec = os.path.join(data_dir, "train.rec")
+    _IMGREC = recordio.MXIndexedRecordIO(
+        path_imgrec[0:-4] + ".idx", path_imgrec, "r", key_type=int
+    )
+
+
+def _read_records(indices, records, errors):
+    # reading runs in a thread, so the disk is busy while the protobufs are built
+    try:
+        for idx in indices:
+            records.put(_IMGREC.read_idx(int(idx)))
+    except Exception as e:
+        errors.append(e)
+    finally:
+        records.put(None)
+
+
+def _convert_part(task):
+    output_file, indices, prefetch = task
+    records = queue.Queue(maxsize=prefetch)
+    errors = []
+    reader = threading.Thread(target=_read_records, args=(indices, records, errors))
+    reader.daemon = True
+    reader.start()
+
+    # the part only appears under its final name once it is complete
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "wb", buffering=1 << 22) as f:
+        while True:
+            rec = records.get()
+            if rec is None:
+                break
+            header, s = recordio.unpack(rec)
+            label = header.label
+            if not isinstance(label, numbers.Number):
+                label = label[0]
+            example = convert_to_ofrecord({"label": int(label), "pixel_data": s})
+            serialized = example.SerializeToString()
+            f.write(struct.pack("q", len(serialized)))
+            f.write(serialized)
+    reader.join()
+    if errors:
+        raise errors[0]
+    os.replace(tmp_file, output_file)
+    return len(indices)
+
+
+def check_or_write_meta(output_dir, meta):
+    """Refuses to resume into parts written with a different shuffle or layout."""
+    meta_file = os.path.join(output_dir, "_META.json")
+    if os.path.exists(meta_file):
+        with open(meta_file, "r") as f:
+            previous = json.load(f)
+        if previous != meta:
+            raise ValueError(
+                "{} was converted with {}, remove it or pass the same arguments "
+                "to resume".format(output_dir, previous)
+            )
+    else:
+        with open(meta_file, "w") as f:
+            json.dump(meta, f)
+
+
 def main(args):
     # Convert recordio to ofrecord
     imgrec, imgidx_list = load_train_data(data_dir=args.data_dir)
-    imgidx_list = list(imgidx_list)
-    random.shuffle(imgidx_list)
+    imgrec.close()
+    # the global shuffle is computed once here, every part is a slice of it
+    imgidx_list = np.random.RandomState(args.seed).permutation(
+        np.asarray(imgidx_list, dtype=np.int64)
+    )
 
     output_dir = os.path.join(args.output_filepath, "train")
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     num_images = len(imgidx_list)
-    num_images_per_part = (num_images + args.num_part) // args.num_part
-    print("num_images", num_images, "num_images_per_part", num_images_per_part)
+    check_or_write_meta(
+        output_dir,
+        {"num_images": num_images, "num_part": args.num_part, "seed": args.seed},
+    )
+    print("num_images", num_images, "num_part", args.num_part)
 
+    tasks = []
+    num_done = 0
     for part_id in range(args.num_part):
         part_name = "part-" + "{:0>5d}".format(part_id)
         output_file = os.path.join(output_dir, part_name)
-        file_idx_start = part_id * num_images_per_part
-        file_idx_end = min((part_id + 1) * num_images_per_part, num_images)
-        print("part-" + str(part_id), "start", file_idx_start, "end", file_idx_end)
-        with open(output_file, "wb") as f:
-            for file_idx in range(file_idx_start, file_idx_end):
-                idx = imgidx_list[file_idx]
-                if idx % 10000 == 0:
-                    print("Converting images: {} of {}".format(idx, len(imgidx_list)))
-
-                img_data = {}
-                rec = imgrec.read_idx(idx)
-                header, s = recordio.unpack(rec)
-                label = header.label
-                if not isinstance(label, numbers.Number):
-                    label = label[0]
-                img_data["label"] = int(label)
-                img_data["pixel_data"] = s
-
-                example = convert_to_ofrecord(img_data)
-                size = example.ByteSize()
-                f.write(struct.pack("q", size))
-                f.write(example.SerializeToString())
+        file_idx_start = part_id * num_images // args.num_part
+        file_idx_end = (part_id + 1) * num_images // args.num_part
+        if os.path.exists(output_file):
+            # finished by an earlier run
+            num_done += file_idx_end - file_idx_start
+            continue
+        tasks.append(
+            (output_file, imgidx_list[file_idx_start:file_idx_end], args.prefetch)
+        )
+    print(
+        "converting {} parts, {} done before".format(
+            len(tasks), args.num_part - len(tasks)
+        )
+    )
+
+    start = time.time()
+    num_converted = 0
+    with multiprocessing.Pool(
+        min(args.num_workers, max(len(tasks), 1)),
+        initializer=_init_worker,
+        initargs=(args.data_dir,),
+    ) as pool:
+        for i, num_records in enumerate(
+            pool.imap_unordered(_convert_part, tasks), start=1
+        ):
+            num_converted += num_records
+            elapsed = time.time() - start
+            speed = num_converted / elapsed
+            remaining = num_images - num_done - num_converted
+            print(
+                "{}/{} parts, {} of {} images, {:.0f} records/s, eta {:.0f}s".format(
+                    i,
+                    len(tasks),
+                    num_done + num_converted,
+                    num_images,
+                    speed,
+                    remaining / speed,
+                )
+            )
+
+    open(os.path.join(output_dir, "_SUCCESS"), "w").close()
 
 
 if __name__ == "__main__":
@@ -19,6 +19,8 @@ class CallBackVerification(object):
         image_size=(112, 112),
         world_size=1,
         is_consistent=False,
+        batch_size=256,
+        cache_dtype="float32",
     ):
         self.frequent: int = frequent
         self.rank: int = rank
@@ -28,6 +30,8 @@ class CallBackVerification(object):
         self.ver_name_list: List[str] = []
         self.world_size = world_size
         self.is_consistent = is_consistent
+        self.batch_size = batch_size
+        self.cache_dtype = cache_dtype
 
         if self.is_consistent:
             self.init_dataset(
@@ -44,7 +48,7 @@ class CallBackVerification(object):
         for i in range(len(self.ver_list)):
 
             acc1, std1, acc2, std2, xnorm, embeddings_list = verification.test(
-                self.ver_list[i], backbone, 10, 10, self.is_consistent
+                self.ver_list[i], backbone, self.batch_size, 10, self.is_consistent
             )
             logging.info(
                 "[%s][%d]XNorm: %f" % (self.ver_name_list[i], global_step, xnorm)
@@ -66,7 +70,9 @@ class CallBackVerification(object):
         for name in val_targets:
             path = os.path.join(data_dir, "val", name + ".bin")
             if os.path.exists(path):
-                data_set = verification.load_bin_cv(path, image_size)
+                data_set = verification.load_bin_cv(
+                    path, image_size, cache_dtype=self.cache_dtype
+                )
                 self.ver_list.append(data_set)
                 self.ver_name_list.append(name)
         if len(self.ver_list) == 0:
@@ -82,7 +88,9 @@ class CallBackVerification(object):
         else:
             if self.rank is 0 and num_update > 0 and num_update % self.frequent == 0:
                 backbone.eval()
-                self.ver_test(backbone, num_update)
+                self.ver_test(
+                    backbone if backbone_graph is None else backbone_graph, num_update
+                )
                 backbone.train()
 
 
@@ -1,5 +1,5 @@
-from .roi_align import RoIAlign
-from .nms import nms
+from .roi_align import RoIAlign, MultiScaleRoIAlign
+from .nms import nms, batched_nms
 
 
 def lib_path():
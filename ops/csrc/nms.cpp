@@ -1,3 +1,6 @@
+#include <algorithm>
+#include <cstring>
+#include <vector>
 #include "oneflow/core/framework/framework.h"
 
 namespace oneflow {
@@ -20,4 +23,113 @@ REGISTER_USER_OP("nms")
     .SetGetSbpFn(user_op::GetSbpFnUtil::DefaultBroadcastToBroadcast);
 ;
 
+namespace {
+
+constexpr int kBlockSize = sizeof(int64_t) * 8;
+
+template<typename T>
+inline T CeilDiv(T a, T b) {
+  return (a + b - 1) / b;
+}
+
+template<typename T>
+inline T IoU(T const* const a, T const* const b) {
+  T interS = std::max<T>(std::min(a[2], b[2]) - std::max(a[0], b[0]), 0)
+             * std::max<T>(std::min(a[3], b[3]) - std::max(a[1], b[1]), 0);
+  T Sa = (a[2] - a[0]) * (a[3] - a[1]);
+  T Sb = (b[2] - b[0]) * (b[3] - b[1]);
+  return interS / (Sa + Sb - interS);
+}
+
+// Same layout as the CUDA kernel: bit j of suppression_bmask_matrix[i * num_blocks + col] is set
+// if box i overlaps box col * kBlockSize + j (only for boxes after i). Every row block is an
+// independent task and is compared against one 64-box column tile at a time.
+template<typename T>
+void CalcSuppressionBitmaskMatrix(int num_boxes, float iou_threshold, const T* boxes,
+                                  int64_t* suppression_bmask_matrix) {
+  const int num_blocks = CeilDiv<int>(num_boxes, kBlockSize);
+#pragma omp parallel for schedule(dynamic)
+  for (int row = 0; row < num_blocks; ++row) {
+    const int row_size = std::min(num_boxes - row * kBlockSize, kBlockSize);
+    for (int i = 0; i < row_size; ++i) {
+      int64_t* bmask_row = suppression_bmask_matrix + (row * kBlockSize + i) * num_blocks;
+      std::fill(bmask_row, bmask_row + row, 0);
+    }
+    for (int col = row; col < num_blocks; ++col) {
+      const int col_size = std::min(num_boxes - col * kBlockSize, kBlockSize);
+      const T* block_boxes = boxes + col * kBlockSize * 4;
+      for (int i = 0; i < row_size; ++i) {
+        const int cur_box_idx = row * kBlockSize + i;
+        const T* cur_box_ptr = boxes + cur_box_idx * 4;
+        uint64_t bits = 0;
+        const int start = row == col ? i + 1 : 0;
+        for (int j = start; j < col_size; ++j) {
+          if (IoU(cur_box_ptr, block_boxes + j * 4) > iou_threshold) { bits |= 1ULL << j; }
+        }
+        suppression_bmask_matrix[cur_box_idx * num_blocks + col] = static_cast<int64_t>(bits);
+      }
+    }
+  }
+}
+
+void ScanSuppression(int num_boxes, int num_blocks, int num_keep,
+                     const int64_t* suppression_bmask, int8_t* keep_mask) {
+  std::vector<uint64_t> remv(num_blocks, 0);
+  for (int i = 0; i < num_boxes && num_keep > 0; ++i) {
+    const int block_n = i / kBlockSize;
+    const int block_i = i % kBlockSize;
+    if (remv[block_n] & (1ULL << block_i)) { continue; }
+    keep_mask[i] = 1;
+    num_keep -= 1;
+    const int64_t* bmask_row = suppression_bmask + i * num_blocks;
+    for (int b = block_n; b < num_blocks; ++b) { remv[b] |= static_cast<uint64_t>(bmask_row[b]); }
+  }
+}
+
+}  // namespace
+
+template<typename T>
+class NmsCpuKernel final : public user_op::OpKernel {
+ public:
+  NmsCpuKernel() = default;
+  ~NmsCpuKernel() = default;
+
+ private:
+  void Compute(user_op::KernelComputeContext* ctx) const override {
+    const user_op::Tensor* boxes_blob = ctx->Tensor4ArgNameAndIndex("in", 0);
+    user_op::Tensor* keep_blob = ctx->Tensor4ArgNameAndIndex("out", 0);
+    user_op::Tensor* tmp_blob = ctx->Tensor4ArgNameAndIndex("tmp_buffer", 0);
+    const T* boxes = boxes_blob->dptr<T>();
+    int8_t* keep = keep_blob->mut_dptr<int8_t>();
+    int64_t* suppression_mask = tmp_blob->mut_dptr<int64_t>();
+
+    const int num_boxes = boxes_blob->shape().At(0);
+    int num_keep = ctx->Attr<int>("keep_n");
+    if (num_keep <= 0 || num_keep > num_boxes) { num_keep = num_boxes; }
+    const int num_blocks = CeilDiv<int>(num_boxes, kBlockSize);
+    std::memset(keep, 0, num_boxes * sizeof(int8_t));
+
+    CalcSuppressionBitmaskMatrix<T>(num_boxes, ctx->Attr<float>("iou_threshold"), boxes,
+                                    suppression_mask);
+    ScanSuppression(num_boxes, num_blocks, num_keep, suppression_mask, keep);
+  }
+  bool AlwaysComputeWhenAllOutputsEmpty() const override { return false; }
+};
+
+#define REGISTER_NMS_CPU_KERNEL(dtype)                                                 \
+  REGISTER_USER_KERNEL("nms")                                                          \
+      .SetCreateFn<NmsCpuKernel<dtype>>()                                              \
+      .SetIsMatchedHob((user_op::HobDeviceTag() == "cpu")                              \
+                       & (user_op::HobDataType("out", 0) == DataType::kInt8)           \
+                       & (user_op::HobDataType("in", 0) == GetDataType<dtype>::value)) \
+      .SetInferTmpSizeFn([](user_op::InferContext* ctx) {                              \
+        Shape* in_shape = ctx->Shape4ArgNameAndIndex("in", 0);                         \
+        int64_t num_boxes = in_shape->At(0);                                           \
+        int64_t blocks = CeilDiv<int64_t>(num_boxes, kBlockSize);                      \
+        return num_boxes * blocks * sizeof(int64_t);                                   \
+      });
+
+REGISTER_NMS_CPU_KERNEL(float)
+REGISTER_NMS_CPU_KERNEL(double)
+
 }  // namespace oneflow
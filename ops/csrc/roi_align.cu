@@ -274,10 +274,12 @@ class RoIAlignGradKernel final : public user_op::OpKernel {
 
 REGISTER_USER_KERNEL("roi_align")
     .SetCreateFn<RoIAlignKernel<float>>()
-    .SetIsMatchedHob(user_op::HobTrue());
+    .SetIsMatchedHob((user_op::HobDeviceTag() == "gpu")
+                     & (user_op::HobDataType("y", 0) == DataType::kFloat));
 
 REGISTER_USER_KERNEL("roi_align_grad")
     .SetCreateFn<RoIAlignGradKernel<float>>()
-    .SetIsMatchedHob(user_op::HobTrue());
+    .SetIsMatchedHob((user_op::HobDeviceTag() == "gpu")
+                     & (user_op::HobDataType("dx", 0) == DataType::kFloat));
 
 }  // namespace oneflow
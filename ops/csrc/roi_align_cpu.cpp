@@ -0,0 +1,315 @@
+#include <algorithm>
+#include <cmath>
+#include <cstring>
+#include <vector>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+#include "oneflow/core/framework/framework.h"
+
+namespace oneflow {
+
+namespace {
+
+int32_t MaxThreadsNum() {
+#ifdef _OPENMP
+  return omp_get_max_threads();
+#else
+  return 1;
+#endif
+}
+
+template<typename T>
+struct RoIBinGeometry {
+  int64_t n;
+  T roi_start_h;
+  T roi_start_w;
+  T bin_height;
+  T bin_width;
+  int32_t bin_grid_height;
+  int32_t bin_grid_width;
+  T count;
+};
+
+// Positions and weights of the four pixels a sampling point is interpolated from.
+template<typename T>
+struct BilinearPreCalc {
+  int64_t pos[4];
+  T w[4];
+};
+
+template<typename T>
+RoIBinGeometry<T> GetRoIBinGeometry(const T* roi, const T spatial_scale,
+                                    const int32_t sampling_ratio, const int64_t pooled_height,
+                                    const int64_t pooled_width, const bool aligned) {
+  RoIBinGeometry<T> geo;
+  geo.n = static_cast<int64_t>(roi[0]);
+  const T align_offset = aligned ? static_cast<T>(0.5) : static_cast<T>(0.f);
+  geo.roi_start_w = roi[1] * spatial_scale - align_offset;
+  geo.roi_start_h = roi[2] * spatial_scale - align_offset;
+  const T roi_end_w = roi[3] * spatial_scale - align_offset;
+  const T roi_end_h = roi[4] * spatial_scale - align_offset;
+  T roi_height = roi_end_h - geo.roi_start_h;
+  T roi_width = roi_end_w - geo.roi_start_w;
+  // aligned == false is for compatibility. the argument "aligned" doesn't
+  // have the semantic of determining minimum roi size
+  if (aligned == false) {
+    roi_height = std::max(roi_height, static_cast<T>(1.0));
+    roi_width = std::max(roi_width, static_cast<T>(1.0));
+  }
+  geo.bin_height = static_cast<T>(roi_height) / static_cast<T>(pooled_height);
+  geo.bin_width = static_cast<T>(roi_width) / static_cast<T>(pooled_width);
+  geo.bin_grid_height =
+      (sampling_ratio > 0) ? sampling_ratio : std::ceil(roi_height / pooled_height);
+  geo.bin_grid_width = (sampling_ratio > 0) ? sampling_ratio : std::ceil(roi_width / pooled_width);
+  geo.count = std::max(geo.bin_grid_height * geo.bin_grid_width, 1);
+  return geo;
+}
+
+// Same interpolation as BilinearInterpolate in roi_align.cu, computed once per sampling point of
+// a RoI and then reused for every channel.
+template<typename T>
+int64_t NumSamplingPoints(const RoIBinGeometry<T>& geo, const int64_t pooled_height,
+                          const int64_t pooled_width) {
+  return pooled_height * pooled_width * geo.bin_grid_height * geo.bin_grid_width;
+}
+
+// Writes NumSamplingPoints(geo, ...) entries to pre_calc.
+template<typename T>
+void PreCalcBilinear(const RoIBinGeometry<T>& geo, const int64_t height, const int64_t width,
+                     const int64_t pooled_height, const int64_t pooled_width,
+                     BilinearPreCalc<T>* pre_calc) {
+  int64_t idx = 0;
+  FOR_RANGE(int64_t, h, 0, pooled_height) {
+    FOR_RANGE(int64_t, w, 0, pooled_width) {
+      FOR_RANGE(int64_t, grid_i, 0, geo.bin_grid_height) {
+        // + .5f for center position
+        T y = geo.roi_start_h + h * geo.bin_height
+              + static_cast<T>(grid_i + 0.5f) * geo.bin_height
+                    / static_cast<T>(geo.bin_grid_height);
+        FOR_RANGE(int64_t, grid_j, 0, geo.bin_grid_width) {
+          T x = geo.roi_start_w + w * geo.bin_width
+                + static_cast<T>(grid_j + 0.5f) * geo.bin_width
+                      / static_cast<T>(geo.bin_grid_width);
+          BilinearPreCalc<T>& pc = pre_calc[idx++];
+          if (y < -1.0 || y > height || x < -1.0 || x > width) {
+            std::fill(pc.pos, pc.pos + 4, 0);
+            std::fill(pc.w, pc.w + 4, static_cast<T>(0));
+            continue;
+          }
+          T yy = y <= 0 ? 0 : y;
+          T xx = x <= 0 ? 0 : x;
+          int64_t y_low = static_cast<int64_t>(yy);
+          int64_t x_low = static_cast<int64_t>(xx);
+          int64_t y_high = 0;
+          int64_t x_high = 0;
+          if (y_low >= height - 1) {
+            y_low = height - 1;
+            y_high = y_low;
+            yy = static_cast<T>(y_low);
+          } else {
+            y_high = y_low + 1;
+          }
+          if (x_low >= width - 1) {
+            x_low = width - 1;
+            x_high = x_low;
+            xx = static_cast<T>(x_low);
+          } else {
+            x_high = x_low + 1;
+          }
+          const T ly = yy - y_low;
+          const T lx = xx - x_low;
+          const T hy = 1.f - ly;
+          const T hx = 1.f - lx;
+          pc.pos[0] = y_low * width + x_low;
+          pc.pos[1] = y_low * width + x_high;
+          pc.pos[2] = y_high * width + x_low;
+          pc.pos[3] = y_high * width + x_high;
+          pc.w[0] = hy * hx;
+          pc.w[1] = hy * lx;
+          pc.w[2] = ly * hx;
+          pc.w[3] = ly * lx;
+        }
+      }
+    }
+  }
+}
+
+template<typename T>
+void RoiAlignForward(const int64_t num_rois, const T* in_dptr, const T* rois_dptr,
+                     const T spatial_scale, const int32_t sampling_ratio,
+                     const int64_t channel_num, const int64_t height, const int64_t width,
+                     const int64_t pooled_height, const int64_t pooled_width, const bool aligned,
+                     T* out_dptr) {
+  // Work is split over (roi, channel block). Blocks are as large as the thread count allows so
+  // the interpolation table of a RoI is shared by as many channels as possible.
+  const int64_t max_tasks = 4 * static_cast<int64_t>(MaxThreadsNum());
+  const int64_t channel_blocks =
+      std::min(channel_num, std::max<int64_t>(1, (max_tasks + num_rois - 1) / num_rois));
+  const int64_t channels_per_block = (channel_num + channel_blocks - 1) / channel_blocks;
+  const int64_t pooled_area = pooled_height * pooled_width;
+#pragma omp parallel for schedule(dynamic)
+  for (int64_t task = 0; task < num_rois * channel_blocks; ++task) {
+    const int64_t r = task / channel_blocks;
+    const int64_t c_begin = (task % channel_blocks) * channels_per_block;
+    const int64_t c_end = std::min(c_begin + channels_per_block, channel_num);
+    const RoIBinGeometry<T> geo = GetRoIBinGeometry(rois_dptr + r * 5, spatial_scale,
+                                                    sampling_ratio, pooled_height, pooled_width,
+                                                    aligned);
+    std::vector<BilinearPreCalc<T>> pre_calc(
+        NumSamplingPoints(geo, pooled_height, pooled_width));
+    PreCalcBilinear(geo, height, width, pooled_height, pooled_width, pre_calc.data());
+    const int64_t samples_per_bin = geo.bin_grid_height * geo.bin_grid_width;
+    FOR_RANGE(int64_t, c, c_begin, c_end) {
+      const T* channel_dptr = in_dptr + (geo.n * channel_num + c) * height * width;
+      T* channel_out_dptr = out_dptr + (r * channel_num + c) * pooled_area;
+      const BilinearPreCalc<T>* pc = pre_calc.data();
+      FOR_RANGE(int64_t, bin, 0, pooled_area) {
+        T out_val = 0.0;
+        FOR_RANGE(int64_t, s, 0, samples_per_bin) {
+          out_val += pc->w[0] * channel_dptr[pc->pos[0]] + pc->w[1] * channel_dptr[pc->pos[1]]
+                     + pc->w[2] * channel_dptr[pc->pos[2]] + pc->w[3] * channel_dptr[pc->pos[3]];
+          ++pc;
+        }
+        channel_out_dptr[bin] = out_val / geo.count;
+      }
+    }
+  }
+}
+
+template<typename T>
+void RoiAlignBackward(const int64_t num_rois, const T* out_diff_dptr, const T* rois_dptr,
+                      const T spatial_scale, const int32_t sampling_ratio,
+                      const int64_t channel_num, const int64_t height, const int64_t width,
+                      const int64_t pooled_height, const int64_t pooled_width, const bool aligned,
+                      T* in_diff_dptr) {
+  // Bound on the interpolation tables kept at once, adaptive sampling of large RoIs can need
+  // thousands of points per bin.
+  constexpr int64_t kMaxPreCalcEntries = 1 << 20;
+  std::vector<RoIBinGeometry<T>> geos(num_rois);
+  std::vector<int64_t> pre_calc_offsets(num_rois + 1, 0);
+  FOR_RANGE(int64_t, r, 0, num_rois) {
+    geos[r] = GetRoIBinGeometry(rois_dptr + r * 5, spatial_scale, sampling_ratio, pooled_height,
+                                pooled_width, aligned);
+    pre_calc_offsets[r + 1] =
+        pre_calc_offsets[r] + NumSamplingPoints(geos[r], pooled_height, pooled_width);
+  }
+  // RoIs of the same image scatter into the same pixels, so every task owns a block of channels
+  // and walks all RoIs; no atomics are needed.
+  const int64_t channel_blocks = std::min<int64_t>(channel_num, 4 * MaxThreadsNum());
+  const int64_t channels_per_block = (channel_num + channel_blocks - 1) / channel_blocks;
+  const int64_t pooled_area = pooled_height * pooled_width;
+  std::vector<BilinearPreCalc<T>> pre_calc;
+  int64_t r_begin = 0;
+  while (r_begin < num_rois) {
+    // The tables of a group of RoIs are computed once, in parallel, and then shared by all
+    // channel blocks.
+    int64_t r_end = r_begin + 1;
+    while (r_end < num_rois
+           && pre_calc_offsets[r_end + 1] - pre_calc_offsets[r_begin] <= kMaxPreCalcEntries) {
+      ++r_end;
+    }
+    const int64_t group_offset = pre_calc_offsets[r_begin];
+    pre_calc.resize(pre_calc_offsets[r_end] - group_offset);
+#pragma omp parallel for schedule(dynamic)
+    for (int64_t r = r_begin; r < r_end; ++r) {
+      PreCalcBilinear(geos[r], height, width, pooled_height, pooled_width,
+                      pre_calc.data() + pre_calc_offsets[r] - group_offset);
+    }
+#pragma omp parallel for schedule(dynamic)
+    for (int64_t block = 0; block < channel_blocks; ++block) {
+      const int64_t c_begin = block * channels_per_block;
+      const int64_t c_end = std::min(c_begin + channels_per_block, channel_num);
+      FOR_RANGE(int64_t, r, r_begin, r_end) {
+        const RoIBinGeometry<T>& geo = geos[r];
+        const int64_t samples_per_bin = geo.bin_grid_height * geo.bin_grid_width;
+        FOR_RANGE(int64_t, c, c_begin, c_end) {
+          T* in_diff_channel_dptr = in_diff_dptr + (geo.n * channel_num + c) * height * width;
+          const T* channel_out_diff_dptr = out_diff_dptr + (r * channel_num + c) * pooled_area;
+          const BilinearPreCalc<T>* pc = pre_calc.data() + pre_calc_offsets[r] - group_offset;
+          FOR_RANGE(int64_t, bin, 0, pooled_area) {
+            const T bin_diff_avg = channel_out_diff_dptr[bin] / geo.count;
+            FOR_RANGE(int64_t, s, 0, samples_per_bin) {
+              FOR_RANGE(int32_t, k, 0, 4) {
+                in_diff_channel_dptr[pc->pos[k]] += bin_diff_avg * pc->w[k];
+              }
+              ++pc;
+            }
+          }
+        }
+      }
+    }
+    r_begin = r_end;
+  }
+}
+
+}  // namespace
+
+template<typename T>
+class RoIAlignCpuKernel final : public user_op::OpKernel {
+ public:
+  RoIAlignCpuKernel() = default;
+  ~RoIAlignCpuKernel() = default;
+
+ private:
+  void Compute(user_op::KernelComputeContext* ctx) const override {
+    const user_op::Tensor* x_blob = ctx->Tensor4ArgNameAndIndex("x", 0);
+    const user_op::Tensor* rois_blob = ctx->Tensor4ArgNameAndIndex("rois", 0);
+    user_op::Tensor* y_blob = ctx->Tensor4ArgNameAndIndex("y", 0);
+    const int32_t pooled_h = ctx->Attr<int32_t>("pooled_h");
+    const int32_t pooled_w = ctx->Attr<int32_t>("pooled_w");
+    const float spatial_scale = ctx->Attr<float>("spatial_scale");
+    const int32_t sampling_ratio = ctx->Attr<int32_t>("sampling_ratio");
+    const bool aligned = ctx->Attr<bool>("aligned");
+
+    RoiAlignForward<T>(rois_blob->shape().At(0), x_blob->dptr<T>(), rois_blob->dptr<T>(),
+                       spatial_scale, sampling_ratio, x_blob->shape().At(1),
+                       x_blob->shape().At(2), x_blob->shape().At(3), pooled_h, pooled_w, aligned,
+                       y_blob->mut_dptr<T>());
+  }
+  bool AlwaysComputeWhenAllOutputsEmpty() const override { return false; }
+};
+
+template<typename T>
+class RoIAlignGradCpuKernel final : public user_op::OpKernel {
+ public:
+  RoIAlignGradCpuKernel() = default;
+  ~RoIAlignGradCpuKernel() = default;
+
+ private:
+  void Compute(user_op::KernelComputeContext* ctx) const override {
+    user_op::Tensor* dx_blob = ctx->Tensor4ArgNameAndIndex("dx", 0);
+    if (dx_blob == nullptr) { return; }
+    std::memset(dx_blob->mut_dptr<T>(), 0, dx_blob->shape().elem_cnt() * sizeof(T));
+    const user_op::Tensor* dy_blob = ctx->Tensor4ArgNameAndIndex("dy", 0);
+    const user_op::Tensor* rois_blob = ctx->Tensor4ArgNameAndIndex("rois", 0);
+    const int32_t pooled_h = ctx->Attr<int32_t>("pooled_h");
+    const int32_t pooled_w = ctx->Attr<int32_t>("pooled_w");
+    const float spatial_scale = ctx->Attr<float>("spatial_scale");
+    const int32_t sampling_ratio = ctx->Attr<int32_t>("sampling_ratio");
+    const bool aligned = ctx->Attr<bool>("aligned");
+
+    if (dy_blob->shape().elem_cnt() > 0) {
+      RoiAlignBackward<T>(rois_blob->shape().At(0), dy_blob->dptr<T>(), rois_blob->dptr<T>(),
+                          spatial_scale, sampling_ratio, dx_blob->shape().At(1),
+                          dx_blob->shape().At(2), dx_blob->shape().At(3), pooled_h, pooled_w,
+                          aligned, dx_blob->mut_dptr<T>());
+    }
+  }
+  bool AlwaysComputeWhenAllOutputsEmpty() const override { return false; }
+};
+
+#define REGISTER_ROI_ALIGN_CPU_KERNEL(dtype)                                            \
+  REGISTER_USER_KERNEL("roi_align")                                                     \
+      .SetCreateFn<RoIAlignCpuKernel<dtype>>()                                          \
+      .SetIsMatchedHob((user_op::HobDeviceTag() == "cpu")                               \
+                       & (user_op::HobDataType("y", 0) == GetDataType<dtype>::value));  \
+  REGISTER_USER_KERNEL("roi_align_grad")                                                \
+      .SetCreateFn<RoIAlignGradCpuKernel<dtype>>()                                      \
+      .SetIsMatchedHob((user_op::HobDeviceTag() == "cpu")                               \
+                       & (user_op::HobDataType("dx", 0) == GetDataType<dtype>::value));
+
+REGISTER_ROI_ALIGN_CPU_KERNEL(float)
+REGISTER_ROI_ALIGN_CPU_KERNEL(double)
+
+}  // namespace oneflow
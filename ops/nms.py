@@ -3,17 +3,76 @@ import oneflow as flow_exp
 from oneflow import Tensor
 
 
-def nms(boxes: Tensor, scores: Tensor, iou_threshold: float) -> Tensor:
-    scores_inds = flow_exp.argsort(scores, dim=0, descending=True)
-    boxes = flow._C.gather(boxes, scores_inds, axis=0)
+def _nms_keep_mask(sorted_boxes: Tensor, iou_threshold: float, keep_n: int) -> Tensor:
     _nms_op = (
         flow_exp.builtin_op("nms")
         .Input("in")
         .Output("out")
         .Attr("iou_threshold", iou_threshold)
-        .Attr("keep_n", -1)
+        .Attr("keep_n", keep_n)
         .Build()
     )
-    keep = _nms_op(boxes)[0]
+    return _nms_op(sorted_boxes)[0]
+
+
+def nms(boxes: Tensor, scores: Tensor, iou_threshold: float) -> Tensor:
+    scores_inds = flow_exp.argsort(scores, dim=0, descending=True)
+    boxes = flow._C.gather(boxes, scores_inds, axis=0)
+    keep = _nms_keep_mask(boxes, iou_threshold, -1)
     index = flow_exp.squeeze(flow_exp.argwhere(keep), dim=[1])
     return flow._C.gather(scores_inds, index, axis=0)
+
+
+def batched_nms(
+    boxes: Tensor,
+    scores: Tensor,
+    idxs: Tensor,
+    iou_threshold: float,
+    pre_nms_top_n: int = -1,
+    post_nms_top_n: int = -1,
+    score_threshold: float = None,
+) -> Tensor:
+    """
+    Class-aware NMS in a single ``nms`` op call: boxes are shifted by a per-class
+    offset larger than any coordinate, so boxes of different classes never overlap.
+
+    Args:
+        boxes: (N, 4) boxes in ``(x1, y1, x2, y2)`` format.
+        scores: (N,) scores of the boxes.
+        idxs: (N,) class index of every box.
+        iou_threshold: boxes with IoU > iou_threshold are suppressed.
+        pre_nms_top_n: only the best ``pre_nms_top_n`` boxes go through NMS if > 0.
+        post_nms_top_n: at most ``post_nms_top_n`` boxes are kept if > 0.
+        score_threshold: boxes scoring at or below it are dropped before NMS.
+
+    Returns:
+        Indices of the kept boxes, sorted by decreasing score.
+    """
+    if boxes.shape[0] == 0:
+        return flow.zeros(0, dtype=flow.int64, device=boxes.device)
+
+    if score_threshold is not None:
+        candidates = flow_exp.squeeze(
+            flow_exp.argwhere(scores > score_threshold), dim=[1]
+        )
+        if candidates.shape[0] == 0:
+            return flow.zeros(0, dtype=flow.int64, device=boxes.device)
+        boxes = flow._C.gather(boxes, candidates, axis=0)
+        scores = flow._C.gather(scores, candidates, axis=0)
+        idxs = flow._C.gather(idxs, candidates, axis=0)
+
+    # Pre-filter with top-k so the quadratic IoU stage only sees the best boxes.
+    if 0 < pre_nms_top_n < scores.shape[0]:
+        order = flow.topk(scores, pre_nms_top_n)[1]
+    else:
+        order = flow_exp.argsort(scores, dim=0, descending=True)
+
+    offsets = idxs.to(boxes.dtype) * (boxes.max() + 1)
+    boxes_for_nms = boxes + offsets.unsqueeze(1)
+    boxes_for_nms = flow._C.gather(boxes_for_nms, order, axis=0)
+    keep = _nms_keep_mask(boxes_for_nms, iou_threshold, post_nms_top_n)
+    index = flow_exp.squeeze(flow_exp.argwhere(keep), dim=[1])
+    keep_inds = flow._C.gather(order, index, axis=0)
+    if score_threshold is not None:
+        keep_inds = flow._C.gather(candidates, keep_inds, axis=0)
+    return keep_inds
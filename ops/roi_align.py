@@ -1,3 +1,5 @@
+import math
+import numpy as np
 import oneflow as flow
 import oneflow.nn as nn
 from typing import List
@@ -31,3 +33,86 @@ class RoIAlign(nn.Module):
 
     def forward(self, input, rois):
         return self._roi_align_op(input, rois)[0]
+
+
+class MultiScaleRoIAlign(nn.Module):
+    """
+    RoIAlign over an FPN feature pyramid. Every RoI is pooled from the level picked by
+    its box area (Eq. 1 of the FPN paper, https://arxiv.org/abs/1612.03144); RoIs are
+    sorted by level so that each level is pooled with a single ``roi_align`` call, and
+    the results are gathered back into the input order.
+
+    Args:
+        output_size: (h, w) of the pooled output.
+        spatial_scales: scale of each feature map w.r.t. the image, finest level first,
+            e.g. ``[1 / 4, 1 / 8, 1 / 16, 1 / 32]``.
+        sampling_ratio, aligned: see :class:`RoIAlign`.
+        canonical_scale, canonical_level: a RoI of ``canonical_scale ** 2`` area is
+            mapped to ``canonical_level``.
+    """
+
+    def __init__(
+        self,
+        output_size: List[int],
+        spatial_scales: List[float],
+        sampling_ratio: int,
+        aligned: bool = False,
+        canonical_scale: int = 224,
+        canonical_level: int = 4,
+        eps: float = 1e-6,
+    ):
+        super().__init__()
+        self.output_size = output_size
+        self.spatial_scales = spatial_scales
+        self.level_poolers = nn.ModuleList(
+            [
+                RoIAlign(output_size, scale, sampling_ratio, aligned)
+                for scale in spatial_scales
+            ]
+        )
+        self.k_min = int(round(-math.log2(spatial_scales[0])))
+        self.k_max = int(round(-math.log2(spatial_scales[-1])))
+        assert self.k_max - self.k_min + 1 == len(spatial_scales)
+        self.canonical_scale = canonical_scale
+        self.canonical_level = canonical_level
+        self.eps = eps
+
+    def map_levels(self, rois):
+        """Index into ``spatial_scales`` of the level every RoI is pooled from."""
+        widths = rois[:, 3] - rois[:, 1]
+        heights = rois[:, 4] - rois[:, 2]
+        sizes = flow.sqrt(flow.clamp(widths * heights, min=0))
+        levels = flow.floor(
+            self.canonical_level
+            + flow.log(sizes / self.canonical_scale + self.eps) / math.log(2)
+        )
+        levels = flow.clamp(levels, min=self.k_min, max=self.k_max)
+        return (levels - self.k_min).to(flow.int64)
+
+    def forward(self, features: List[flow.Tensor], rois):
+        assert len(features) == len(self.level_poolers)
+        if rois.shape[0] == 0:
+            # no level gets any RoI, there is nothing to concatenate
+            return flow.zeros(
+                0,
+                features[0].shape[1],
+                *self.output_size,
+                dtype=features[0].dtype,
+                device=features[0].device,
+            )
+        if len(features) == 1:
+            return self.level_poolers[0](features[0], rois)
+
+        levels = self.map_levels(rois)
+        order = flow.argsort(levels, dim=0)
+        sorted_rois = flow._C.gather(rois, order, axis=0)
+        counts = np.bincount(levels.numpy(), minlength=len(features))
+
+        pooled = []
+        start = 0
+        for feature, pooler, count in zip(features, self.level_poolers, counts):
+            if count > 0:
+                pooled.append(pooler(feature, sorted_rois[start : start + count]))
+            start += count
+        pooled = flow.cat(pooled, dim=0)
+        return flow._C.gather(pooled, flow.argsort(order, dim=0), axis=0)
@@ -1,4 +1,6 @@
 import ctypes
+import os
+import time
 import unittest
 from collections import OrderedDict
 
@@ -6,7 +8,7 @@ import numpy as np
 
 import oneflow as flow
 from oneflow.test.modules.test_util import GenArgList
-from ops import nms, lib_path
+from ops import nms, batched_nms, lib_path
 
 p = ctypes.CDLL(lib_path())
 
@@ -53,6 +55,15 @@ def nms_np(boxes, scores, iou_threshold):
     return np.asarray(picked)
 
 
+def batched_nms_np(boxes, scores, idxs, iou_threshold):
+    keep = []
+    for class_id in np.unique(idxs):
+        inds = np.nonzero(idxs == class_id)[0]
+        keep.append(inds[nms_np(boxes[inds], scores[inds], iou_threshold)])
+    keep = np.concatenate(keep)
+    return keep[np.argsort(-scores[keep])]
+
+
 def create_tensors_with_iou(N, iou_thresh):
     boxes = np.random.rand(N, 4) * 100
     boxes[:, 2:] += boxes[:, :2]
@@ -74,14 +85,75 @@ def _test_nms(test_case, device):
     test_case.assertTrue(np.allclose(keep.numpy(), keep_np))
 
 
+def _test_batched_nms(test_case, device):
+    iou = 0.5
+    boxes, scores = create_tensors_with_iou(1000, iou)
+    idxs = np.random.randint(0, 5, size=1000)
+    keep_np = batched_nms_np(boxes, scores, idxs, iou)
+    keep = batched_nms(
+        flow.Tensor(boxes, dtype=flow.float32, device=flow.device(device)),
+        flow.Tensor(scores, dtype=flow.float32, device=flow.device(device)),
+        flow.tensor(idxs, dtype=flow.int64, device=flow.device(device)),
+        iou,
+    )
+    test_case.assertTrue(np.allclose(keep.numpy(), keep_np))
+
+    top_n = 300
+    top = np.argsort(-scores)[:top_n]
+    keep_np = top[batched_nms_np(boxes[top], scores[top], idxs[top], iou)][:50]
+    keep = batched_nms(
+        flow.Tensor(boxes, dtype=flow.float32, device=flow.device(device)),
+        flow.Tensor(scores, dtype=flow.float32, device=flow.device(device)),
+        flow.tensor(idxs, dtype=flow.int64, device=flow.device(device)),
+        iou,
+        pre_nms_top_n=top_n,
+        post_nms_top_n=50,
+    )
+    test_case.assertTrue(np.allclose(keep.numpy(), keep_np))
+
+
+def _time_it(fn, repeat=3):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def _benchmark_nms(test_case, num_boxes_list=(1000, 5000, 10000, 50000, 100000)):
+    iou = 0.5
+    print("\n{:>8} {:>12} {:>12} {:>12}".format("N", "cpu ms", "cuda ms", "numpy ms"))
+    for num_boxes in num_boxes_list:
+        boxes, scores = create_tensors_with_iou(num_boxes, iou)
+        times = []
+        for device in ["cpu", "cuda"]:
+            boxes_t = flow.Tensor(boxes, dtype=flow.float32, device=flow.device(device))
+            scores_t = flow.Tensor(
+                scores, dtype=flow.float32, device=flow.device(device)
+            )
+            times.append(_time_it(lambda: nms(boxes_t, scores_t, iou).numpy()))
+        # the greedy NumPy reference takes minutes beyond 10k boxes
+        if num_boxes <= 10000:
+            times.append(_time_it(lambda: nms_np(boxes, scores, iou), repeat=1))
+        else:
+            times.append(float("nan"))
+        print("{:>8} {:>12.2f} {:>12.2f} {:>12.2f}".format(num_boxes, *times))
+
+
 class TestNMS(flow.unittest.TestCase):
     def test_nms(test_case):
         arg_dict = OrderedDict()
-        arg_dict["test_fun"] = [_test_nms]
-        arg_dict["device"] = ["cuda"]
+        arg_dict["test_fun"] = [_test_nms, _test_batched_nms]
+        arg_dict["device"] = ["cuda", "cpu"]
         for arg in GenArgList(arg_dict):
             arg[0](test_case, *arg[1:])
 
+    @unittest.skipUnless(
+        os.getenv("ONEFLOW_OPS_BENCHMARK"), "set ONEFLOW_OPS_BENCHMARK=1"
+    )
+    def test_nms_benchmark(test_case):
+        _benchmark_nms(test_case)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,4 +1,6 @@
 import ctypes
+import os
+import time
 import unittest
 from collections import OrderedDict
 
@@ -7,7 +9,7 @@ import math
 
 import oneflow as flow
 from oneflow.test.modules.test_util import GenArgList
-from ops import RoIAlign, lib_path
+from ops import RoIAlign, MultiScaleRoIAlign, lib_path
 
 p = ctypes.CDLL(lib_path())
 
@@ -515,14 +517,120 @@ def _test_roi_align_backward(test_case, device):
     )
 
 
+def _test_multi_scale_roi_align(test_case, device):
+    scales = [1 / 4, 1 / 8, 1 / 16, 1 / 32]
+    features_np = [np.random.randn(2, 3, int(256 * s), int(256 * s)) for s in scales]
+    rois_np = _random_rois(100, 2, 256).astype(np.float32)
+    areas = (rois_np[:, 3] - rois_np[:, 1]) * (rois_np[:, 4] - rois_np[:, 2])
+    levels = np.floor(4 + np.log2(np.sqrt(areas) / 224 + 1e-6))
+    levels = np.clip(levels, 2, 5).astype(np.int64) - 2
+
+    np_out = np.zeros((rois_np.shape[0], 3, 7, 7), dtype=np.float32)
+    for level, (feature, scale) in enumerate(zip(features_np, scales)):
+        mask = levels == level
+        if mask.any():
+            np_out[mask] = roi_align_np(feature, rois_np[mask], 7, 7, scale, 2, True)
+
+    features = [
+        flow.Tensor(f, dtype=flow.float32, device=flow.device(device))
+        for f in features_np
+    ]
+    rois = flow.Tensor(rois_np, dtype=flow.float32, device=flow.device(device))
+    pooler = MultiScaleRoIAlign((7, 7), scales, 2, True)
+    test_case.assertTrue(np.array_equal(pooler.map_levels(rois).numpy(), levels))
+    of_out = pooler(features, rois)
+    test_case.assertTrue(np.allclose(of_out.numpy(), np_out, rtol=1e-4, atol=1e-4))
+
+
+def _test_multi_scale_roi_align_no_rois(test_case, device):
+    scales = [1 / 4, 1 / 8, 1 / 16, 1 / 32]
+    features = [
+        flow.Tensor(
+            np.random.randn(2, 3, int(256 * s), int(256 * s)),
+            dtype=flow.float32,
+            device=flow.device(device),
+        )
+        for s in scales
+    ]
+    rois = flow.Tensor(np.zeros((0, 5)), dtype=flow.float32, device=flow.device(device))
+    pooler = MultiScaleRoIAlign((7, 7), scales, 2, True)
+    of_out = pooler(features, rois)
+    test_case.assertEqual(tuple(of_out.shape), (0, 3, 7, 7))
+
+
+def _random_rois(num_rois, num_images, size):
+    boxes = np.random.uniform(low=0, high=size, size=(num_rois, 4))
+    boxes = np.hstack(
+        (np.minimum(boxes[:, :2], boxes[:, 2:]), np.maximum(boxes[:, :2], boxes[:, 2:]))
+    )
+    img_idx = np.random.randint(low=0, high=num_images, size=(num_rois, 1))
+    return np.hstack((img_idx, boxes))
+
+
+def _benchmark_roi_align(
+    test_case, num_rois_list=(100, 1000, 5000), sampling_ratios=(0, 2, 4)
+):
+    input_np = np.random.randn(2, 256, 64, 64)
+    print(
+        "\n{:>8} {:>8} {:>8} {:>14} {:>14}".format(
+            "rois", "ratio", "device", "fwd rois/s", "fwd+bwd rois/s"
+        )
+    )
+    for num_rois in num_rois_list:
+        rois_np = _random_rois(num_rois, 2, 64 * 4)
+        for sampling_ratio in sampling_ratios:
+            for device in ["cpu", "cuda"]:
+                input = flow.Tensor(
+                    input_np,
+                    dtype=flow.float32,
+                    device=flow.device(device),
+                    requires_grad=True,
+                )
+                rois = flow.Tensor(
+                    rois_np, dtype=flow.float32, device=flow.device(device)
+                )
+                roi_align_module = RoIAlign((7, 7), 0.25, sampling_ratio, True)
+                roi_align_module(input, rois).numpy()
+
+                start = time.perf_counter()
+                roi_align_module(input, rois).numpy()
+                forward_time = time.perf_counter() - start
+
+                start = time.perf_counter()
+                out = roi_align_module(input, rois)
+                out.sum().backward()
+                input.grad.numpy()
+                backward_time = time.perf_counter() - start
+                print(
+                    "{:>8} {:>8} {:>8} {:>14.0f} {:>14.0f}".format(
+                        num_rois,
+                        sampling_ratio,
+                        device,
+                        num_rois / forward_time,
+                        num_rois / backward_time,
+                    )
+                )
+
+
 class TestRoIAlign(flow.unittest.TestCase):
     def test_roi_align(test_case):
         arg_dict = OrderedDict()
-        arg_dict["test_fun"] = [_test_roi_align]
-        arg_dict["device"] = ["cuda"]
+        arg_dict["test_fun"] = [
+            _test_roi_align,
+            _test_roi_align_backward,
+            _test_multi_scale_roi_align,
+            _test_multi_scale_roi_align_no_rois,
+        ]
+        arg_dict["device"] = ["cuda", "cpu"]
         for arg in GenArgList(arg_dict):
             arg[0](test_case, *arg[1:])
 
+    @unittest.skipUnless(
+        os.getenv("ONEFLOW_OPS_BENCHMARK"), "set ONEFLOW_OPS_BENCHMARK=1"
+    )
+    def test_roi_align_benchmark(test_case):
+        _benchmark_roi_align(test_case)
+
 
 if __name__ == "__main__":
     unittest.main()